@@ -0,0 +1,166 @@
+"""Admission control for API requests.
+
+Requests are split into route classes (reads and writes). Each class has its own
+concurrency limit with a bounded FIFO wait queue, so a burst of writes queues
+behind the write limit instead of slowing down the reads the gallery depends
+on. A request that finds the queue full, or waits in it too long, is shed at
+once with 503 and Retry-After. Optional per-client token buckets answer clients
+that exceed their rate with 429.
+"""
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Optional, Tuple
+
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+class ConcurrencyLimiter:
+    """At most `concurrency` requests at once; up to `queue_size` more wait in arrival order"""
+
+    def __init__(self, concurrency: int, queue_size: int, queue_timeout: float):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.stats = {"admitted": 0, "queued": 0, "shed_queue_full": 0, "shed_queue_timeout": 0,
+                      "queue_wait_seconds": 0.0}
+
+    async def acquire(self) -> bool:
+        """Take a slot, waiting in the queue if need be; False means the request should be shed"""
+        if self.in_flight < self.concurrency and not self.waiters:
+            self.in_flight += 1
+            self.stats["admitted"] += 1
+            return True
+        if len(self.waiters) >= self.queue_size:
+            self.stats["shed_queue_full"] += 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        self.stats["queued"] += 1
+        started = time.perf_counter()
+        try:
+            async with asyncio.timeout(self.queue_timeout):
+                await waiter
+        except (TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # A slot was handed over just as the wait ended; pass it on
+                self.release()
+            elif waiter in self.waiters:
+                self.waiters.remove(waiter)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.stats["shed_queue_timeout"] += 1
+            return False
+        finally:
+            self.stats["queue_wait_seconds"] += time.perf_counter() - started
+        self.stats["admitted"] += 1
+        return True
+
+    def release(self):
+        # The slot goes straight to the next waiter, so in_flight only drops when nobody waits
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+class RateLimiter:
+    """Per-client token buckets refilling at `rate` per second up to `burst`; a rate of 0 disables it"""
+
+    def __init__(self, rate: float, burst: int, max_clients: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self.stats = {"rate_limited": 0}
+
+    def retry_after(self, client: str) -> float:
+        """Take a token for client; 0.0 if one was available, else seconds until the next one"""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        tokens, updated = self.buckets.pop(client, (float(self.burst), now))
+        tokens = min(float(self.burst), tokens + (now - updated) * self.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+            self.stats["rate_limited"] += 1
+        self.buckets[client] = (tokens, now)
+        # Forgetting the least recently seen client only ever refills its bucket early
+        while len(self.buckets) > self.max_clients:
+            self.buckets.popitem(last=False)
+        return wait
+
+class RouteClass:
+    def __init__(self, limiter: ConcurrencyLimiter, rate_limiter: RateLimiter):
+        self.limiter = limiter
+        self.rate_limiter = rate_limiter
+
+class AdmissionController:
+    """Route classes by name; reads are GET and HEAD, everything else is a write"""
+
+    def __init__(self, classes: Dict[str, RouteClass], retry_after: int = 1,
+                 client_header: Optional[str] = None):
+        self.classes = classes
+        self.retry_after = retry_after
+        self.client_header = client_header.lower() if client_header else None
+
+    def route_class(self, method: str) -> str:
+        return "read" if method in ("GET", "HEAD") else "write"
+
+    def client_key(self, scope) -> str:
+        if self.client_header:
+            # e.g. X-Forwarded-For from a trusted proxy: the first hop is the client
+            forwarded = Headers(scope=scope).get(self.client_header)
+            if forwarded:
+                return forwarded.split(",")[0].strip()
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+class AdmissionMiddleware:
+    """ASGI middleware applying an AdmissionController to requests under a path prefix
+
+    Paths in exempt skip the concurrency limit (long-lived streams would hold a
+    slot for as long as they stay open) but are still rate limited.
+    """
+
+    def __init__(self, app, controller: AdmissionController, prefix: str = "/", exempt=()):
+        self.app = app
+        self.controller = controller
+        self.prefix = prefix
+        self.exempt = frozenset(exempt)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or not scope["path"].startswith(self.prefix):
+            return await self.app(scope, receive, send)
+
+        route_class = self.controller.classes[self.controller.route_class(scope["method"])]
+        wait = route_class.rate_limiter.retry_after(self.controller.client_key(scope))
+        if wait:
+            response = JSONResponse(
+                {"detail": "Too many requests, slow down"},
+                status_code=429,
+                headers={"Retry-After": str(math.ceil(wait))}
+            )
+            return await response(scope, receive, send)
+        if scope["path"] in self.exempt:
+            return await self.app(scope, receive, send)
+
+        if not await route_class.limiter.acquire():
+            response = JSONResponse(
+                {"detail": "Server is busy, try again shortly"},
+                status_code=503,
+                headers={"Retry-After": str(self.controller.retry_after)}
+            )
+            return await response(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route_class.limiter.release()
@@ -0,0 +1,178 @@
+"""Text analytics for stories.
+
+The scoring functions are pure and CPU-bound, so StoryAnalyzer runs them in a
+process (or thread) pool and server.py only ever awaits the result. Results are
+keyed by a hash of the story text, so re-submitting or re-saving unchanged text
+never recomputes.
+"""
+import asyncio
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import re
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+# Bump when the scoring changes so the backfill recomputes stored analytics
+ANALYTICS_VERSION = 1
+
+SECTIONS = ("introduction", "middle", "conclusion")
+
+# Share of the words each section should carry in a well-shaped story
+SECTION_TARGETS = {"introduction": 0.25, "middle": 0.5, "conclusion": 0.25}
+
+WORD_PATTERN = re.compile(r"[A-Za-z0-9]+(?:['’][A-Za-z]+)*")
+SENTENCE_END_PATTERN = re.compile(r"[.!?]+(?:[\"'’”)\]]*)(?=\s|$)")
+VOWEL_GROUP_PATTERN = re.compile(r"[aeiouy]+")
+
+def content_hash(doc: dict) -> str:
+    """Identity of the analyzed text; unchanged sections hash the same"""
+    payload = json.dumps([ANALYTICS_VERSION] + [doc.get(section, "") for section in SECTIONS])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def count_syllables(word: str) -> int:
+    word = word.lower()
+    syllables = len(VOWEL_GROUP_PATTERN.findall(word))
+    if word.endswith("e") and not word.endswith(("le", "ee")) and syllables > 1:
+        syllables -= 1
+    return max(syllables, 1)
+
+def count_sentences(text: str) -> int:
+    if not text.strip():
+        return 0
+    # Text that trails off without punctuation still ends a sentence
+    return len(SENTENCE_END_PATTERN.findall(text)) + (0 if text.rstrip()[-1] in ".!?\"'’”)]" else 1)
+
+def analyze_sections(sections: Dict[str, str]) -> dict:
+    """Counts, vocabulary richness, readability and section balance for one story"""
+    section_stats = {}
+    words: List[str] = []
+    sentences = 0
+    for section in SECTIONS:
+        text = sections.get(section) or ""
+        section_words = WORD_PATTERN.findall(text)
+        section_sentences = count_sentences(text)
+        section_stats[section] = {"words": len(section_words), "sentences": section_sentences}
+        words.extend(section_words)
+        sentences += section_sentences
+
+    word_count = len(words)
+    distinct = {word.lower() for word in words}
+    syllables = sum(count_syllables(word) for word in words)
+    if word_count and sentences:
+        words_per_sentence = word_count / sentences
+        syllables_per_word = syllables / word_count
+        reading_ease = 206.835 - 1.015 * words_per_sentence - 84.6 * syllables_per_word
+        grade_level = 0.39 * words_per_sentence + 11.8 * syllables_per_word - 15.59
+    else:
+        reading_ease = grade_level = 0.0
+
+    shares = {
+        section: section_stats[section]["words"] / word_count if word_count else 0.0
+        for section in SECTIONS
+    }
+    # 1.0 when the sections match SECTION_TARGETS exactly, 0.0 when all words sit in one section
+    deviation = sum(abs(shares[section] - SECTION_TARGETS[section]) for section in SECTIONS)
+    worst = max(2 * (1 - target) for target in SECTION_TARGETS.values())
+
+    return {
+        "version": ANALYTICS_VERSION,
+        "word_count": word_count,
+        "sentence_count": sentences,
+        "sections": section_stats,
+        "unique_words": len(distinct),
+        # Type-token ratio, plus a length-corrected variant that stays comparable across story lengths
+        "vocabulary_richness": round(len(distinct) / word_count, 4) if word_count else 0.0,
+        "root_ttr": round(len(distinct) / word_count ** 0.5, 4) if word_count else 0.0,
+        "avg_sentence_length": round(word_count / sentences, 2) if sentences else 0.0,
+        "reading_ease": round(reading_ease, 2),
+        "grade_level": round(max(grade_level, 0.0), 2),
+        "section_shares": {section: round(share, 4) for section, share in shares.items()},
+        "section_balance": round(max(0.0, 1 - deviation / worst), 4) if word_count else 0.0
+    }
+
+def analyze_batch(batch: List[Dict[str, str]]) -> List[dict]:
+    """One pool round trip for many stories; used by imports and the backfill"""
+    return [analyze_sections(sections) for sections in batch]
+
+class StoryAnalyzer:
+    """Runs analyze_sections off the event loop, memoized by content hash"""
+
+    def __init__(self, executor: str = "process", workers: Optional[int] = None, cache_size: int = 4096):
+        self.executor_kind = executor
+        self.workers = workers
+        self.cache_size = cache_size
+        self.cache: "OrderedDict[str, dict]" = OrderedDict()
+        self.executor: Optional[Executor] = None
+        self.stats = {"computed": 0, "cache_hits": 0}
+
+    def _executor(self) -> Optional[Executor]:
+        if self.executor is None:
+            if self.executor_kind == "process":
+                # By now the event loop and Motor's threads are running, and a forked child
+                # could inherit a lock one of them held; start workers from a clean process
+                start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context(start_method)
+                )
+            elif self.executor_kind == "thread":
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="analytics")
+        # "inline" keeps everything on the calling thread; only meant for benchmarks
+        return self.executor
+
+    def _remember(self, key: str, analytics: dict):
+        if self.cache_size <= 0:
+            return
+        self.cache[key] = analytics
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    async def analyze(self, doc: dict) -> dict:
+        return (await self.analyze_many([doc]))[0]
+
+    async def analyze_many(self, docs: List[dict]) -> List[dict]:
+        """Analytics for each doc, in order; only uncached texts reach the pool"""
+        keys = [content_hash(doc) for doc in docs]
+        results: List[Optional[dict]] = []
+        pending: Dict[str, Dict[str, str]] = {}
+        for key, doc in zip(keys, docs):
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.cache.move_to_end(key)
+                self.stats["cache_hits"] += 1
+            elif key not in pending:
+                pending[key] = {section: doc.get(section, "") for section in SECTIONS}
+            results.append(cached)
+
+        if pending:
+            executor = self._executor()
+            texts = list(pending.values())
+            if executor is None:
+                computed = analyze_batch(texts)
+            else:
+                # Spread large batches over every worker instead of handing them all to one
+                size = max(1, math.ceil(len(texts) / (self.workers or os.cpu_count() or 1)))
+                loop = asyncio.get_running_loop()
+                chunks = await asyncio.gather(*(
+                    loop.run_in_executor(executor, analyze_batch, texts[i:i + size])
+                    for i in range(0, len(texts), size)
+                ))
+                computed = [analytics for chunk in chunks for analytics in chunk]
+            self.stats["computed"] += len(computed)
+            fresh = dict(zip(pending, computed))
+            for key, analytics in fresh.items():
+                self._remember(key, analytics)
+            results = [result if result is not None else fresh[key] for key, result in zip(keys, results)]
+
+        return [{**analytics, "content_hash": key} for key, analytics in zip(keys, results)]
+
+    def close(self):
+        if self.executor is not None:
+            # Waiting lets the pool's manager thread close its pipes before the interpreter's atexit
+            # hook writes to them; queued batches are cancelled, so only running ones are awaited
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
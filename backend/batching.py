@@ -0,0 +1,117 @@
+"""Group commit for bursts of writes.
+
+WriteBatcher coalesces concurrent submissions into one flush, so a classroom
+saving at the same moment costs one insert per store rather than one per story.
+WriteFence lets any number of writes run together while keeping them out of
+the way of a job that needs a consistent view, like progress reconciliation.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, List, Optional, Set, Tuple
+
+class WriteBatcher:
+    """Coalesces concurrent submissions into one flush call
+
+    Items submitted within max_delay seconds of the first pending one, up to
+    max_batch of them, are flushed together. flush returns one result per item,
+    in order; each submitter gets its own result back, or its own exception.
+    """
+
+    def __init__(self, flush: Callable[[List[Any]], Awaitable[List[Any]]], max_batch: int, max_delay: float):
+        self.flush = flush
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.pending: List[Tuple[Any, asyncio.Future]] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.tasks: Set[asyncio.Task] = set()
+        self.stats = {"batches": 0, "items": 0, "largest_batch": 0}
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((item, future))
+        if len(self.pending) >= self.max_batch:
+            self._start_flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.max_delay, self._start_flush)
+        return await future
+
+    def _start_flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            # Runs as its own task so a submitter going away can't cancel everyone's write
+            task = asyncio.create_task(self._flush(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _flush(self, batch: List[Tuple[Any, asyncio.Future]]):
+        self.stats["batches"] += 1
+        self.stats["items"] += len(batch)
+        self.stats["largest_batch"] = max(self.stats["largest_batch"], len(batch))
+        try:
+            results = await self.flush([item for item, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def drain(self):
+        """Flush whatever is pending and wait for in-flight flushes to finish"""
+        self._start_flush()
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+class WriteFence:
+    """Admits any number of writers at once, or one exclusive holder with no writers in flight
+
+    Story writes hold it shared from storing or deleting a story until its
+    counters are updated; reconciliation holds it exclusively, so the stories
+    it reads and the counters it repairs agree. A waiting exclusive holder
+    keeps new writers out, so it can't be starved.
+    """
+
+    def __init__(self):
+        self.writers = 0
+        self.held = False
+        self.waiters: List[asyncio.Future] = []
+
+    async def _until(self, ready: Callable[[], bool]):
+        while not ready():
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            await waiter
+
+    def _wake(self):
+        waiters, self.waiters = self.waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    @asynccontextmanager
+    async def shared(self):
+        await self._until(lambda: not self.held)
+        self.writers += 1
+        try:
+            yield
+        finally:
+            self.writers -= 1
+            self._wake()
+
+    @asynccontextmanager
+    async def exclusive(self):
+        await self._until(lambda: not self.held)
+        self.held = True
+        try:
+            await self._until(lambda: self.writers == 0)
+            yield
+        finally:
+            self.held = False
+            self._wake()
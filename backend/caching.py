@@ -0,0 +1,102 @@
+"""Read-through cache of rendered JSON responses.
+
+ResponseCache keeps the encoded body of recent GET responses with a strong ETag,
+so a repeated read skips both the storage engine and serialization, and a client
+sending a matching If-None-Match gets a 304. Entries are tagged with what they
+were built from and dropped when a write invalidates one of their tags.
+"""
+import hashlib
+import time
+from collections import OrderedDict, defaultdict
+from typing import Dict, FrozenSet, NamedTuple, Optional
+
+from fastapi import Request, Response
+
+from profiling import span
+from serialization import dumps
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(tag.removeprefix("W/") == etag for tag in candidates)
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    etag: str
+    headers: Dict[str, str]
+    tags: FrozenSet[str]
+    expires_at: float
+
+class ResponseCache:
+    """Bounded LRU of rendered JSON responses with a TTL, invalidated by tag on writes"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: "OrderedDict[tuple, CachedResponse]" = OrderedDict()
+        self.versions: Dict[str, int] = defaultdict(int)
+        self.stats = {"hits": 0, "misses": 0, "not_modified": 0, "invalidations": 0, "evictions": 0}
+
+    def get(self, key: tuple) -> Optional[CachedResponse]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def snapshot(self, tags) -> tuple:
+        return tuple(self.versions[tag] for tag in tags)
+
+    def put(self, key: tuple, entry: CachedResponse, versions: tuple):
+        # A write that invalidated these tags while we were loading makes the entry stale
+        if self.max_entries <= 0 or self.snapshot(entry.tags) != versions:
+            return
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def invalidate(self, *tags: str):
+        for tag in tags:
+            self.versions[tag] += 1
+        stale = [key for key, entry in self.entries.items() if entry.tags.intersection(tags)]
+        for key in stale:
+            del self.entries[key]
+        self.stats["invalidations"] += len(stale)
+
+    async def respond(self, request: Request, key: tuple, tags, loader) -> Response:
+        """Serve a JSON response from the cache, loading and rendering it on a miss
+
+        loader returns (payload, extra_headers). Responses carry a strong ETag and a
+        matching If-None-Match is answered with 304 and no body.
+        """
+        tags = frozenset(tags)
+        entry = self.get(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            versions = self.snapshot(tags)
+            payload, headers = await loader()
+            with span("serialize"):
+                body = dumps(payload)
+            entry = CachedResponse(
+                body=body,
+                etag=f'"{hashlib.sha1(body).hexdigest()}"',
+                headers=headers,
+                tags=tags,
+                expires_at=time.monotonic() + self.ttl
+            )
+            self.put(key, entry, versions)
+        else:
+            self.stats["hits"] += 1
+
+        headers = {**entry.headers, "ETag": entry.etag, "Cache-Control": "no-cache"}
+        if etag_matches(request, entry.etag):
+            self.stats["not_modified"] += 1
+            return Response(status_code=304, headers=headers)
+        return Response(content=entry.body, media_type="application/json", headers=headers)
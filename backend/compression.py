@@ -0,0 +1,187 @@
+"""Compression for API responses and stored story bodies.
+
+CompressionMiddleware negotiates gzip or brotli per request and compresses
+responses above a size threshold, streaming ones chunk by chunk. The codecs at
+the bottom compress whole blobs for storage.py. brotli and zstd come from the
+optional `brotli` and `zstandard` packages; without them only gzip and zlib are
+offered.
+"""
+import zlib
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Media types worth compressing; images and already-compressed exports pass through
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+# Events must reach the client as they happen, not when a compressor block fills
+UNCOMPRESSED_TYPES = ("text/event-stream",)
+
+class GzipStream:
+    def __init__(self, level: int):
+        self.compressor = zlib.compressobj(level, wbits=31)
+
+    def chunk(self, data: bytes) -> bytes:
+        # A sync flush hands everything so far to the client without ending the stream
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        return self.compressor.compress(data) + self.compressor.flush()
+
+class BrotliStream:
+    def __init__(self, quality: int):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def chunk(self, data: bytes) -> bytes:
+        return self.compressor.process(data) + self.compressor.flush()
+
+    def finish(self, data: bytes = b"") -> bytes:
+        return self.compressor.process(data) + self.compressor.finish()
+
+def response_encodings() -> Tuple[str, ...]:
+    """Content codings the server can produce, most preferred first"""
+    return ("br", "gzip") if brotli else ("gzip",)
+
+def negotiate_encoding(accept_encoding: str, offered: Tuple[str, ...]) -> Optional[str]:
+    """The offered coding the client weights highest; ties go to the server's order"""
+    weights: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        weight = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding] = weight
+    ranked = [
+        (weights.get(coding, weights.get("*", 0.0)), -position, coding)
+        for position, coding in enumerate(offered)
+    ]
+    weight, _, coding = max(ranked)
+    return coding if weight > 0 else None
+
+class CompressionMiddleware:
+    """ASGI middleware compressing responses under a path prefix with gzip or brotli
+
+    Responses smaller than minimum_size, already encoded, or of a type outside
+    COMPRESSIBLE_TYPES go out untouched. Compressed responses get a weak ETag,
+    since the bytes differ from the identity representation the tag was made for.
+    A body with a strong ETag is the same bytes every time, so its compressed form
+    is kept (up to cache_size entries) and reused instead of recompressed.
+    """
+
+    def __init__(self, app, prefix: str = "/", minimum_size: int = 1024,
+                 gzip_level: int = 6, brotli_quality: int = 4, cache_size: int = 256):
+        self.app = app
+        self.prefix = prefix
+        self.minimum_size = minimum_size
+        self.cache_size = cache_size
+        self.compressed: "OrderedDict[Tuple[str, str], bytes]" = OrderedDict()
+        self.offered = response_encodings()
+        self.streams: Dict[str, Callable[[], object]] = {
+            "gzip": lambda: GzipStream(gzip_level),
+            "br": lambda: BrotliStream(brotli_quality)
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefix):
+            return await self.app(scope, receive, send)
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""), self.offered)
+
+        start = None
+        stream = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, stream, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                headers = Headers(raw=start["headers"])
+                media_type = headers.get("content-type", "")
+                passthrough = (
+                    "content-encoding" in headers
+                    or not media_type.startswith(COMPRESSIBLE_TYPES)
+                    or media_type.startswith(UNCOMPRESSED_TYPES)
+                )
+                if encoding is None and not passthrough:
+                    # Caches still need to know another Accept-Encoding could get other bytes
+                    MutableHeaders(raw=start["headers"]).add_vary_header("Accept-Encoding")
+                    passthrough = True
+                if passthrough:
+                    await send(start)
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                return await send(message)
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if stream is None:
+                headers = MutableHeaders(raw=start["headers"])
+                if not more_body and len(body) < self.minimum_size:
+                    passthrough = True
+                    headers.add_vary_header("Accept-Encoding")
+                    await send(start)
+                    return await send(message)
+                stream = self.streams[encoding]()
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                etag = headers.get("etag")
+                if etag and not etag.startswith("W/"):
+                    headers["ETag"] = f"W/{etag}"
+                if more_body:
+                    del headers["Content-Length"]
+                else:
+                    body = self._compress_whole(stream, body, etag, encoding)
+                    headers["Content-Length"] = str(len(body))
+                    await send(start)
+                    return await send({"type": "http.response.body", "body": body})
+                await send(start)
+            data = stream.chunk(body) if more_body else stream.finish(body)
+            await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+    def _compress_whole(self, stream, body: bytes, etag: Optional[str], encoding: str) -> bytes:
+        if not etag or etag.startswith("W/") or self.cache_size <= 0:
+            return stream.finish(body)
+        key = (etag, encoding)
+        compressed = self.compressed.get(key)
+        if compressed is None:
+            compressed = self.compressed[key] = stream.finish(body)
+            while len(self.compressed) > self.cache_size:
+                self.compressed.popitem(last=False)
+        else:
+            self.compressed.move_to_end(key)
+        return compressed
+
+# Whole-blob codecs for story bodies at rest
+def zlib_codec(level: int = 6):
+    return (lambda data: zlib.compress(data, level)), zlib.decompress
+
+def zstd_codec(level: int = 3):
+    compressor = zstandard.ZstdCompressor(level=level)
+    decompressor = zstandard.ZstdDecompressor()
+    return compressor.compress, decompressor.decompress
+
+def blob_codecs() -> Dict[str, tuple]:
+    """name -> (compress, decompress) for every codec usable in this environment"""
+    codecs = {"zlib": zlib_codec()}
+    if zstandard:
+        codecs["zstd"] = zstd_codec()
+    return codecs
@@ -0,0 +1,127 @@
+"""Draft autosave.
+
+The editor autosaves every few seconds while a student writes. DraftBuffer keeps
+the drafts being edited in memory, checks each edit's revision against them and
+writes a draft back to its storage engine once edits pause, instead of once per
+autosave.
+"""
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+
+from bson import ObjectId
+
+logger = logging.getLogger(__name__)
+
+class DraftBuffer:
+    """Drafts being edited, held in memory and written back once edits pause
+
+    A draft is written delay seconds after its latest edit, but never more than
+    max_delay seconds after its first unsaved one, so a burst of autosaves
+    becomes one write. Revisions are checked against the in-memory copy.
+    """
+
+    def __init__(self, storage, delay: float, max_delay: float):
+        self.storage = storage
+        self.delay = delay
+        self.max_delay = max_delay
+        self.drafts: Dict[ObjectId, dict] = {}
+        self.dirty_since: Dict[ObjectId, float] = {}
+        self.timers: Dict[ObjectId, asyncio.TimerHandle] = {}
+        # A draft's lock lives as long as anyone holds or waits for it
+        self.locks: Dict[ObjectId, asyncio.Lock] = {}
+        self.lock_users: Dict[ObjectId, int] = {}
+        self.tasks: Set[asyncio.Task] = set()
+        self.stats = {"edits": 0, "writes": 0}
+
+    async def get(self, draft_id: ObjectId) -> Optional[dict]:
+        draft = self.drafts.get(draft_id)
+        if draft is None:
+            loaded = await self.storage.drafts.get(draft_id)
+            if loaded is None:
+                return None
+            draft = self.drafts.setdefault(draft_id, loaded)
+        return draft
+
+    async def create(self, doc: dict):
+        # New drafts are written straight away so a reload can always find them
+        await self.storage.drafts.put(doc)
+        self.drafts[doc["_id"]] = doc
+
+    async def list(self, student_id: str, limit: int) -> List[dict]:
+        stored = await self.storage.drafts.list(student_id, limit)
+        return [self.drafts.get(doc["_id"], doc) for doc in stored]
+
+    def edit(self, draft: dict, fields: dict):
+        draft.update(fields)
+        draft["revision"] += 1
+        draft["updated_at"] = datetime.utcnow()
+        self.stats["edits"] += 1
+        self._schedule(draft["_id"])
+
+    @asynccontextmanager
+    async def _locked(self, draft_id: ObjectId):
+        lock = self.locks.setdefault(draft_id, asyncio.Lock())
+        self.lock_users[draft_id] = self.lock_users.get(draft_id, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self.lock_users[draft_id] -= 1
+            if not self.lock_users[draft_id]:
+                del self.lock_users[draft_id], self.locks[draft_id]
+
+    def _schedule(self, draft_id: ObjectId):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        first_edit = self.dirty_since.setdefault(draft_id, now)
+        delay = max(0.0, min(self.delay, first_edit + self.max_delay - now))
+        timer = self.timers.pop(draft_id, None)
+        if timer is not None:
+            timer.cancel()
+        self.timers[draft_id] = loop.call_later(delay, self._start_write, draft_id)
+
+    def _start_write(self, draft_id: ObjectId):
+        self.timers.pop(draft_id, None)
+        task = asyncio.create_task(self.write(draft_id))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def write(self, draft_id: ObjectId):
+        """Persist a draft's latest state, then let it drop out of memory if nothing changed meanwhile"""
+        async with self._locked(draft_id):
+            if self.dirty_since.pop(draft_id, None) is None or draft_id not in self.drafts:
+                return
+            try:
+                # A finalize in progress may still fail, so the stored copy stays a draft
+                await self.storage.drafts.put({**self.drafts[draft_id], "status": "draft"})
+                self.stats["writes"] += 1
+            except Exception as e:
+                logger.error(f"Error saving draft {draft_id}: {e}")
+                self.dirty_since.setdefault(draft_id, asyncio.get_running_loop().time())
+                self._schedule(draft_id)
+                return
+        draft = self.drafts.get(draft_id)
+        if draft and draft["status"] == "draft" and draft_id not in self.dirty_since and draft_id not in self.timers:
+            self.drafts.pop(draft_id, None)
+
+    async def remove(self, draft_id: ObjectId):
+        async with self._locked(draft_id):
+            timer = self.timers.pop(draft_id, None)
+            if timer is not None:
+                timer.cancel()
+            self.dirty_since.pop(draft_id, None)
+            self.drafts.pop(draft_id, None)
+            await self.storage.drafts.delete(draft_id)
+
+    async def flush(self):
+        """Write every unsaved draft now; used on shutdown"""
+        for draft_id in list(self.dirty_since):
+            timer = self.timers.pop(draft_id, None)
+            if timer is not None:
+                timer.cancel()
+            await self.write(draft_id)
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
@@ -0,0 +1,107 @@
+"""Live story events for galleries, delivered over Server-Sent Events.
+
+StoryEvents fans each story and progress change out to every connected client.
+server.py publishes from its write paths, or from a Mongo change stream when one
+is available, and turns each subscription into a streaming response.
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Deque, List, Optional, Set, Tuple
+
+from serialization import dumps
+
+class EventSubscriber:
+    """One SSE client: a bounded queue of encoded frames, where None ends the stream"""
+
+    __slots__ = ("queue",)
+
+    def __init__(self, size: int):
+        self.queue: asyncio.Queue = asyncio.Queue(size)
+
+class StoryEvents:
+    """In-process pub/sub of story and progress changes
+
+    Each event is encoded once and put on every subscriber's bounded queue. A
+    subscriber whose queue is full is disconnected instead of buffered without
+    limit; its browser reconnects with Last-Event-ID and catches up from the ring
+    of recent events. Ids are "<epoch>-<seq>", so an id from before a restart, or
+    one older than the ring, gets a reset event telling the client to reload.
+    """
+
+    def __init__(self, history_size: int, queue_size: int, heartbeat: float = 15.0, retry_ms: int = 3000):
+        self.epoch = format(int(time.time() * 1000), "x")
+        self.seq = 0
+        self.history: Deque[Tuple[int, bytes]] = deque(maxlen=history_size)
+        self.queue_size = queue_size
+        self.heartbeat = heartbeat
+        self.retry_ms = retry_ms
+        self.subscribers: Set[EventSubscriber] = set()
+        # "change_stream" while a Mongo change stream publishes instead of the write paths
+        self.source = "local"
+        self.stats = {"published": 0, "resumed": 0, "resets": 0, "dropped_subscribers": 0}
+
+    def publish(self, event: str, data: dict):
+        self.seq += 1
+        frame = f"id: {self.epoch}-{self.seq}\nevent: {event}\ndata: ".encode() + dumps(data) + b"\n\n"
+        self.history.append((self.seq, frame))
+        self.stats["published"] += 1
+        for subscriber in list(self.subscribers):
+            try:
+                subscriber.queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                self._disconnect(subscriber)
+                self.stats["dropped_subscribers"] += 1
+
+    def publish_local(self, event: str, data: dict):
+        """Publish from a write path, unless the change stream already reports the write"""
+        if self.source == "local":
+            self.publish(event, data)
+
+    def subscribe(self, last_event_id: Optional[str] = None) -> Tuple[EventSubscriber, List[bytes]]:
+        """A new subscriber and the frames it missed since last_event_id"""
+        subscriber = EventSubscriber(self.queue_size)
+        self.subscribers.add(subscriber)
+        return subscriber, self._missed(last_event_id) if last_event_id else []
+
+    def _missed(self, last_event_id: str) -> List[bytes]:
+        epoch, _, seq = last_event_id.partition("-")
+        if epoch == self.epoch and seq.isdigit() and int(seq) <= self.seq:
+            oldest = self.history[0][0] if self.history else self.seq + 1
+            if int(seq) >= oldest - 1:
+                self.stats["resumed"] += 1
+                return [frame for position, frame in self.history if position > int(seq)]
+        self.stats["resets"] += 1
+        return [f"id: {self.epoch}-{self.seq}\nevent: reset\ndata: {{}}\n\n".encode()]
+
+    async def stream(self, subscriber: EventSubscriber, missed: List[bytes]):
+        """SSE frames for one client: missed events, then live ones with heartbeats in between"""
+        try:
+            yield f"retry: {self.retry_ms}\n\n".encode()
+            for frame in missed:
+                yield frame
+            while True:
+                try:
+                    async with asyncio.timeout(self.heartbeat):
+                        frame = await subscriber.queue.get()
+                except TimeoutError:
+                    # Keeps proxies from closing an idle connection; EventSource ignores comments
+                    frame = b": heartbeat\n\n"
+                if frame is None:
+                    return
+                yield frame
+        finally:
+            self.unsubscribe(subscriber)
+
+    def unsubscribe(self, subscriber: EventSubscriber):
+        self.subscribers.discard(subscriber)
+
+    def _disconnect(self, subscriber: EventSubscriber):
+        self.subscribers.discard(subscriber)
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.queue.put_nowait(None)
+
+    def close(self):
+        for subscriber in list(self.subscribers):
+            self._disconnect(subscriber)
@@ -0,0 +1,246 @@
+"""Prometheus metrics for GET /metrics.
+
+MetricsMiddleware times every HTTP request against its route template, and
+CommandMetricsListener, registered with the Mongo client, times each command per
+collection and counts the documents it returns. Metrics keeps the fixed-bucket
+histograms and counters and renders them, along with the admission controller's
+queues and shedding, in the Prometheus text format.
+"""
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, List
+
+from pymongo import monitoring
+
+from profiling import current_profile, explainable_command, query_shape
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    """Fixed-bucket latency histogram in the Prometheus cumulative style"""
+
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def exposition(self, name: str, labels: str) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+def prometheus_labels(**labels) -> str:
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels.items()
+    )
+    return ",".join(f'{key}="{value}"' for key, value in escaped)
+
+class Metrics:
+    """Process-wide request and Mongo command metrics, rendered for GET /metrics"""
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.requests: Dict[tuple, Histogram] = defaultdict(Histogram)
+        self.commands: Dict[tuple, Histogram] = defaultdict(Histogram)
+        self.command_documents: Dict[tuple, int] = defaultdict(int)
+        self.command_failures: Dict[tuple, int] = defaultdict(int)
+        # PyMongo reports command events from Motor's worker threads
+        self.lock = threading.Lock()
+        # The AdmissionController whose queues and shedding are reported, if any
+        self.admission = None
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float):
+        self.requests[(method, route, status)].observe(seconds)
+
+    def observe_command(self, key: tuple, seconds: float, documents: int, failed: bool = False):
+        with self.lock:
+            self.commands[key].observe(seconds)
+            self.command_documents[key] += documents
+            if failed:
+                self.command_failures[key] += 1
+
+    def render(self) -> str:
+        lines = [
+            "# HELP storymaster_http_request_duration_seconds HTTP request latency by route",
+            "# TYPE storymaster_http_request_duration_seconds histogram"
+        ]
+        for (method, route, status), histogram in sorted(self.requests.items()):
+            labels = prometheus_labels(method=method, route=route, status=status)
+            lines.extend(histogram.exposition("storymaster_http_request_duration_seconds", labels))
+
+        with self.lock:
+            lines += [
+                "# HELP storymaster_mongo_command_duration_seconds Mongo command latency by collection and command",
+                "# TYPE storymaster_mongo_command_duration_seconds histogram"
+            ]
+            for (collection, command), histogram in sorted(self.commands.items()):
+                labels = prometheus_labels(collection=collection, command=command)
+                lines.extend(histogram.exposition("storymaster_mongo_command_duration_seconds", labels))
+
+            lines += [
+                "# HELP storymaster_mongo_documents_returned_total Documents returned by Mongo commands",
+                "# TYPE storymaster_mongo_documents_returned_total counter"
+            ]
+            for (collection, command), documents in sorted(self.command_documents.items()):
+                labels = prometheus_labels(collection=collection, command=command)
+                lines.append(f"storymaster_mongo_documents_returned_total{{{labels}}} {documents}")
+
+            lines += [
+                "# HELP storymaster_mongo_command_failures_total Failed Mongo commands",
+                "# TYPE storymaster_mongo_command_failures_total counter"
+            ]
+            for (collection, command), failures in sorted(self.command_failures.items()):
+                labels = prometheus_labels(collection=collection, command=command)
+                lines.append(f"storymaster_mongo_command_failures_total{{{labels}}} {failures}")
+
+        if self.admission:
+            lines.extend(self.render_admission())
+
+        return "\n".join(lines) + "\n"
+
+    def render_admission(self) -> List[str]:
+        classes = sorted(self.admission.classes.items())
+        gauges = (
+            ("in_flight", "Requests being served", lambda route_class: route_class.limiter.in_flight),
+            ("queue_depth", "Requests waiting for a slot", lambda route_class: len(route_class.limiter.waiters))
+        )
+        lines = []
+        for name, description, value in gauges:
+            lines += [
+                f"# HELP storymaster_admission_{name} {description} by route class",
+                f"# TYPE storymaster_admission_{name} gauge"
+            ]
+            for class_name, route_class in classes:
+                lines.append(f"storymaster_admission_{name}{{{prometheus_labels(route_class=class_name)}}} "
+                             f"{value(route_class)}")
+
+        lines += [
+            "# HELP storymaster_admission_admitted_total Requests admitted by route class",
+            "# TYPE storymaster_admission_admitted_total counter"
+        ]
+        for class_name, route_class in classes:
+            lines.append(f"storymaster_admission_admitted_total{{{prometheus_labels(route_class=class_name)}}} "
+                         f"{route_class.limiter.stats['admitted']}")
+
+        lines += [
+            "# HELP storymaster_admission_queue_wait_seconds_total Time admitted and shed requests spent queued",
+            "# TYPE storymaster_admission_queue_wait_seconds_total counter"
+        ]
+        for class_name, route_class in classes:
+            lines.append(f"storymaster_admission_queue_wait_seconds_total{{{prometheus_labels(route_class=class_name)}}} "
+                         f"{route_class.limiter.stats['queue_wait_seconds']}")
+
+        lines += [
+            "# HELP storymaster_admission_shed_total Requests turned away by route class and reason",
+            "# TYPE storymaster_admission_shed_total counter"
+        ]
+        for class_name, route_class in classes:
+            shed = {
+                "queue_full": route_class.limiter.stats["shed_queue_full"],
+                "queue_timeout": route_class.limiter.stats["shed_queue_timeout"],
+                "rate_limited": route_class.rate_limiter.stats["rate_limited"]
+            }
+            for reason, count in shed.items():
+                labels = prometheus_labels(route_class=class_name, reason=reason)
+                lines.append(f"storymaster_admission_shed_total{{{labels}}} {count}")
+        return lines
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request against its matched route template"""
+
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.metrics.enabled:
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # FastAPI records the matched APIRoute in the scope while routing
+            route = scope.get("route")
+            route_path = getattr(route, "path", "<unmatched>")
+            self.metrics.observe_request(scope["method"], route_path, status, time.perf_counter() - started)
+
+class CommandMetricsListener(monitoring.CommandListener):
+    """Times Mongo commands per collection and counts the documents they return
+
+    Commands issued while a request is being profiled are also added to its profile.
+    """
+
+    CURSOR_COMMANDS = {"find": "firstBatch", "aggregate": "firstBatch", "getMore": "nextBatch"}
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+        self.pending: Dict[tuple, tuple] = {}
+
+    def started(self, event):
+        # Motor runs commands with a copy of the calling request's context
+        profile = current_profile.get()
+        if not self.metrics.enabled and profile is None:
+            return
+        command = event.command
+        name = event.command_name
+        collection = command.get("collection") if name == "getMore" else command.get(name)
+        if not isinstance(collection, str):
+            return
+        profiled = None
+        if profile is not None:
+            profiled = (profile, time.perf_counter(), event.database_name,
+                        query_shape(name, command), explainable_command(name, command))
+        self.pending[(event.connection_id, event.request_id)] = ((collection, name), profiled)
+
+    def succeeded(self, event):
+        entry = self.pending.pop((event.connection_id, event.request_id), None)
+        if entry is None:
+            return
+        reply = event.reply
+        batch = self.CURSOR_COMMANDS.get(event.command_name)
+        if batch:
+            documents = len(reply.get("cursor", {}).get(batch, ()))
+        elif event.command_name == "findAndModify":
+            documents = 1 if reply.get("value") else 0
+        else:
+            documents = 0
+        self.finish(entry, event.duration_micros / 1e6, documents)
+
+    def failed(self, event):
+        entry = self.pending.pop((event.connection_id, event.request_id), None)
+        if entry is not None:
+            self.finish(entry, event.duration_micros / 1e6, 0, failed=True)
+
+    def finish(self, entry: tuple, seconds: float, documents: int, failed: bool = False):
+        key, profiled = entry
+        if self.metrics.enabled:
+            self.metrics.observe_command(key, seconds, documents, failed=failed)
+        if profiled:
+            profile, started, database, shape, explain = profiled
+            collection, name = key
+            profile.add_command(started, seconds, name=name, collection=collection, database=database,
+                                shape=shape, explain=explain)
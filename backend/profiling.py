@@ -0,0 +1,336 @@
+"""Per-request profiling: phase timings, the slow-request log and ?profile=1.
+
+ProfilingMiddleware gives each request a RequestProfile in a context variable,
+and code on the request path adds timed spans to it: ProfiledRoute times request
+validation and the endpoint, span() times serialization, and metrics.py's Mongo
+command listener adds every command (Motor copies the context into the worker
+threads that run them). Requests slower than a threshold are reported to a
+SlowRequestLog, which logs one structured record per request, with explain()
+output for its queries gathered in the background. With profiling allowed,
+?profile=1 swaps a response's body for its span tree.
+"""
+import asyncio
+import functools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional
+from urllib.parse import parse_qs
+
+import orjson
+from fastapi.exceptions import RequestValidationError
+from fastapi.routing import APIRoute
+
+logger = logging.getLogger(__name__)
+
+class Span(NamedTuple):
+    name: str
+    start: float
+    duration: float
+
+class RequestProfile:
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.route: Optional[str] = None
+        self.status = 500
+        self.started = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.route_started: Optional[float] = None
+        self.spans: List[Span] = []
+        # Mongo commands: name, collection, database, shape, ms and, for reads, the explainable command
+        self.commands: List[dict] = []
+
+    def add(self, name: str, start: float, duration: float):
+        self.spans.append(Span(name, start, duration))
+
+    def add_command(self, start: float, duration: float, **command):
+        name = f"mongo {command['name']} {command['collection']}"
+        self.spans.append(Span(name, start, duration))
+        self.commands.append({**command, "ms": round(duration * 1000, 3)})
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.started
+
+    def phases(self) -> Dict[str, float]:
+        """Milliseconds per phase; Mongo commands are summed, as are repeated phases"""
+        totals: Dict[str, float] = {}
+        for span in self.spans:
+            phase = "mongo" if span.name.startswith("mongo ") else span.name
+            totals[phase] = totals.get(phase, 0.0) + span.duration
+        return {f"{phase}_ms": round(seconds * 1000, 3) for phase, seconds in totals.items()}
+
+    def flame(self) -> dict:
+        """Spans nested by containment, with same-named siblings merged, flame-graph style"""
+        root = {"name": f"{self.method} {self.route or self.path}", "ms": self.duration, "count": 1, "children": {}}
+        stack = [(root, self.started, self.started + (self.duration or 0.0))]
+        for span in sorted(self.spans, key=lambda span: (span.start, -span.duration)):
+            end = span.start + span.duration
+            # Mongo commands are timed on a worker thread, so allow them a little clock slop at the edges
+            slop = 1e-4 if span.name.startswith("mongo ") else 0.0
+            while len(stack) > 1 and (span.start >= stack[-1][2] or end > stack[-1][2] + slop):
+                stack.pop()
+            siblings = stack[-1][0]["children"]
+            node = siblings.get(span.name)
+            if node is None:
+                node = siblings[span.name] = {"name": span.name, "ms": 0.0, "count": 0, "children": {}}
+            node["ms"] += span.duration
+            node["count"] += 1
+            stack.append((node, span.start, end))
+
+        def render(node):
+            return {
+                "name": node["name"],
+                "ms": round(node["ms"] * 1000, 3),
+                "count": node["count"],
+                "children": [render(child) for child in node["children"].values()]
+            }
+        return render(root)
+
+current_profile: ContextVar[Optional[RequestProfile]] = ContextVar("current_profile", default=None)
+
+@contextmanager
+def span(name: str):
+    """Time a block into the current request's profile, if it is being profiled"""
+    profile = current_profile.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, started, time.perf_counter() - started)
+
+# Command fields that belong to the session or transport rather than the query
+SESSION_FIELDS = frozenset((
+    "$db", "lsid", "$clusterTime", "txnNumber", "$readPreference", "readConcern", "writeConcern",
+    "autocommit", "startTransaction", "apiVersion", "apiStrict", "apiDeprecationErrors"
+))
+# Read commands explain() accepts without side effects
+EXPLAINABLE_COMMANDS = frozenset(("find", "aggregate", "count", "distinct"))
+# Fields kept as written in a query shape; they hold structure, not user data
+LITERAL_FIELDS = frozenset(("sort", "projection", "limit", "skip", "hint", "key"))
+
+def value_shape(value):
+    """value with every literal replaced by "?", so shapes group alike queries and leak no text"""
+    if isinstance(value, dict):
+        return {key: value_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        shapes = []
+        for item in value:
+            shape = value_shape(item)
+            if shape not in shapes:
+                shapes.append(shape)
+        return shapes
+    return "?"
+
+def query_shape(command_name: str, command: dict) -> dict:
+    shape = {}
+    for key, value in command.items():
+        if key in SESSION_FIELDS:
+            continue
+        if key == command_name or key in LITERAL_FIELDS:
+            shape[key] = value
+        else:
+            shape[key] = value_shape(value)
+    return shape
+
+def explainable_command(command_name: str, command: dict) -> Optional[dict]:
+    """The command stripped down for explain(), or None when it shouldn't be explained"""
+    if command_name not in EXPLAINABLE_COMMANDS:
+        return None
+    if command_name == "aggregate" and any(
+        "$out" in stage or "$merge" in stage for stage in command.get("pipeline", ())
+    ):
+        return None
+    return {key: value for key, value in command.items() if key not in SESSION_FIELDS}
+
+def timed_endpoint(endpoint):
+    # include_router() builds its routes from endpoints that are already wrapped
+    if getattr(endpoint, "profiled", False):
+        return endpoint
+
+    @functools.wraps(endpoint)
+    async def timed(*args, **kwargs):
+        profile = current_profile.get()
+        if profile is None:
+            return await endpoint(*args, **kwargs)
+        started = time.perf_counter()
+        if profile.route_started is not None:
+            # Reading the body and validating parameters happen between routing and the endpoint
+            profile.add("validation", profile.route_started, started - profile.route_started)
+        try:
+            return await endpoint(*args, **kwargs)
+        finally:
+            profile.add("handler", started, time.perf_counter() - started)
+    timed.profiled = True
+    return timed
+
+class ProfiledRoute(APIRoute):
+    """APIRoute that times request validation and its endpoint into the current profile"""
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        # wraps() keeps the signature FastAPI reads parameters and the response model from
+        super().__init__(path, timed_endpoint(endpoint), **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def profiled_handler(request):
+            profile = current_profile.get()
+            if profile is None:
+                return await handler(request)
+            profile.route = self.path
+            profile.route_started = started = time.perf_counter()
+            try:
+                return await handler(request)
+            except RequestValidationError:
+                profile.add("validation", started, time.perf_counter() - started)
+                raise
+        return profiled_handler
+
+class SlowRequestLog:
+    """Logs requests slower than threshold as one JSON record each
+
+    With an explain callable (database, command) -> summary, the record waits,
+    off the request path, for explain() of the request's read queries. A query
+    shape is explained at most once per explain_interval seconds.
+    """
+
+    def __init__(self, threshold: float, explain: Optional[Callable[[str, dict], Awaitable[dict]]] = None,
+                 explain_interval: float = 300.0, explain_timeout: float = 10.0):
+        self.threshold = threshold
+        self.explain = explain
+        self.explain_interval = explain_interval
+        self.explain_timeout = explain_timeout
+        self.explained: Dict[bytes, float] = {}
+        self.tasks = set()
+        self.stats = {"logged": 0, "explained": 0, "explain_failures": 0}
+
+    def record(self, profile: RequestProfile) -> dict:
+        return {
+            "method": profile.method,
+            "route": profile.route or profile.path,
+            "path": profile.path,
+            "status": profile.status,
+            "duration_ms": round(profile.duration * 1000, 3),
+            "threshold_ms": round(self.threshold * 1000, 3),
+            "phases": profile.phases(),
+            "mongo": [
+                {key: command[key] for key in ("name", "collection", "ms", "shape")}
+                for command in profile.commands
+            ]
+        }
+
+    def report(self, profile: RequestProfile):
+        record = self.record(profile)
+        pending = self._pending_explains(profile)
+        if not pending:
+            return self._log(record)
+        task = asyncio.get_running_loop().create_task(self._explain_and_log(record, pending))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def _pending_explains(self, profile: RequestProfile) -> Dict[bytes, dict]:
+        if self.explain is None:
+            return {}
+        now = time.monotonic()
+        pending = {}
+        for command in profile.commands:
+            if command.get("explain") is None:
+                continue
+            key = orjson.dumps(command["shape"], option=orjson.OPT_SORT_KEYS, default=str)
+            if key in pending or now - self.explained.get(key, float("-inf")) < self.explain_interval:
+                continue
+            self.explained[key] = now
+            pending[key] = command
+        return pending
+
+    async def _explain_and_log(self, record: dict, pending: Dict[bytes, dict]):
+        explains = []
+        for command in pending.values():
+            try:
+                async with asyncio.timeout(self.explain_timeout):
+                    summary = await self.explain(command["database"], command["explain"])
+                self.stats["explained"] += 1
+            except Exception as e:
+                self.stats["explain_failures"] += 1
+                summary = {"error": repr(e)}
+            explains.append({"shape": command["shape"], **summary})
+        record["explain"] = explains
+        self._log(record)
+
+    def _log(self, record: dict):
+        self.stats["logged"] += 1
+        logger.warning("Slow request " + orjson.dumps(record, default=str).decode())
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling requests under a path prefix
+
+    Requests taking at least slow_log.threshold are handed to slow_log. When
+    allow_profile_param is set, a request with ?profile=1 is answered with its
+    span tree as JSON instead of its normal body; only turn that on in
+    development, since it exposes timings and query structure. Paths in exempt
+    (long-lived streams) are never profiled.
+    """
+
+    def __init__(self, app, prefix: str = "/", slow_log: Optional[SlowRequestLog] = None,
+                 allow_profile_param: bool = False, exempt=()):
+        self.app = app
+        self.prefix = prefix
+        self.slow_log = slow_log
+        self.allow_profile_param = allow_profile_param
+        self.exempt = frozenset(exempt)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefix) or scope["path"] in self.exempt:
+            return await self.app(scope, receive, send)
+        flame = self.allow_profile_param and parse_qs(scope.get("query_string", b"").decode()).get("profile") == ["1"]
+        if not flame and self.slow_log is None:
+            return await self.app(scope, receive, send)
+
+        profile = RequestProfile(scope["method"], scope["path"])
+        token = current_profile.set(profile)
+        response_bytes = 0
+
+        async def send_profiled(message):
+            nonlocal response_bytes
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+            elif message["type"] == "http.response.body":
+                response_bytes += len(message.get("body", b""))
+            if not flame:
+                await send(message)
+
+        try:
+            await self.app(scope, receive, send_profiled)
+        finally:
+            current_profile.reset(token)
+            profile.finish()
+            if self.slow_log and profile.duration >= self.slow_log.threshold:
+                self.slow_log.report(profile)
+        if not flame:
+            return
+
+        body = orjson.dumps({
+            "status": profile.status,
+            "response_bytes": response_bytes,
+            "phases": profile.phases(),
+            "flame": profile.flame(),
+            "mongo": [
+                {key: command[key] for key in ("name", "collection", "ms", "shape")}
+                for command in profile.commands
+            ]
+        }, default=str)
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"cache-control", b"no-store")
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
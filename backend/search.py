@@ -0,0 +1,117 @@
+"""Full-text story search.
+
+StoryIndex is an in-process inverted index over story text: a sorted vocabulary
+for prefix expansion, and TF-IDF ranking with title words weighted higher. It
+is built from the stories collection at startup and kept current by the write
+paths, so searches never touch the database until results are fetched.
+"""
+import asyncio
+import logging
+import math
+import re
+from bisect import bisect_left, insort
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+class StoryIndex:
+    """In-process inverted index over story text, kept current by the story write routes"""
+
+    TEXT_FIELDS = ("title", "introduction", "middle", "conclusion")
+    TITLE_WEIGHT = 3
+    TOKEN_PATTERN = re.compile(r"\w+")
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self.vocabulary: List[str] = []
+        self.doc_tokens: Dict[str, Set[str]] = {}
+        self.doc_meta: Dict[str, tuple] = {}
+        self.ready = asyncio.Event()
+        self._deleted_during_build: Set[str] = set()
+
+    @classmethod
+    def tokenize(cls, text: str) -> List[str]:
+        return cls.TOKEN_PATTERN.findall((text or "").lower())
+
+    def add(self, doc):
+        """Index (or re-index) a story document"""
+        story_id = str(doc["_id"])
+        if not self.ready.is_set() and story_id in self._deleted_during_build:
+            return
+        self.remove(story_id)
+
+        frequencies: Dict[str, int] = defaultdict(int)
+        for field in self.TEXT_FIELDS:
+            weight = self.TITLE_WEIGHT if field == "title" else 1
+            for token in self.tokenize(doc.get(field)):
+                frequencies[token] += weight
+
+        for token, frequency in frequencies.items():
+            if token not in self.postings:
+                insort(self.vocabulary, token)
+            self.postings[token][story_id] = frequency
+        self.doc_tokens[story_id] = set(frequencies)
+        self.doc_meta[story_id] = (doc.get("category"), doc.get("created_at") or datetime.min)
+
+    def remove(self, story_id: str):
+        if not self.ready.is_set():
+            self._deleted_during_build.add(story_id)
+        for token in self.doc_tokens.pop(story_id, ()):
+            docs = self.postings[token]
+            docs.pop(story_id, None)
+            if not docs:
+                del self.postings[token]
+                del self.vocabulary[bisect_left(self.vocabulary, token)]
+        self.doc_meta.pop(story_id, None)
+
+    def expand(self, term: str) -> List[str]:
+        """Indexed tokens starting with term (the term itself included when present)"""
+        start = bisect_left(self.vocabulary, term)
+        matches = []
+        for token in self.vocabulary[start:]:
+            if not token.startswith(term):
+                break
+            matches.append(token)
+        return matches
+
+    def search(self, query: str, category: Optional[str] = None) -> List[str]:
+        """Story ids matching every query term (by prefix), best TF-IDF score first"""
+        terms = self.tokenize(query)
+        if not terms:
+            return []
+
+        total_docs = max(len(self.doc_tokens), 1)
+        scores: Optional[Dict[str, float]] = None
+        for term in dict.fromkeys(terms):
+            term_scores: Dict[str, float] = {}
+            for token in self.expand(term):
+                docs = self.postings[token]
+                idf = math.log(1 + total_docs / len(docs))
+                # Exact matches outrank prefix completions of the same term
+                boost = 1.0 if token == term else 0.5
+                for story_id, frequency in docs.items():
+                    score = frequency * idf * boost
+                    if score > term_scores.get(story_id, 0):
+                        term_scores[story_id] = score
+
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {k: v + term_scores[k] for k, v in scores.items() if k in term_scores}
+            if not scores:
+                return []
+
+        if category:
+            scores = {k: v for k, v in scores.items() if self.doc_meta[k][0] == category}
+        return sorted(scores, key=lambda k: (scores[k], self.doc_meta[k][1]), reverse=True)
+
+    async def build(self, stories, batch_size: int = 1000):
+        """Load every stored story into the index"""
+        fields = self.TEXT_FIELDS + ("category", "created_at")
+        async for doc in stories.scan(fields=fields, batch_size=batch_size):
+            self.add(doc)
+        self.ready.set()
+        self._deleted_during_build.clear()
+        logger.info(f"Story search index built with {len(self.doc_tokens)} stories")
@@ -0,0 +1,44 @@
+"""JSON encoding for API responses.
+
+Documents come straight from the storage engines with ObjectId and datetime
+values. orjson writes datetimes natively and bson_default covers the BSON
+types, so documents are encoded as-is instead of being converted and copied
+by jsonable_encoder first.
+"""
+from datetime import datetime
+
+import orjson
+from bson import Decimal128, ObjectId
+from fastapi.responses import JSONResponse
+
+from profiling import span
+
+JSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+def bson_default(value):
+    """orjson fallback for the BSON types documents can carry"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, Decimal128):
+        return str(value.to_decimal())
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+def dumps(payload) -> bytes:
+    return orjson.dumps(payload, default=bson_default, option=JSON_OPTIONS)
+
+def to_text(value) -> str:
+    """A single value as CSV cell text, formatted the way dumps would write it"""
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (ObjectId, Decimal128, str)):
+        return str(value)
+    return dumps(value).decode()
+
+class BSONJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson; accepts raw storage documents"""
+
+    def render(self, content) -> bytes:
+        with span("serialize"):
+            return dumps(content)
@@ -1,33 +1,91 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, Header, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+import io
 import os
+import re
+import csv
+import json
+import zlib
+import codecs
+import time
+import asyncio
+import hashlib
 import logging
+from collections import defaultdict
+from contextlib import asynccontextmanager
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional
-from datetime import datetime
+from pydantic import BaseModel, Field, ValidationError, field_validator
+from typing import Any, Dict, List, Optional, Tuple, Union
+from datetime import date, datetime, timedelta
 from bson import ObjectId
+from admission import AdmissionController, AdmissionMiddleware, ConcurrencyLimiter, RateLimiter, RouteClass
+from analytics import ANALYTICS_VERSION, SECTIONS, StoryAnalyzer
+from batching import WriteBatcher, WriteFence
+from caching import ResponseCache
+from compression import CompressionMiddleware
+from drafts import DraftBuffer
+from events import StoryEvents
+from metrics import CommandMetricsListener, Metrics, MetricsMiddleware
+from profiling import ProfiledRoute, ProfilingMiddleware, SlowRequestLog
+from search import StoryIndex
+from serialization import BSONJSONResponse, dumps, to_text
+from storage import (
+    DEFAULT_STUDENT_ID, STORY_STATS_FIELDS, EmbeddedStorage, MongoStorage, StoryCursor, author_key,
+    summarize_rollups, summarize_story
+)
 
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Request and Mongo command metrics, served at GET /metrics
+metrics = Metrics(enabled=os.environ.get('METRICS_ENABLED', 'true').lower() not in ('0', 'false', 'no'))
+
+# Storage engine: MongoDB by default, or the embedded engine for single-classroom setups
+STORAGE_ENGINE = os.environ.get('STORAGE_ENGINE', 'mongo')
+# none, zlib or zstd; stories already stored in another format stay readable
+STORY_BODY_COMPRESSION = os.environ.get('STORY_BODY_COMPRESSION', 'none')
+if STORAGE_ENGINE == 'embedded':
+    storage = EmbeddedStorage(os.environ.get('STORAGE_PATH'), body_compression=STORY_BODY_COMPRESSION)
+else:
+    # MongoDB connection; the client is only built when the app starts, see lifespan()
+    storage = MongoStorage(
+        os.environ['MONGO_URL'],
+        os.environ['DB_NAME'],
+        body_compression=STORY_BODY_COMPRESSION,
+        maxPoolSize=int(os.environ.get('MONGO_MAX_POOL_SIZE', '100')),
+        minPoolSize=int(os.environ.get('MONGO_MIN_POOL_SIZE', '10')),
+        maxIdleTimeMS=int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', '300000')),
+        connectTimeoutMS=int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '5000')),
+        serverSelectionTimeoutMS=int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000')),
+        waitQueueTimeoutMS=int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', '5000')),
+        event_listeners=[CommandMetricsListener(metrics)]
+    )
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Connect and prepare storage before the server takes traffic; drain it on the way out"""
+    await bootstrap_storage()
+    start_background_tasks()
+    app.state.ready = True
+    yield
+    # Fail readiness first so load balancers stop routing here while writes drain
+    app.state.ready = False
+    await shutdown_db_client()
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Create a router with the /api prefix
-api_router = APIRouter(prefix="/api")
+api_router = APIRouter(prefix="/api", default_response_class=BSONJSONResponse, route_class=ProfiledRoute)
 
 
 # Define Models
 class UserProgress(BaseModel):
+    student_id: str = DEFAULT_STUDENT_ID
+    class_id: Optional[str] = None
     lesson_completed: bool = False
     current_streak: int = 0
     stories_count: int = 0
@@ -37,9 +95,17 @@ class UserProgress(BaseModel):
 
 class UserProgressUpdate(BaseModel):
     lesson_completed: Optional[bool] = None
-    current_streak: Optional[int] = None
     stories_count: Optional[int] = None
     total_words: Optional[int] = None
+    # Accepted only to be refused with a 422, rather than silently ignored
+    current_streak: Optional[int] = None
+
+    @field_validator("current_streak")
+    @classmethod
+    def refuse_current_streak(cls, value):
+        if value is not None:
+            raise ValueError("current_streak is computed from the stories a student has completed, so it can't be set")
+        return value
 
 class Story(BaseModel):
     title: str
@@ -50,7 +116,10 @@ class Story(BaseModel):
     word_count: int
     date_completed: str
     student_name: Optional[str] = None
+    student_id: str = DEFAULT_STUDENT_ID
+    class_id: Optional[str] = None
     teacher_feedback: Optional[str] = None
+    analytics: Optional[dict] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -63,123 +132,1102 @@ class StoryCreate(BaseModel):
     word_count: int
     date_completed: str
     student_name: Optional[str] = None
+    student_id: Optional[str] = None
+    class_id: Optional[str] = None
+
+class DraftCreate(BaseModel):
+    category: str
+    title: str = ""
+    introduction: str = ""
+    middle: str = ""
+    conclusion: str = ""
+    student_name: Optional[str] = None
+    student_id: Optional[str] = None
+    class_id: Optional[str] = None
+
+class StoryPatch(BaseModel):
+    """A draft edit: only the sections that changed, and the revision they were written against"""
+    revision: int
+    title: Optional[str] = None
+    introduction: Optional[str] = None
+    middle: Optional[str] = None
+    conclusion: Optional[str] = None
+
+class DraftFinalize(BaseModel):
+    revision: int
+    date_completed: Optional[str] = None
+
+# Response shapes for the OpenAPI schema. Routes hand back pre-rendered responses
+# built from raw storage documents, so FastAPI never re-validates against these.
+class ProgressResponse(UserProgress):
+    id: str = Field(alias="_id")
+
+class StoryResponse(Story):
+    id: str = Field(alias="_id")
+
+class StorySummaryResponse(BaseModel):
+    id: str = Field(alias="_id")
+    title: str
+    category: str
+    word_count: int
+    date_completed: str
+    student_name: Optional[str] = None
+    created_at: datetime
+    preview: str
+
+class StorySearchResponse(BaseModel):
+    total: int
+    results: List[StorySummaryResponse]
+
+class StoryCreatedResponse(StoryResponse):
+    progress: ProgressResponse
+
+class BootstrapResponse(BaseModel):
+    progress: ProgressResponse
+    stories: List[StorySummaryResponse]
+    next_cursor: Optional[str] = None
+
+def validate_story_parts(story: StoryCreate):
+    """Every story needs a title and all three parts"""
+    if not story.title.strip():
+        raise HTTPException(status_code=400, detail="Story title is required")
+    if not story.introduction.strip():
+        raise HTTPException(status_code=400, detail="Story introduction is required")
+    if not story.middle.strip():
+        raise HTTPException(status_code=400, detail="Story main part is required")
+    if not story.conclusion.strip():
+        raise HTTPException(status_code=400, detail="Story conclusion is required")
+
+# Keyset pagination helpers; cursors are "<created_at ISO>,<_id>" of the last story on a page
+def encode_story_cursor(doc):
+    return f"{doc['created_at'].isoformat()},{doc['_id']}"
 
-# Helper function to convert ObjectId to string
-def serialize_doc(doc):
-    if doc and "_id" in doc:
-        doc["_id"] = str(doc["_id"])
+def decode_story_cursor(cursor: str) -> StoryCursor:
+    created_at, _, story_id = cursor.rpartition(",")
+    try:
+        created_at = datetime.fromisoformat(created_at)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not ObjectId.is_valid(story_id):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    return created_at, ObjectId(story_id)
+
+# Read-through response cache
+response_cache = ResponseCache(
+    max_entries=int(os.environ.get('RESPONSE_CACHE_SIZE', '256')),
+    ttl=float(os.environ.get('RESPONSE_CACHE_TTL', '30'))
+)
+
+# Live story events, streamed to galleries over Server-Sent Events
+story_events = StoryEvents(
+    history_size=int(os.environ.get('SSE_HISTORY_SIZE', '1000')),
+    queue_size=int(os.environ.get('SSE_QUEUE_SIZE', '256')),
+    heartbeat=float(os.environ.get('SSE_HEARTBEAT_SECONDS', '15')),
+    retry_ms=int(os.environ.get('SSE_RETRY_MS', '3000'))
+)
+
+async def follow_change_stream():
+    """Publish story events from a Mongo change stream, so writes from every server instance show up"""
+    try:
+        changes = await storage.watch()
+        story_events.source = "change_stream"
+        async for kind, operation, doc in changes:
+            if kind == "progress":
+                story_events.publish("progress-updated", progress_view(doc))
+            elif operation == "insert":
+                story_events.publish("story-created", summarize_story(doc))
+            else:
+                story_events.publish("story-deleted", {"_id": doc["_id"]})
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logging.warning(f"Story change stream unavailable, publishing events from this process only: {e}")
+    finally:
+        story_events.source = "local"
+
+# Streaming import helpers
+BULK_IMPORT_BATCH_SIZE = int(os.environ.get('BULK_IMPORT_BATCH_SIZE', '500'))
+MAX_IMPORT_RECORD_BYTES = 1024 * 1024
+MAX_REPORTED_IMPORT_ERRORS = 1000
+# Characters that give a JSON array element its structure, and the rest of a string after its opening quote
+ARRAY_STRUCTURE_PATTERN = re.compile(r'[\[\]{}",]')
+STRING_REST_PATTERN = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"', re.S)
+
+def array_element_end(buffer: str, scan: Tuple[int, int, bool] = (0, 0, False)) -> Tuple[int, Tuple[int, int, bool]]:
+    """Index of the comma or bracket ending the array element buffer starts with, or -1 if it hasn't all arrived
+
+    Only brackets and strings are followed, so this finds where a malformed
+    element ends too. Also returns the scan's (position, depth, in_string)
+    state, to resume from when more of the element arrives.
+    """
+    pos, depth, in_string = scan
+    while True:
+        if in_string:
+            rest = STRING_REST_PATTERN.match(buffer, pos)
+            if rest is None:
+                # Resume before any trailing backslashes, since they may escape what arrives next
+                return -1, (len(buffer.rstrip("\\")), depth, True)
+            pos, in_string = rest.end(), False
+            continue
+        match = ARRAY_STRUCTURE_PATTERN.search(buffer, pos)
+        if match is None:
+            return -1, (len(buffer), depth, False)
+        char, pos = match.group(), match.end()
+        if char == '"':
+            in_string = True
+        elif char in "[{":
+            depth += 1
+        elif char in "]}" and depth:
+            depth -= 1
+        elif char != "}" and not depth:
+            return match.start(), (pos, depth, False)
+
+async def iter_import_records(chunks):
+    """Parse an NDJSON or JSON array body incrementally
+
+    Yields (record_number, value, error) without ever holding more than one
+    partial record in memory; the format is chosen by the first character.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    buffer = ""
+    mode = None
+    closed = False
+    record = 0
+    scan = (0, 0, False)
+    
+    async for chunk in chunks:
+        buffer += text.decode(chunk)
+        if mode is None:
+            buffer = buffer.lstrip()
+            if not buffer:
+                continue
+            mode = "array" if buffer[0] == "[" else "ndjson"
+            if mode == "array":
+                buffer = buffer[1:]
+        
+        if mode == "ndjson":
+            *lines, buffer = buffer.split("\n")
+            for line in lines:
+                if line.strip():
+                    record += 1
+                    try:
+                        yield record, json.loads(line), None
+                    except json.JSONDecodeError as e:
+                        yield record, None, f"Invalid JSON: {e.msg}"
+        else:
+            while not closed:
+                buffer = buffer.lstrip(" \t\r\n,")
+                if not buffer:
+                    break
+                if buffer[0] == "]":
+                    closed, buffer = True, ""
+                    break
+                try:
+                    value, end = decoder.raw_decode(buffer)
+                except json.JSONDecodeError as e:
+                    end, scan = array_element_end(buffer, scan)
+                    if end < 0:
+                        # A record split across chunks; wait for more data
+                        break
+                    # A malformed record; report it and carry on from the next one
+                    record += 1
+                    yield record, None, f"Invalid JSON: {e.msg}"
+                    buffer, scan = buffer[end:], (0, 0, False)
+                    continue
+                if end == len(buffer) and isinstance(value, (int, float)):
+                    # A number may go on in the next chunk
+                    break
+                record += 1
+                yield record, value, None
+                buffer, scan = buffer[end:], (0, 0, False)
+        
+        if len(buffer) > MAX_IMPORT_RECORD_BYTES:
+            raise HTTPException(status_code=413, detail=f"Import record {record + 1} is too large")
+    
+    buffer += text.decode(b"", final=True)
+    if mode == "ndjson" and buffer.strip():
+        record += 1
+        try:
+            yield record, json.loads(buffer), None
+        except json.JSONDecodeError as e:
+            yield record, None, f"Invalid JSON: {e.msg}"
+    elif mode == "array" and not closed:
+        # A body cut short, e.g. by a dropped upload, even if it ended between records
+        record += 1
+        yield record, None, "Invalid JSON: unterminated array"
+
+# Streaming export helpers
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '500'))
+EXPORT_CHUNK_ROWS = 100
+EXPORT_CSV_COLUMNS = [
+    "_id", "title", "category", "introduction", "middle", "conclusion", "word_count",
+    "date_completed", "student_name", "teacher_feedback", "created_at", "updated_at"
+]
+
+def csv_line(values) -> str:
+    line = io.StringIO()
+    csv.writer(line).writerow(values)
+    return line.getvalue()
+
+def export_row(doc, export_format: str) -> str:
+    if export_format == "ndjson":
+        return dumps(doc).decode() + "\n"
+    return csv_line([to_text(doc.get(column)) for column in EXPORT_CSV_COLUMNS])
+
+async def iter_export_chunks(cursor, export_format: str, compress: bool):
+    """Stream a cursor as encoded text chunks, flushing the first row immediately"""
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    
+    def encode(rows):
+        data = "".join(rows).encode()
+        if compressor:
+            return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        return data
+    
+    rows = [csv_line(EXPORT_CSV_COLUMNS)] if export_format == "csv" else []
+    
+    exported = 0
+    async for doc in cursor:
+        rows.append(export_row(doc, export_format))
+        exported += 1
+        if exported == 1 or len(rows) >= EXPORT_CHUNK_ROWS:
+            yield encode(rows)
+            rows = []
+    
+    if rows:
+        yield encode(rows)
+    if compressor:
+        yield compressor.flush()
+
+# Progress aggregate helpers
+def progress_defaults(*maintained: str) -> dict:
+    """Fields a new progress document starts with, leaving out any the caller's update sets"""
+    return UserProgress().dict(exclude={"student_id", "class_id", *maintained})
+
+def story_day(doc: dict) -> str:
+    """The YYYY-MM-DD a story counts toward: its date_completed, else when it was saved"""
+    try:
+        return date.fromisoformat((doc.get("date_completed") or "")[:10]).isoformat()
+    except ValueError:
+        return (doc.get("created_at") or datetime.utcnow()).date().isoformat()
+
+def add_progress_change(changes: Dict[str, dict], doc: dict, sign: int = 1):
+    """Accumulate a story's effect (or its removal's, with sign=-1) on its student's counters"""
+    change = changes.setdefault(
+        doc.get("student_id") or DEFAULT_STUDENT_ID,
+        {"stories_count": 0, "total_words": 0, "class_id": None, "days": defaultdict(int)}
+    )
+    change["stories_count"] += sign
+    change["total_words"] += sign * doc.get("word_count", 0)
+    if sign > 0:
+        change["class_id"] = doc.get("class_id") or change["class_id"]
+    # Stories per day are what current_streak is computed from
+    change["days"][story_day(doc)] += sign
+
+async def apply_progress_changes(changes: Dict[str, dict]):
+    """Atomically adjust the maintained progress counters of every student in changes"""
+    if not changes:
+        return
+    await storage.progress.increment_many(
+        [
+            (
+                student_id,
+                {
+                    "stories_count": change["stories_count"],
+                    "total_words": change["total_words"],
+                    **{f"active_days.{day}": stories for day, stories in change["days"].items()}
+                },
+                change["class_id"]
+            )
+            for student_id, change in changes.items()
+        ],
+        progress_defaults("stories_count", "total_words", "updated_at")
+    )
+    response_cache.invalidate(*(f"progress:{student_id}" for student_id in changes))
+    if story_events.source == "local":
+        for doc in await storage.progress.get_many(list(changes)):
+            story_events.publish("progress-updated", progress_view(doc))
+
+def current_streak(active_days: Dict[str, int], today: Optional[date] = None) -> int:
+    """Consecutive days with a completed story, ending today or yesterday"""
+    today = today or datetime.utcnow().date()
+    day = today if active_days.get(today.isoformat(), 0) > 0 else today - timedelta(days=1)
+    streak = 0
+    while active_days.get(day.isoformat(), 0) > 0:
+        streak += 1
+        day -= timedelta(days=1)
+    return streak
+
+def progress_view(doc: dict) -> dict:
+    """A progress document as the API returns it, with the streak computed server-side"""
+    active_days = doc.pop("active_days", None) or {}
+    doc["current_streak"] = current_streak(active_days)
     return doc
 
+async def reconcile_progress():
+    """Recompute every student's progress counters from the stories and repair any drift
+
+    Story writes on this instance are fenced off meanwhile, since a story that
+    is stored but not yet counted would look like drift. Repairs are applied as
+    increments that only land if the counters still hold what was read, so a
+    write from another instance in the meantime is never overwritten.
+    """
+    async with story_write_fence.exclusive():
+        totals = await storage.stories.totals_by_student()
+        recorded = {doc["student_id"]: doc for doc in await storage.progress.all()}
+        
+        drift = {}
+        for student_id in totals.keys() | recorded.keys():
+            stories_count, total_words = totals.get(student_id, (0, 0))
+            expected = {"stories_count": stories_count, "total_words": total_words}
+            progress = recorded.get(student_id) or await storage.progress.get_or_create(student_id, progress_defaults())
+            actual = {
+                "stories_count": progress.get("stories_count", 0),
+                "total_words": progress.get("total_words", 0)
+            }
+            if expected == actual:
+                continue
+            
+            repaired = await storage.progress.adjust(
+                student_id, actual, {field: expected[field] - actual[field] for field in expected}
+            )
+            if not repaired:
+                logging.info(f"Progress for student {student_id} changed while being reconciled; leaving it to the next run")
+                continue
+            drift[student_id] = {"expected": expected, "actual": actual}
+            logging.warning(f"Progress drift detected for student {student_id}, repaired: {drift[student_id]}")
+            response_cache.invalidate(f"progress:{student_id}")
+    
+    return {"students": len(totals.keys() | recorded.keys()), "drift": drift, "repaired": bool(drift)}
+
+async def reconcile_progress_periodically(interval: float):
+    """Background loop that keeps the maintained counters honest"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await reconcile_progress()
+        except Exception as e:
+            logging.error(f"Error reconciling progress: {e}")
+
+# Story statistics rollups, one per (day, category)
+def add_story_stats(changes: Dict[tuple, dict], doc: dict, sign: int = 1):
+    """Accumulate a story's contribution (or removal, with sign=-1) to its rollup"""
+    change = changes.setdefault(
+        (story_day(doc), doc.get("category") or ""),
+        {"stories_count": 0, "total_words": 0, "authors": defaultdict(int)}
+    )
+    change["stories_count"] += sign
+    change["total_words"] += sign * doc.get("word_count", 0)
+    change["authors"][author_key(doc.get("student_id") or DEFAULT_STUDENT_ID)] += sign
+
+async def apply_story_stats(changes: Dict[tuple, dict]):
+    if changes:
+        await storage.rollups.apply(changes)
+        response_cache.invalidate("stats")
+
+async def rebuild_stats() -> dict:
+    """Recompute every rollup and each student's active days from the stored stories
+
+    Fenced against story writes and applied as conditional increments, like
+    reconcile_progress; a rollup or student another instance wrote to
+    meanwhile is skipped and counted in the report.
+    """
+    async with story_write_fence.exclusive():
+        changes: Dict[tuple, dict] = {}
+        active_days: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        async for doc in storage.stories.scan(fields=STORY_STATS_FIELDS):
+            add_story_stats(changes, doc)
+            active_days[doc.get("student_id") or DEFAULT_STUDENT_ID][story_day(doc)] += 1
+        
+        skipped = 0
+        stored = {(doc["day"], doc["category"]): doc for doc in await storage.rollups.range()}
+        for day, category in changes.keys() | stored.keys():
+            expected = changes.get((day, category)) or {"stories_count": 0, "total_words": 0, "authors": {}}
+            current = stored.get((day, category))
+            if current is None:
+                skipped += not await storage.rollups.adjust(day, category, None, expected)
+                continue
+            authors = {
+                author: expected["authors"].get(author, 0) - current["authors"].get(author, 0)
+                for author in expected["authors"].keys() | current["authors"].keys()
+            }
+            delta = {
+                "stories_count": expected["stories_count"] - current["stories_count"],
+                "total_words": expected["total_words"] - current["total_words"],
+                "authors": {author: stories for author, stories in authors.items() if stories}
+            }
+            if delta["stories_count"] or delta["total_words"] or delta["authors"]:
+                observed = {"stories_count": current["stories_count"], "total_words": current["total_words"]}
+                skipped += not await storage.rollups.adjust(day, category, observed, delta)
+        
+        recorded = {doc["student_id"]: doc for doc in await storage.progress.all()}
+        students = recorded.keys() | active_days.keys()
+        for student_id in students:
+            progress = recorded.get(student_id) or await storage.progress.get_or_create(student_id, progress_defaults())
+            expected_days, current_days = active_days.get(student_id, {}), progress.get("active_days") or {}
+            deltas = {
+                f"active_days.{day}": expected_days.get(day, 0) - current_days.get(day, 0)
+                for day in expected_days.keys() | current_days.keys()
+                if expected_days.get(day, 0) != current_days.get(day, 0)
+            }
+            # Every story write increments stories_count along with active_days
+            if deltas and not await storage.progress.adjust(
+                student_id, {"stories_count": progress.get("stories_count", 0)}, deltas
+            ):
+                skipped += 1
+            response_cache.invalidate(f"progress:{student_id}")
+        response_cache.invalidate("stats")
+    
+    if skipped:
+        logging.info(f"Stats rebuild skipped {skipped} rollups or students that changed while it ran")
+    return {"rollups": len(changes), "students": len(students), "skipped": skipped}
+
+# Story text analytics, computed off the event loop
+ANALYTICS_BACKFILL_BATCH_SIZE = int(os.environ.get('ANALYTICS_BACKFILL_BATCH_SIZE', '500'))
+
+story_analyzer = StoryAnalyzer(
+    executor=os.environ.get('ANALYTICS_EXECUTOR', 'process'),
+    workers=int(os.environ.get('ANALYTICS_WORKERS', '0')) or None,
+    cache_size=int(os.environ.get('ANALYTICS_CACHE_SIZE', '4096'))
+)
+
+analytics_backfill = {"running": False, "scanned": 0, "updated": 0, "last_run": None}
+
+def apply_analytics(doc: dict, analytics: dict):
+    """Store analytics on a story; its word count becomes the server-computed one"""
+    doc["analytics"] = analytics
+    doc["word_count"] = analytics["word_count"]
+
+async def backfill_analytics(batch_size: int = ANALYTICS_BACKFILL_BATCH_SIZE) -> dict:
+    """Analyze every story whose stored analytics are missing or from an older version"""
+    started = time.perf_counter()
+    analytics_backfill.update(running=True, scanned=0, updated=0)
+    batch = []
+    
+    async def flush():
+        results = await story_analyzer.analyze_many(batch)
+        updates = [
+            (doc["_id"], {"analytics": analytics, "word_count": analytics["word_count"]})
+            for doc, analytics in zip(batch, results)
+        ]
+        await storage.stories.set_fields_many(updates)
+        response_cache.invalidate("stories", *(f"story:{doc['_id']}" for doc in batch))
+        analytics_backfill["updated"] += len(updates)
+        batch.clear()
+    
+    try:
+        async for doc in storage.stories.scan_unanalyzed(ANALYTICS_VERSION, SECTIONS, batch_size=batch_size):
+            analytics_backfill["scanned"] += 1
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                await flush()
+        if batch:
+            await flush()
+    finally:
+        analytics_backfill["running"] = False
+    
+    # Authoritative word counts can differ from what clients sent
+    if analytics_backfill["updated"]:
+        await reconcile_progress()
+        await rebuild_stats()
+    
+    seconds = time.perf_counter() - started
+    report = {
+        "scanned": analytics_backfill["scanned"],
+        "updated": analytics_backfill["updated"],
+        "seconds": round(seconds, 3),
+        "stories_per_second": round(analytics_backfill["updated"] / seconds, 1) if seconds else 0.0
+    }
+    analytics_backfill["last_run"] = report
+    logging.info(f"Analytics backfill finished: {report}")
+    return report
+
+# Draft autosave
+draft_buffer = DraftBuffer(
+    storage,
+    delay=float(os.environ.get('DRAFT_SAVE_DELAY_MS', '2000')) / 1000,
+    max_delay=float(os.environ.get('DRAFT_SAVE_MAX_DELAY_MS', '10000')) / 1000
+)
+
+async def get_draft_or_error(story_id: str) -> dict:
+    if not ObjectId.is_valid(story_id):
+        raise HTTPException(status_code=400, detail="Invalid story ID")
+    draft = await draft_buffer.get(ObjectId(story_id))
+    if draft is None:
+        if await storage.stories.get(ObjectId(story_id)):
+            raise HTTPException(status_code=409, detail="Story is already finalized")
+        raise HTTPException(status_code=404, detail="Story not found")
+    return draft
+
+def check_revision(draft: dict, revision: int):
+    if draft["status"] != "draft":
+        raise HTTPException(status_code=409, detail="Story is being finalized")
+    if revision != draft["revision"]:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Draft has changed since revision {revision}; it is now at revision {draft['revision']}"
+        )
+
+# Full-text search index
+story_index = StoryIndex()
+
+# Group commit for story writes
+story_write_fence = WriteFence()
+
+async def persist_stories(docs: List[dict]) -> Dict[int, str]:
+    """Analyze, insert and account for a batch of new stories with one write per store
+
+    Returns the error message for each position that failed to insert; every
+    other story is indexed and counted toward progress and the stats rollups.
+    """
+    for doc, analytics in zip(docs, await story_analyzer.analyze_many(docs)):
+        apply_analytics(doc, analytics)
+    async with story_write_fence.shared():
+        failed = await storage.stories.insert_many(docs)
+        
+        progress, stats = {}, {}
+        for index, doc in enumerate(docs):
+            if index in failed:
+                continue
+            story_index.add(doc)
+            story_events.publish_local("story-created", summarize_story(doc))
+            add_progress_change(progress, doc)
+            add_story_stats(stats, doc)
+        if len(failed) < len(docs):
+            response_cache.invalidate("stories")
+            await asyncio.gather(apply_progress_changes(progress), apply_story_stats(stats))
+    return failed
+
+async def write_story_batch(docs: List[dict]) -> List[Any]:
+    failed = await persist_stories(docs)
+    return [RuntimeError(failed[index]) if index in failed else doc for index, doc in enumerate(docs)]
+
+story_writes = WriteBatcher(
+    write_story_batch,
+    max_batch=int(os.environ.get('STORY_WRITE_BATCH_SIZE', '64')),
+    max_delay=float(os.environ.get('STORY_WRITE_BATCH_WINDOW_MS', '5')) / 1000
+)
+
+# Idempotent story submission: double-clicks and client retries get the first story back
+IDEMPOTENCY_KEY_TTL = float(os.environ.get('IDEMPOTENCY_KEY_TTL_SECONDS', '86400'))
+# Without a key, identical content from the same student only counts as a replay for a short while
+IDEMPOTENCY_CONTENT_TTL = float(os.environ.get('IDEMPOTENCY_CONTENT_TTL_SECONDS', '600'))
+# How long a duplicate waits for the first submission, and how long an unfinished claim holds its key
+IDEMPOTENCY_WAIT = float(os.environ.get('IDEMPOTENCY_WAIT_MS', '10000')) / 1000
+
+# key -> (fingerprint, task) for submissions being saved by this instance
+submissions_in_flight: Dict[str, Tuple[str, asyncio.Task]] = {}
+
+def story_fingerprint(doc: dict) -> str:
+    """Hash of who wrote the story and what it says"""
+    content = [doc.get("student_id"), doc.get("title")] + [doc.get(section) for section in SECTIONS]
+    return hashlib.sha256(dumps(content)).hexdigest()
+
+async def claim_submission(key: str, fingerprint: str) -> Optional[ObjectId]:
+    """Claim key for this submission: None if claimed, else the _id of the story an earlier one created
+
+    Until the story is saved the claim is only leased for IDEMPOTENCY_WAIT, so
+    an instance that dies mid-save holds the key up no longer than that.
+    """
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT
+    while True:
+        claim = await storage.idempotency.claim(key, fingerprint, datetime.utcnow() + timedelta(seconds=IDEMPOTENCY_WAIT))
+        if claim is None:
+            return None
+        if claim["fingerprint"] != fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different story")
+        if claim["story_id"] is not None:
+            return claim["story_id"]
+        # Another instance is still saving the first submission
+        if time.monotonic() >= deadline:
+            raise HTTPException(status_code=409, detail="An identical story is still being saved, try again shortly")
+        await asyncio.sleep(0.05)
+
+async def save_submission(key: str, fingerprint: str, ttl: float, story_doc: dict) -> Tuple[dict, bool]:
+    """(story, replayed): the story written for this submission, or the one an earlier replay of it wrote"""
+    while True:
+        story_id = await claim_submission(key, fingerprint)
+        if story_id is None:
+            break
+        story = await storage.stories.get(story_id)
+        if story is not None:
+            return story, True
+        # The story the first submission created has since been deleted, so this one is new
+        await storage.idempotency.release(key, story_id)
+    try:
+        created_story = await story_writes.submit(story_doc)
+    except Exception:
+        await storage.idempotency.release(key)
+        raise
+    try:
+        await storage.idempotency.complete(key, created_story["_id"], datetime.utcnow() + timedelta(seconds=ttl))
+    except Exception as e:
+        # The story is saved; at worst its claim lapses and a later retry saves it again
+        logging.error(f"Error completing idempotency claim {key}: {e}")
+    return created_story, False
+
+async def submit_story_once(story_doc: dict, idempotency_key: Optional[str] = None) -> Tuple[dict, bool]:
+    """Write story_doc unless this submission was already made; (story, replayed)
+
+    Submissions are identified by the client's Idempotency-Key, scoped to the
+    student, or failing that by a hash of the story's content.
+    """
+    fingerprint = story_fingerprint(story_doc)
+    if idempotency_key:
+        key, ttl = f"key:{story_doc['student_id']}:{idempotency_key}", IDEMPOTENCY_KEY_TTL
+    else:
+        key, ttl = f"content:{fingerprint}", IDEMPOTENCY_CONTENT_TTL
+    
+    in_flight = submissions_in_flight.get(key)
+    if in_flight:
+        # A concurrent duplicate on this instance shares the first one's outcome
+        first_fingerprint, task = in_flight
+        if first_fingerprint != fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different story")
+        story, _ = await asyncio.shield(task)
+        return story, True
+    
+    # Its own task, so a client that disconnects can't leave a story written but its claim unfinished
+    task = asyncio.create_task(save_submission(key, fingerprint, ttl, story_doc))
+    submissions_in_flight[key] = (fingerprint, task)
+    
+    def forget(done: asyncio.Task):
+        submissions_in_flight.pop(key, None)
+        if not done.cancelled():
+            # Retrieved here in case every waiter has gone away
+            done.exception()
+    task.add_done_callback(forget)
+    return await asyncio.shield(task)
+
+# Loaders shared by the routes that return progress and story pages
+async def load_progress(student_id: str, class_id: Optional[str] = None) -> dict:
+    """A student's progress as the API shows it, created with defaults on first use"""
+    defaults = progress_defaults()
+    if class_id:
+        defaults["class_id"] = class_id
+    return progress_view(await storage.progress.get_or_create(student_id, defaults))
+
+async def load_story_page(limit: int, after: Optional[str] = None, category: Optional[str] = None,
+                          summary: bool = False) -> Tuple[List[dict], Optional[str]]:
+    """One keyset page of stories, newest first, and the cursor of the next page if there is one"""
+    # Fetch one extra story to learn whether another page exists
+    stories = await storage.stories.list(
+        limit + 1,
+        after=decode_story_cursor(after) if after else None,
+        category=category,
+        summary=summary
+    )
+    if len(stories) > limit:
+        stories = stories[:limit]
+        return stories, encode_story_cursor(stories[-1])
+    return stories, None
+
 # API Routes
 @api_router.get("/")
 async def root():
     return {"message": "Story Master API - Ready to help kids learn storytelling!"}
 
+@api_router.get("/bootstrap", response_model=BootstrapResponse)
+async def get_bootstrap(
+    request: Request,
+    student_id: str = Query(DEFAULT_STUDENT_ID, min_length=1),
+    class_id: Optional[str] = None,
+    limit: int = Query(1000, ge=1, le=1000)
+):
+    """Everything the app shows on start in one round trip: progress and the gallery's story summaries"""
+    async def load():
+        progress, (stories, next_cursor) = await asyncio.gather(
+            load_progress(student_id, class_id),
+            load_story_page(limit, summary=True)
+        )
+        return {"progress": progress, "stories": stories, "next_cursor": next_cursor}, {}
+    
+    try:
+        key = ("bootstrap", student_id, class_id, limit)
+        return await response_cache.respond(request, key, {f"progress:{student_id}", "stories"}, load)
+    except Exception as e:
+        logging.error(f"Error loading bootstrap data: {e}")
+        raise HTTPException(status_code=500, detail="Failed to load app data")
+
 # User Progress Routes
-@api_router.get("/progress")
-async def get_progress():
-    """Get user progress data"""
-    try:
-        progress = await db.user_progress.find_one()
-        if not progress:
-            # Create default progress if none exists
-            default_progress = UserProgress()
-            await db.user_progress.insert_one(default_progress.dict())
-            return default_progress.dict()
-        
-        return serialize_doc(progress)
+@api_router.get("/progress", response_model=ProgressResponse)
+async def get_progress(
+    request: Request,
+    student_id: str = Query(DEFAULT_STUDENT_ID, min_length=1),
+    class_id: Optional[str] = None
+):
+    """Get a student's progress data"""
+    async def load():
+        # Create default progress if none exists
+        return await load_progress(student_id, class_id), {}
+    
+    try:
+        return await response_cache.respond(request, ("progress", student_id, class_id), {f"progress:{student_id}"}, load)
     except Exception as e:
         logging.error(f"Error getting progress: {e}")
         raise HTTPException(status_code=500, detail="Failed to get progress")
 
-@api_router.put("/progress")
-async def update_progress(progress_update: UserProgressUpdate):
-    """Update user progress"""
+@api_router.put("/progress", response_model=ProgressResponse)
+async def update_progress(
+    progress_update: UserProgressUpdate,
+    student_id: str = Query(DEFAULT_STUDENT_ID, min_length=1),
+    class_id: Optional[str] = None
+):
+    """Update a student's progress"""
     try:
         update_data = {k: v for k, v in progress_update.dict().items() if v is not None}
         update_data["updated_at"] = datetime.utcnow()
+        if class_id:
+            update_data["class_id"] = class_id
         
-        result = await db.user_progress.update_one(
-            {},
-            {"$set": update_data},
-            upsert=True
-        )
-        
-        # Get updated progress
-        updated_progress = await db.user_progress.find_one()
-        return serialize_doc(updated_progress)
+        await storage.progress.get_or_create(student_id, progress_defaults())
+        updated_progress = progress_view(await storage.progress.set(student_id, update_data))
+        response_cache.invalidate(f"progress:{student_id}")
+        story_events.publish_local("progress-updated", updated_progress)
+        return BSONJSONResponse(updated_progress)
     except Exception as e:
         logging.error(f"Error updating progress: {e}")
         raise HTTPException(status_code=500, detail="Failed to update progress")
 
+@api_router.post("/progress/reconcile")
+async def reconcile_progress_endpoint():
+    """Recompute progress counters from stored stories and repair drift"""
+    try:
+        return await reconcile_progress()
+    except Exception as e:
+        logging.error(f"Error reconciling progress: {e}")
+        raise HTTPException(status_code=500, detail="Failed to reconcile progress")
+
+@api_router.get("/classes/{class_id}/progress")
+async def get_class_progress(class_id: str):
+    """Summed progress across the students of a class"""
+    try:
+        return {"class_id": class_id, **await storage.progress.class_rollup(class_id)}
+    except Exception as e:
+        logging.error(f"Error getting class progress: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get class progress")
+
+@api_router.get("/stats")
+async def get_stats(
+    request: Request,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    category: Optional[str] = None
+):
+    """Story counts, words and distinct authors over a day range, answered from the rollups"""
+    async def load():
+        rollups = await storage.rollups.range(
+            start.isoformat() if start else None, end.isoformat() if end else None, category
+        )
+        return {"start": start, "end": end, "category": category, **summarize_rollups(rollups)}, {}
+    
+    try:
+        if start and end and start > end:
+            raise HTTPException(status_code=400, detail="start must not be after end")
+        return await response_cache.respond(request, ("stats", start, end, category), {"stats"}, load)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error getting stats: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get stats")
+
+@api_router.post("/stats/rebuild")
+async def rebuild_stats_endpoint():
+    """Recompute the statistics rollups and streak counters from stored stories"""
+    try:
+        return await rebuild_stats()
+    except Exception as e:
+        logging.error(f"Error rebuilding stats: {e}")
+        raise HTTPException(status_code=500, detail="Failed to rebuild stats")
+
+@api_router.get("/cache/stats")
+async def get_cache_stats():
+    """Response cache effectiveness counters"""
+    lookups = response_cache.stats["hits"] + response_cache.stats["misses"]
+    return {
+        **response_cache.stats,
+        "entries": len(response_cache.entries),
+        "hit_ratio": response_cache.stats["hits"] / lookups if lookups else 0.0
+    }
+
 # Story Routes
-@api_router.get("/stories")
-async def get_stories():
-    """Get all user stories"""
+@api_router.get("/stories", response_model=List[Union[StoryResponse, StorySummaryResponse]])
+async def get_stories(
+    request: Request,
+    after: Optional[str] = None,
+    limit: int = Query(1000, ge=1, le=1000),
+    fields: Optional[str] = None,
+    category: Optional[str] = None
+):
+    """Get user stories, newest first, one keyset page at a time"""
+    async def load():
+        stories, next_cursor = await load_story_page(limit, after, category, summary=fields == "summary")
+        return stories, {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    
     try:
-        stories = await db.stories.find().sort("created_at", -1).to_list(1000)
-        return [serialize_doc(story) for story in stories]
+        if fields not in (None, "summary"):
+            raise HTTPException(status_code=400, detail="Unsupported fields value")
+        
+        key = ("stories", after, limit, fields, category)
+        return await response_cache.respond(request, key, {"stories"}, load)
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error getting stories: {e}")
         raise HTTPException(status_code=500, detail="Failed to get stories")
 
-@api_router.post("/stories")
-async def create_story(story: StoryCreate):
-    """Create a new story"""
+@api_router.get("/stories/search", response_model=StorySearchResponse)
+async def search_stories(
+    q: str,
+    category: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0)
+):
+    """Ranked full-text search over stories, matching word prefixes"""
+    if not story_index.ready.is_set():
+        raise HTTPException(status_code=503, detail="Search index is still loading")
+    
     try:
-        # Validate story has all required parts
-        if not story.title.strip():
-            raise HTTPException(status_code=400, detail="Story title is required")
-        if not story.introduction.strip():
-            raise HTTPException(status_code=400, detail="Story introduction is required")
-        if not story.middle.strip():
-            raise HTTPException(status_code=400, detail="Story main part is required")
-        if not story.conclusion.strip():
-            raise HTTPException(status_code=400, detail="Story conclusion is required")
-        
-        # Create story document
-        story_doc = Story(**story.dict())
-        result = await db.stories.insert_one(story_doc.dict())
+        story_ids = story_index.search(q, category)
+        page_ids = [ObjectId(story_id) for story_id in story_ids[offset:offset + limit]]
         
-        # Update user progress
-        stories_count = await db.stories.count_documents({})
-        total_words = 0
-        async for story_doc in db.stories.find():
-            total_words += story_doc.get("word_count", 0)
-        
-        await db.user_progress.update_one(
-            {},
-            {
-                "$set": {
-                    "stories_count": stories_count,
-                    "total_words": total_words,
-                    "updated_at": datetime.utcnow()
-                }
-            },
-            upsert=True
-        )
+        stories = await storage.stories.get_many(page_ids, summary=True)
+        by_id = {story["_id"]: story for story in stories}
+        results = [by_id[story_id] for story_id in page_ids if story_id in by_id]
+        return BSONJSONResponse({"total": len(story_ids), "results": results})
+    except Exception as e:
+        logging.error(f"Error searching stories: {e}")
+        raise HTTPException(status_code=500, detail="Failed to search stories")
+
+@api_router.get("/stories/export")
+async def export_stories(
+    format: str = "ndjson",
+    category: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    gzip: bool = False
+):
+    """Stream every matching story as NDJSON or CSV, optionally gzipped"""
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="Unsupported export format")
+    
+    cursor = storage.stories.scan(category=category, start=start, end=end, batch_size=EXPORT_BATCH_SIZE)
+    filename = f"stories.{format}"
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/csv"
+    if gzip:
+        filename += ".gz"
+        media_type = "application/gzip"
+    
+    return StreamingResponse(
+        iter_export_chunks(cursor, format, gzip),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@api_router.post("/stories/analytics/backfill", status_code=202)
+async def start_analytics_backfill(batch_size: int = Query(ANALYTICS_BACKFILL_BATCH_SIZE, ge=1, le=5000)):
+    """Analyze stories saved before analytics existed (or under an older version) in the background"""
+    if analytics_backfill["running"]:
+        raise HTTPException(status_code=409, detail="Analytics backfill already running")
+    analytics_backfill["running"] = True
+    app.state.backfill_task = asyncio.create_task(backfill_analytics(batch_size))
+    return {"status": "started", "version": ANALYTICS_VERSION}
+
+@api_router.get("/stories/analytics/backfill")
+async def get_analytics_backfill():
+    """Progress of the running or most recent analytics backfill"""
+    return {**analytics_backfill, "version": ANALYTICS_VERSION, "analyzer": story_analyzer.stats}
+
+@api_router.get("/stories/events")
+async def stream_story_events(
+    last_event_id: Optional[str] = Header(None),
+    resume_from: Optional[str] = Query(None, alias="last_event_id")
+):
+    """Server-Sent Events: story-created, story-deleted and progress-updated as they happen
+    
+    Browsers resume with the Last-Event-ID header on reconnect; last_event_id in
+    the query does the same for clients that open a new EventSource themselves.
+    """
+    subscriber, missed = story_events.subscribe(last_event_id or resume_from)
+    return StreamingResponse(
+        story_events.stream(subscriber, missed),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.post("/stories/drafts", status_code=201)
+async def create_draft(draft: DraftCreate):
+    """Start a story; it stays out of the gallery and progress until finalized"""
+    try:
+        now = datetime.utcnow()
+        doc = {
+            "_id": ObjectId(),
+            **draft.dict(exclude_none=True),
+            "student_id": draft.student_id or DEFAULT_STUDENT_ID,
+            "status": "draft",
+            "revision": 0,
+            "created_at": now,
+            "updated_at": now
+        }
+        await draft_buffer.create(doc)
+        return BSONJSONResponse(doc, status_code=201)
+    except Exception as e:
+        logging.error(f"Error creating draft: {e}")
+        raise HTTPException(status_code=500, detail="Failed to create draft")
+
+@api_router.get("/stories/drafts")
+async def list_drafts(
+    student_id: str = Query(DEFAULT_STUDENT_ID, min_length=1),
+    limit: int = Query(20, ge=1, le=100)
+):
+    """A student's unfinished stories, most recently edited first"""
+    try:
+        return BSONJSONResponse(await draft_buffer.list(student_id, limit))
+    except Exception as e:
+        logging.error(f"Error listing drafts: {e}")
+        raise HTTPException(status_code=500, detail="Failed to list drafts")
+
+@api_router.patch("/stories/{story_id}")
+async def patch_story(story_id: str, patch: StoryPatch):
+    """Apply changed sections to a draft if it is still at the given revision"""
+    fields = patch.dict(exclude={"revision"}, exclude_none=True)
+    if not fields:
+        raise HTTPException(status_code=400, detail="Nothing to update")
+    
+    draft = await get_draft_or_error(story_id)
+    check_revision(draft, patch.revision)
+    draft_buffer.edit(draft, fields)
+    return BSONJSONResponse({"_id": draft["_id"], "revision": draft["revision"], "updated_at": draft["updated_at"]})
+
+@api_router.post("/stories/{story_id}/finalize", response_model=StoryCreatedResponse)
+async def finalize_story(story_id: str, request: DraftFinalize):
+    """Turn a draft into a finished story; only now does it count toward progress"""
+    draft = await get_draft_or_error(story_id)
+    check_revision(draft, request.revision)
+    
+    story = StoryCreate(
+        **{field: draft.get(field) for field in ("title", "category", "introduction", "middle", "conclusion",
+                                                  "student_name", "student_id", "class_id")},
+        word_count=0,
+        date_completed=request.date_completed or datetime.utcnow().date().isoformat()
+    )
+    validate_story_parts(story)
+    
+    # Fence off further edits while the story is written
+    draft["status"] = "finalizing"
+    try:
+        story_doc = {**Story(**story.dict(exclude_none=True)).dict(), "_id": draft["_id"]}
+        created_story = await story_writes.submit(story_doc)
+    except Exception as e:
+        draft["status"] = "draft"
+        logging.error(f"Error finalizing story: {e}")
+        raise HTTPException(status_code=500, detail="Failed to finalize story")
+    
+    await draft_buffer.remove(draft["_id"])
+    progress = await load_progress(created_story["student_id"])
+    return BSONJSONResponse({**created_story, "progress": progress})
+
+@api_router.post("/stories", response_model=StoryCreatedResponse)
+async def create_story(
+    story: StoryCreate,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", min_length=1, max_length=255)
+):
+    """Create a new story, returned with its author's updated progress
+
+    Repeats of a submission (same Idempotency-Key, or without one the same
+    student and content shortly after) return the first story and don't write.
+    """
+    try:
+        # Validate story has all required parts
+        validate_story_parts(story)
         
-        # Return created story
-        created_story = await db.stories.find_one({"_id": result.inserted_id})
-        return serialize_doc(created_story)
+        # Concurrent submissions are analyzed, inserted and counted together;
+        # the created story comes back with its _id and analytics filled in
+        story_doc = Story(**story.dict(exclude_none=True))
+        created_story, replayed = await submit_story_once(story_doc.dict(), idempotency_key)
+        progress = await load_progress(created_story["student_id"])
+        headers = {"Idempotent-Replayed": "true"} if replayed else None
+        return BSONJSONResponse({**created_story, "progress": progress}, headers=headers)
     except HTTPException:
         raise
     except Exception as e:
         logging.error(f"Error creating story: {e}")
         raise HTTPException(status_code=500, detail="Failed to create story")
 
-@api_router.get("/stories/{story_id}")
-async def get_story(story_id: str):
-    """Get a specific story"""
+@api_router.post("/stories/bulk")
+async def bulk_import_stories(
+    request: Request,
+    batch_size: int = Query(BULK_IMPORT_BATCH_SIZE, ge=1, le=5000)
+):
+    """Import stories from a streamed NDJSON or JSON array body"""
+    report = {"inserted": 0, "failed": 0, "errors": []}
+    batch = []
+    
+    def record_error(record, detail):
+        report["failed"] += 1
+        if len(report["errors"]) < MAX_REPORTED_IMPORT_ERRORS:
+            report["errors"].append({"record": record, "detail": detail})
+    
+    async def flush():
+        failed = await persist_stories([doc for _, doc in batch])
+        for index, (record, _) in enumerate(batch):
+            if index in failed:
+                record_error(record, failed[index])
+            else:
+                report["inserted"] += 1
+        batch.clear()
+    
     try:
-        if not ObjectId.is_valid(story_id):
-            raise HTTPException(status_code=400, detail="Invalid story ID")
+        async for record, value, error in iter_import_records(request.stream()):
+            if error is None and not isinstance(value, dict):
+                error = "Record must be a JSON object"
+            if error:
+                record_error(record, error)
+                continue
+            
+            try:
+                story = StoryCreate(**value)
+                validate_story_parts(story)
+            except ValidationError as e:
+                record_error(record, "; ".join(
+                    f"{'.'.join(str(loc) for loc in err['loc'])}: {err['msg']}" for err in e.errors()
+                ))
+                continue
+            except HTTPException as e:
+                record_error(record, e.detail)
+                continue
+            
+            batch.append((record, Story(**story.dict(exclude_none=True)).dict()))
+            if len(batch) >= batch_size:
+                await flush()
         
-        story = await db.stories.find_one({"_id": ObjectId(story_id)})
+        if batch:
+            await flush()
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error importing stories: {e}")
+        raise HTTPException(status_code=500, detail="Failed to import stories")
+    
+    return report
+
+@api_router.get("/stories/{story_id}", response_model=StoryResponse)
+async def get_story(request: Request, story_id: str):
+    """Get a specific story"""
+    async def load():
+        story = await storage.stories.get(ObjectId(story_id))
         if not story:
             raise HTTPException(status_code=404, detail="Story not found")
         
-        return serialize_doc(story)
+        return story, {}
+    
+    try:
+        if not ObjectId.is_valid(story_id):
+            raise HTTPException(status_code=400, detail="Invalid story ID")
+        
+        return await response_cache.respond(request, ("story", story_id), {f"story:{story_id}"}, load)
     except HTTPException:
         raise
     except Exception as e:
@@ -193,27 +1241,25 @@ async def delete_story(story_id: str):
         if not ObjectId.is_valid(story_id):
             raise HTTPException(status_code=400, detail="Invalid story ID")
         
-        result = await db.stories.delete_one({"_id": ObjectId(story_id)})
-        if result.deleted_count == 0:
-            raise HTTPException(status_code=404, detail="Story not found")
-        
-        # Update user progress
-        stories_count = await db.stories.count_documents({})
-        total_words = 0
-        async for story_doc in db.stories.find():
-            total_words += story_doc.get("word_count", 0)
-        
-        await db.user_progress.update_one(
-            {},
-            {
-                "$set": {
-                    "stories_count": stories_count,
-                    "total_words": total_words,
-                    "updated_at": datetime.utcnow()
-                }
-            }
-        )
+        async with story_write_fence.shared():
+            deleted = await storage.stories.delete(ObjectId(story_id))
+            if deleted:
+                story_index.remove(story_id)
+                response_cache.invalidate("stories", f"story:{story_id}")
+                story_events.publish_local("story-deleted", {"_id": story_id})
+                
+                # Update the owning student's progress and the stats rollups
+                progress, stats = {}, {}
+                add_progress_change(progress, deleted, sign=-1)
+                add_story_stats(stats, deleted, sign=-1)
+                await asyncio.gather(apply_progress_changes(progress), apply_story_stats(stats))
         
+        if not deleted:
+            # Discarding a draft touches nothing else
+            if await draft_buffer.get(ObjectId(story_id)):
+                await draft_buffer.remove(ObjectId(story_id))
+                return {"message": "Draft deleted successfully"}
+            raise HTTPException(status_code=404, detail="Story not found")
         return {"message": "Story deleted successfully"}
     except HTTPException:
         raise
@@ -224,12 +1270,99 @@ async def delete_story(story_id: str):
 # Include the router in the main app
 app.include_router(api_router)
 
+@app.get("/metrics")
+async def get_metrics():
+    """Request and Mongo command metrics in Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# Probes live outside /api so admission control never sheds them
+READINESS_TIMEOUT = float(os.environ.get('READINESS_TIMEOUT_MS', '1000')) / 1000
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and its event loop is responding"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: startup has finished and storage answers a ping"""
+    if not getattr(app.state, "ready", False):
+        return BSONJSONResponse({"status": "starting"}, status_code=503)
+    try:
+        async with asyncio.timeout(READINESS_TIMEOUT):
+            await storage.ping()
+    except Exception as e:
+        logger.warning(f"Readiness check failed: {e!r}")
+        return BSONJSONResponse({"status": "unavailable", "storage": storage.name}, status_code=503)
+    return {"status": "ready", "storage": storage.name}
+
+# Opt-in profiling: a structured log record for slow requests, and ?profile=1 in development
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', '0'))
+slow_requests = SlowRequestLog(
+    threshold=SLOW_REQUEST_MS / 1000,
+    # Only Mongo queries have plans to explain
+    explain=storage.explain if STORAGE_ENGINE != 'embedded' and os.environ.get(
+        'SLOW_REQUEST_EXPLAIN', 'true').lower() not in ('0', 'false', 'no') else None,
+    explain_interval=float(os.environ.get('SLOW_REQUEST_EXPLAIN_INTERVAL', '300'))
+)
+REQUEST_PROFILING = os.environ.get('REQUEST_PROFILING', '').lower() in ('1', 'true', 'yes')
+
+if SLOW_REQUEST_MS > 0 or REQUEST_PROFILING:
+    app.add_middleware(
+        ProfilingMiddleware,
+        prefix="/api",
+        slow_log=slow_requests if SLOW_REQUEST_MS > 0 else None,
+        allow_profile_param=REQUEST_PROFILING,
+        exempt=("/api/stories/events",)
+    )
+
+if os.environ.get('RESPONSE_COMPRESSION', 'true').lower() not in ('0', 'false', 'no'):
+    app.add_middleware(
+        CompressionMiddleware,
+        prefix="/api",
+        minimum_size=int(os.environ.get('RESPONSE_COMPRESSION_MIN_BYTES', '1024'))
+    )
+
+# Admission control: reads and writes each get a concurrency limit and wait queue
+def admission_route_class(name: str, concurrency: int, queue_size: int, burst: int) -> RouteClass:
+    """Limits for one route class; every default can be overridden from the environment"""
+    prefix = name.upper()
+    return RouteClass(
+        ConcurrencyLimiter(
+            concurrency=int(os.environ.get(f'ADMISSION_{prefix}_CONCURRENCY', concurrency)),
+            queue_size=int(os.environ.get(f'ADMISSION_{prefix}_QUEUE', queue_size)),
+            queue_timeout=float(os.environ.get('ADMISSION_QUEUE_TIMEOUT_MS', '2000')) / 1000
+        ),
+        # Off unless configured: a whole classroom often shares one address
+        RateLimiter(
+            rate=float(os.environ.get(f'RATE_LIMIT_{prefix}S_PER_SECOND', '0')),
+            burst=int(os.environ.get(f'RATE_LIMIT_{prefix}_BURST', burst))
+        )
+    )
+
+admission = AdmissionController(
+    {
+        "read": admission_route_class("read", concurrency=128, queue_size=512, burst=100),
+        "write": admission_route_class("write", concurrency=64, queue_size=256, burst=30)
+    },
+    retry_after=int(os.environ.get('ADMISSION_RETRY_AFTER', '1')),
+    client_header=os.environ.get('RATE_LIMIT_CLIENT_HEADER')
+)
+
+if os.environ.get('ADMISSION_CONTROL', 'true').lower() not in ('0', 'false', 'no'):
+    # Event streams stay open indefinitely, so they can't hold a read slot
+    app.add_middleware(AdmissionMiddleware, controller=admission, prefix="/api", exempt=("/api/stories/events",))
+    metrics.admission = admission
+
+app.add_middleware(MetricsMiddleware, metrics=metrics)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Idempotent-Replayed"],
 )
 
 # Configure logging
@@ -239,6 +1372,41 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
+async def bootstrap_storage():
+    await storage.open()
+    # Legacy data must be keyed by student before the unique student_id index is built
+    if await storage.migrate():
+        await reconcile_progress()
+    await storage.ensure_indexes()
+    # Stores from before the rollups existed get them built once
+    if not await storage.rollups.count():
+        await rebuild_stats()
+    if os.environ.get('QUERY_PLAN_CHECK', '').lower() in ('1', 'true', 'yes'):
+        await storage.verify_query_plans()
+
+def start_background_tasks():
+    app.state.index_task = asyncio.create_task(story_index.build(storage.stories))
+    interval = float(os.environ.get('PROGRESS_RECONCILE_INTERVAL', '0'))
+    if interval > 0:
+        app.state.reconcile_task = asyncio.create_task(reconcile_progress_periodically(interval))
+    if os.environ.get('ANALYTICS_BACKFILL', '').lower() in ('1', 'true', 'yes'):
+        analytics_backfill["running"] = True
+        app.state.backfill_task = asyncio.create_task(backfill_analytics())
+    if os.environ.get('STORY_EVENTS_SOURCE', 'local') == 'change_stream':
+        if STORAGE_ENGINE == 'embedded':
+            logger.warning("STORY_EVENTS_SOURCE=change_stream ignored: the embedded engine has no change stream, "
+                           "so story events are published by this process only")
+        else:
+            app.state.change_stream_task = asyncio.create_task(follow_change_stream())
+
 async def shutdown_db_client():
-    client.close()
+    await story_writes.drain()
+    await draft_buffer.flush()
+    for name in ("index_task", "reconcile_task", "backfill_task", "change_stream_task"):
+        task = getattr(app.state, name, None)
+        if task:
+            task.cancel()
+    # End open event streams so the server isn't held up waiting on them
+    story_events.close()
+    story_analyzer.close()
+    storage.close()
@@ -0,0 +1,1155 @@
+"""Storage engines for stories and progress.
+
+server.py talks to the repositories here rather than to a database driver, so the
+API runs either against MongoDB through Motor or against an embedded in-memory
+engine (optionally persisted to SQLite in WAL mode). STORAGE_ENGINE picks one.
+"""
+import asyncio
+import hashlib
+import logging
+import sqlite3
+from bisect import bisect_left, insort
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import bson
+from bson import Binary, ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from compression import blob_codecs
+
+logger = logging.getLogger(__name__)
+
+# Newest first, with _id breaking created_at ties so keyset pages are stable
+STORY_SORT = [("created_at", DESCENDING), ("_id", DESCENDING)]
+
+# Gallery summary: card fields plus a preview of the introduction
+STORY_PREVIEW_LENGTH = 120
+STORY_SUMMARY_FIELDS = ("title", "category", "word_count", "date_completed", "student_name", "created_at")
+
+# What progress and the stats rollups need from a story when it is deleted or rebuilt
+STORY_STATS_FIELDS = ("word_count", "student_id", "class_id", "category", "date_completed", "created_at")
+
+# A keyset position: (created_at, _id) of the last story on the previous page
+StoryCursor = Tuple[datetime, ObjectId]
+
+# Free-text sections that compact storage keeps compressed in the story's body field
+STORY_BODY_FIELDS = ("introduction", "middle", "conclusion")
+
+# Owner of stories and progress written before progress was tracked per student
+DEFAULT_STUDENT_ID = "default"
+
+def author_key(student_id: str) -> str:
+    """Field-name-safe stand-in for a student_id inside rollup author counters"""
+    return hashlib.sha1(student_id.encode("utf-8")).hexdigest()[:16]
+
+def increment_path(doc: dict, path: str, delta: int):
+    """$inc semantics for a dotted field path on an in-memory document"""
+    *parents, field = path.split(".")
+    for parent in parents:
+        doc = doc.setdefault(parent, {})
+    doc[field] = doc.get(field, 0) + delta
+
+def class_rollup(docs) -> dict:
+    rollup = {"students": 0, "stories_count": 0, "total_words": 0, "lessons_completed": 0}
+    for doc in docs:
+        rollup["students"] += 1
+        rollup["stories_count"] += doc.get("stories_count", 0)
+        rollup["total_words"] += doc.get("total_words", 0)
+        rollup["lessons_completed"] += 1 if doc.get("lesson_completed") else 0
+    return rollup
+
+class StoryBodyCodec:
+    """Compact at-rest format for stories: summary fields stay plain, sections are compressed
+
+    A packed story keeps its gallery preview as a plain field and carries its
+    sections as one compressed BSON blob in body, tagged with body_codec. Stories
+    too short to gain from it are stored plain. unpack restores the original
+    shape and reads plain stories unchanged, so stories written under any setting
+    stay readable.
+    """
+
+    def __init__(self, name: str = "none"):
+        codecs = blob_codecs()
+        if name != "none" and name not in codecs:
+            raise ValueError(f"Unsupported story body compression {name!r}; available: none, {', '.join(codecs)}")
+        self.name = name
+        self.codecs = codecs
+
+    def pack(self, doc: dict) -> dict:
+        """The document to store for doc; doc itself is left as it is"""
+        if self.name == "none" or not any(field in doc for field in STORY_BODY_FIELDS):
+            return dict(doc)
+        compress, _ = self.codecs[self.name]
+        sections = {field: doc[field] for field in STORY_BODY_FIELDS if field in doc}
+        encoded = bson.encode(sections)
+        compact = {
+            "preview": (sections.get("introduction") or "")[:STORY_PREVIEW_LENGTH],
+            "body": Binary(compress(encoded)),
+            "body_codec": self.name
+        }
+        if len(bson.encode(compact)) >= len(encoded):
+            return dict(doc)
+        packed = {field: value for field, value in doc.items() if field not in STORY_BODY_FIELDS}
+        packed.update(compact)
+        return packed
+
+    def unpack(self, doc: dict) -> dict:
+        """Restore the sections of a stored story in place"""
+        if "body" not in doc:
+            return doc
+        _, decompress = self.codecs[doc.pop("body_codec")]
+        doc.update(bson.decode(decompress(doc.pop("body"))))
+        doc.pop("preview", None)
+        return doc
+
+def story_projection(fields) -> Optional[dict]:
+    """Projection for the given fields; sections also fetch the compressed body they may live in"""
+    if not fields:
+        return None
+    projection = {field: 1 for field in fields}
+    if any(field in STORY_BODY_FIELDS for field in fields):
+        projection.update(body=1, body_codec=1)
+    return projection
+
+def summarize_rollups(docs) -> dict:
+    """Totals, per-day and per-category figures from (day, category) rollup documents"""
+    by_day: Dict[str, dict] = {}
+    by_category: Dict[str, dict] = {}
+    day_authors, category_authors, authors = defaultdict(set), defaultdict(set), set()
+    for doc in docs:
+        active = {author for author, stories in doc.get("authors", {}).items() if stories > 0}
+        for figures, key in ((by_day, doc["day"]), (by_category, doc["category"])):
+            entry = figures.setdefault(key, {"stories_count": 0, "total_words": 0})
+            entry["stories_count"] += doc.get("stories_count", 0)
+            entry["total_words"] += doc.get("total_words", 0)
+        day_authors[doc["day"]] |= active
+        category_authors[doc["category"]] |= active
+        authors |= active
+
+    def listing(figures, name, distinct):
+        return [
+            {name: key, **figures[key], "distinct_authors": len(distinct[key])}
+            for key in sorted(figures) if figures[key]["stories_count"] > 0
+        ]
+
+    return {
+        "stories_count": sum(entry["stories_count"] for entry in by_day.values()),
+        "total_words": sum(entry["total_words"] for entry in by_day.values()),
+        "distinct_authors": len(authors),
+        "by_day": listing(by_day, "day", day_authors),
+        "by_category": listing(by_category, "category", category_authors)
+    }
+
+
+# MongoDB engine
+STORY_SUMMARY_PROJECTION = {
+    **{field: 1 for field in STORY_SUMMARY_FIELDS},
+    # Packed stories store their preview; plain ones cut it from the introduction
+    "preview": {"$ifNull": ["$preview", {"$substrCP": ["$introduction", 0, STORY_PREVIEW_LENGTH]}]}
+}
+
+COLLECTION_INDEXES = {
+    "stories": [
+        IndexModel(STORY_SORT, name="created_at_desc"),
+        IndexModel([("category", ASCENDING)] + STORY_SORT, name="category_created_at_desc"),
+        IndexModel([("student_name", ASCENDING)], name="student_name")
+    ],
+    "user_progress": [
+        IndexModel([("student_id", ASCENDING)], name="student_id", unique=True),
+        IndexModel([("class_id", ASCENDING)], name="class_id")
+    ],
+    "story_drafts": [
+        IndexModel([("student_id", ASCENDING), ("updated_at", DESCENDING)], name="student_id_updated_at_desc")
+    ],
+    "story_rollups": [
+        IndexModel([("day", ASCENDING), ("category", ASCENDING)], name="day_category"),
+        IndexModel([("category", ASCENDING), ("day", ASCENDING)], name="category_day")
+    ],
+    # Claims are keyed by _id, which is unique; each expires at its own expires_at
+    "story_idempotency": [
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0)
+    ]
+}
+
+def rollup_id(day: str, category: str) -> str:
+    # day is always YYYY-MM-DD, so the pair can't collide whatever the category holds
+    return f"{day}|{category}"
+
+def rollup_filter(start: Optional[str] = None, end: Optional[str] = None,
+                  category: Optional[str] = None) -> dict:
+    query = {}
+    if start or end:
+        query["day"] = {}
+        if start:
+            query["day"]["$gte"] = start
+        if end:
+            query["day"]["$lte"] = end
+    if category:
+        query["category"] = category
+    return query
+
+def story_filter(after: Optional[StoryCursor] = None, category: Optional[str] = None,
+                 start: Optional[datetime] = None, end: Optional[datetime] = None) -> dict:
+    query = {}
+    if category:
+        query["category"] = category
+    if start or end:
+        query["created_at"] = {}
+        if start:
+            query["created_at"]["$gte"] = start
+        if end:
+            query["created_at"]["$lt"] = end
+    if after:
+        # The top-level created_at bound keeps this an index range scan on STORY_SORT
+        created_at, story_id = after
+        query.setdefault("created_at", {})["$lte"] = created_at
+        query["$or"] = [{"created_at": {"$lt": created_at}}, {"_id": {"$lt": story_id}}]
+    return query
+
+class MongoStoryRepository:
+    def __init__(self, collection, body_codec: StoryBodyCodec):
+        self.collection = collection
+        self.body_codec = body_codec
+
+    async def insert(self, doc: dict) -> ObjectId:
+        doc.setdefault("_id", ObjectId())
+        result = await self.collection.insert_one(self.body_codec.pack(doc))
+        return result.inserted_id
+
+    async def insert_many(self, docs: List[dict]) -> Dict[int, str]:
+        """Insert unordered; returns the error message for each failed position"""
+        for doc in docs:
+            doc.setdefault("_id", ObjectId())
+        try:
+            await self.collection.insert_many([self.body_codec.pack(doc) for doc in docs], ordered=False)
+        except BulkWriteError as e:
+            return {error["index"]: error["errmsg"] for error in e.details["writeErrors"]}
+        return {}
+
+    async def get(self, story_id: ObjectId) -> Optional[dict]:
+        doc = await self.collection.find_one({"_id": story_id})
+        return self.body_codec.unpack(doc) if doc else None
+
+    async def get_many(self, story_ids: List[ObjectId], summary: bool = False) -> List[dict]:
+        projection = STORY_SUMMARY_PROJECTION if summary else None
+        docs = await self.collection.find({"_id": {"$in": story_ids}}, projection).to_list(len(story_ids))
+        return docs if summary else [self.body_codec.unpack(doc) for doc in docs]
+
+    async def list(self, limit: int, after: Optional[StoryCursor] = None,
+                   category: Optional[str] = None, summary: bool = False) -> List[dict]:
+        projection = STORY_SUMMARY_PROJECTION if summary else None
+        cursor = self.collection.find(story_filter(after, category), projection).sort(STORY_SORT)
+        docs = await cursor.to_list(limit)
+        return docs if summary else [self.body_codec.unpack(doc) for doc in docs]
+
+    async def scan(self, category: Optional[str] = None, start: Optional[datetime] = None,
+                   end: Optional[datetime] = None, fields=None, batch_size: int = 500):
+        """Async iterator over matching stories, newest first, fetched in batches"""
+        query = story_filter(category=category, start=start, end=end)
+        cursor = self.collection.find(query, story_projection(fields)).sort(STORY_SORT).batch_size(batch_size)
+        async for doc in cursor:
+            yield self.body_codec.unpack(doc)
+
+    async def scan_unanalyzed(self, version: int, fields, batch_size: int = 500):
+        """Async iterator over stories whose stored analytics are missing or older than version"""
+        query = {"analytics.version": {"$ne": version}}
+        cursor = self.collection.find(query, story_projection(fields)).sort("_id", ASCENDING).batch_size(batch_size)
+        async for doc in cursor:
+            yield self.body_codec.unpack(doc)
+
+    async def set_fields_many(self, updates: List[Tuple[ObjectId, dict]]):
+        if updates:
+            await self.collection.bulk_write(
+                [UpdateOne({"_id": story_id}, {"$set": fields}) for story_id, fields in updates],
+                ordered=False
+            )
+
+    async def delete(self, story_id: ObjectId) -> Optional[dict]:
+        """Delete a story, returning what the progress counters need from it"""
+        return await self.collection.find_one_and_delete(
+            {"_id": story_id},
+            projection={field: 1 for field in STORY_STATS_FIELDS}
+        )
+
+    async def totals_by_student(self) -> Dict[str, Tuple[int, int]]:
+        """student_id -> (story count, summed word_count) straight from the stored stories"""
+        totals = self.collection.aggregate([
+            {"$group": {
+                "_id": {"$ifNull": ["$student_id", DEFAULT_STUDENT_ID]},
+                "stories_count": {"$sum": 1},
+                "total_words": {"$sum": "$word_count"}
+            }}
+        ])
+        return {row["_id"]: (row["stories_count"], row["total_words"]) async for row in totals}
+
+    async def migrate_owner(self) -> int:
+        """Assign stories saved before per-student progress to the default student"""
+        result = await self.collection.update_many(
+            {"student_id": {"$exists": False}},
+            {"$set": {"student_id": DEFAULT_STUDENT_ID}}
+        )
+        return result.modified_count
+
+    async def storage_size(self) -> dict:
+        """Document count, BSON data size and on-disk (block-compressed) size of the collection"""
+        stats = await self.collection.database.command("collStats", self.collection.name)
+        return {
+            "documents": stats.get("count", 0),
+            "data_bytes": stats.get("size", 0),
+            "storage_bytes": stats.get("storageSize", 0)
+        }
+
+class MongoDraftRepository:
+    """Stories still being written; they move to the stories collection when finalized"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def get(self, draft_id: ObjectId) -> Optional[dict]:
+        return await self.collection.find_one({"_id": draft_id})
+
+    async def put(self, doc: dict):
+        await self.collection.replace_one({"_id": doc["_id"]}, doc, upsert=True)
+
+    async def delete(self, draft_id: ObjectId):
+        await self.collection.delete_one({"_id": draft_id})
+
+    async def list(self, student_id: str, limit: int) -> List[dict]:
+        cursor = self.collection.find({"student_id": student_id}).sort("updated_at", DESCENDING)
+        return await cursor.to_list(limit)
+
+class MongoIdempotencyRepository:
+    """Claims on story submissions, so a replayed submission finds the story the first one created"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def claim(self, key: str, fingerprint: str, expires_at: datetime) -> Optional[dict]:
+        """Claim key for a new submission: None if this caller got it, else the live claim holding it
+
+        expires_at is a short lease; complete() extends it once the story is
+        saved, and a claim whose lease ran out can be taken over.
+        """
+        doc = {"_id": key, "fingerprint": fingerprint, "story_id": None, "expires_at": expires_at}
+        existing = None
+        for _ in range(3):
+            try:
+                await self.collection.insert_one(doc)
+                return None
+            except DuplicateKeyError:
+                existing = await self.collection.find_one({"_id": key})
+            if existing is None:
+                # Released or expired between the insert and the read
+                continue
+            if existing["expires_at"] > datetime.utcnow():
+                return existing
+            # The TTL monitor only sweeps once a minute, so expired claims can still be around
+            await self.collection.delete_one({"_id": key, "expires_at": existing["expires_at"]})
+        return existing
+
+    async def get(self, key: str) -> Optional[dict]:
+        return await self.collection.find_one({"_id": key})
+
+    async def complete(self, key: str, story_id: ObjectId, expires_at: datetime):
+        await self.collection.update_one({"_id": key}, {"$set": {"story_id": story_id, "expires_at": expires_at}})
+
+    async def release(self, key: str, story_id: Optional[ObjectId] = None):
+        """Drop the claim if it still holds story_id, so a retry can go ahead
+
+        None releases an unfinished claim, e.g. after its write failed; a story's
+        _id releases a claim whose story has since been deleted.
+        """
+        await self.collection.delete_one({"_id": key, "story_id": story_id})
+
+class MongoRollupRepository:
+    """Story counts, word totals and per-author counters for each (day, category)"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def apply(self, changes: Dict[Tuple[str, str], dict]):
+        """Add each change's stories_count, total_words and authors counters to its rollup"""
+        if not changes:
+            return
+        await self.collection.bulk_write([
+            UpdateOne(
+                {"_id": rollup_id(day, category)},
+                {
+                    "$inc": {
+                        "stories_count": change["stories_count"],
+                        "total_words": change["total_words"],
+                        **{f"authors.{author}": stories for author, stories in change["authors"].items()}
+                    },
+                    "$setOnInsert": {"day": day, "category": category}
+                },
+                upsert=True
+            )
+            for (day, category), change in changes.items()
+        ], ordered=False)
+
+    async def range(self, start: Optional[str] = None, end: Optional[str] = None,
+                    category: Optional[str] = None) -> List[dict]:
+        return await self.collection.find(rollup_filter(start, end, category)).to_list(None)
+
+    async def count(self) -> int:
+        return await self.collection.estimated_document_count()
+
+    async def adjust(self, day: str, category: str, observed: Optional[dict], change: dict) -> bool:
+        """Add change to a rollup only if its counters still hold observed, or with observed None, only if it
+        doesn't exist yet; False if it has changed since"""
+        if observed is None:
+            try:
+                await self.collection.insert_one({
+                    "_id": rollup_id(day, category), "day": day, "category": category,
+                    "stories_count": change["stories_count"], "total_words": change["total_words"],
+                    "authors": dict(change["authors"])
+                })
+                return True
+            except DuplicateKeyError:
+                return False
+        result = await self.collection.update_one(
+            {"_id": rollup_id(day, category), **observed},
+            {"$inc": {
+                "stories_count": change["stories_count"],
+                "total_words": change["total_words"],
+                **{f"authors.{author}": stories for author, stories in change["authors"].items()}
+            }}
+        )
+        return result.matched_count == 1
+
+class MongoProgressRepository:
+    """One progress document per student, looked up through the unique student_id index"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def get(self, student_id: str) -> Optional[dict]:
+        return await self.collection.find_one({"student_id": student_id})
+
+    async def get_or_create(self, student_id: str, defaults: dict) -> dict:
+        return await self.collection.find_one_and_update(
+            {"student_id": student_id},
+            {"$setOnInsert": defaults},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def increment_many(self, increments: List[Tuple[str, Dict[str, int], Optional[str]]], defaults: dict):
+        """Atomically add each (student_id, deltas, class_id), creating documents from defaults if needed
+
+        All students' updates go to the server as one unordered bulk write.
+        """
+        if not increments:
+            return
+        now = datetime.utcnow()
+        await self.collection.bulk_write([
+            UpdateOne(
+                {"student_id": student_id},
+                {
+                    "$inc": deltas,
+                    "$set": {"updated_at": now, **({"class_id": class_id} if class_id else {})},
+                    "$setOnInsert": defaults
+                },
+                upsert=True
+            )
+            for student_id, deltas, class_id in increments
+        ], ordered=False)
+
+    async def set(self, student_id: str, fields: dict) -> dict:
+        return await self.collection.find_one_and_update(
+            {"student_id": student_id},
+            {"$set": fields},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def adjust(self, student_id: str, observed: dict, deltas: Dict[str, int]) -> bool:
+        """Add deltas to a student's counters only if observed still holds; False if they have changed since"""
+        result = await self.collection.update_one(
+            {"student_id": student_id, **observed},
+            {"$inc": deltas, "$set": {"updated_at": datetime.utcnow()}}
+        )
+        return result.matched_count == 1
+
+    async def get_many(self, student_ids: List[str]) -> List[dict]:
+        return await self.collection.find({"student_id": {"$in": student_ids}}).to_list(len(student_ids))
+
+    async def all(self) -> List[dict]:
+        return await self.collection.find(
+            {}, {"student_id": 1, "stories_count": 1, "total_words": 1, "active_days": 1}
+        ).to_list(None)
+
+    async def class_rollup(self, class_id: str) -> dict:
+        return class_rollup([doc async for doc in self.collection.find({"class_id": class_id})])
+
+    async def migrate_legacy(self) -> int:
+        """Turn the pre-per-student global progress document into the default student's"""
+        legacy = await self.collection.find({"student_id": {"$exists": False}}).sort("created_at", ASCENDING).to_list(None)
+        if not legacy:
+            return 0
+        if await self.collection.find_one({"student_id": DEFAULT_STUDENT_ID}):
+            keep, extra = None, legacy
+        else:
+            keep, extra = legacy[0], legacy[1:]
+            await self.collection.update_one({"_id": keep["_id"]}, {"$set": {"student_id": DEFAULT_STUDENT_ID}})
+        if extra:
+            # Duplicates from the old find-then-insert race; reconciliation restores the counters
+            logger.warning(f"Dropping {len(extra)} duplicate legacy progress documents")
+            await self.collection.delete_many({"_id": {"$in": [doc["_id"] for doc in extra]}})
+        return len(legacy)
+
+def plan_stages(plan):
+    """Every stage name in an explain() plan tree"""
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from plan_stages(item)
+
+class MongoStorage:
+    """MongoDB through Motor
+
+    The client and repositories are built by open(), not the constructor, so
+    importing the server never resolves hosts or starts pool monitors.
+    client_options go straight to AsyncIOMotorClient (maxPoolSize,
+    serverSelectionTimeoutMS, event_listeners, ...).
+    """
+    name = "mongo"
+
+    def __init__(self, url: str, db_name: str, body_compression: str = "none", **client_options):
+        self.url = url
+        self.db_name = db_name
+        self.body_codec = StoryBodyCodec(body_compression)
+        self.client_options = client_options
+        self.client = None
+
+    async def open(self):
+        # Only this engine needs Motor, so embedded deployments never import it
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        self.client = AsyncIOMotorClient(self.url, **self.client_options)
+        self.db = self.client[self.db_name]
+        self.stories = MongoStoryRepository(self.db.stories, self.body_codec)
+        self.progress = MongoProgressRepository(self.db.user_progress)
+        self.rollups = MongoRollupRepository(self.db.story_rollups)
+        self.drafts = MongoDraftRepository(self.db.story_drafts)
+        self.idempotency = MongoIdempotencyRepository(self.db.story_idempotency)
+        # Concurrent pings select a server and open minPoolSize connections now,
+        # rather than leaving the first requests to pay for it
+        warm = max(1, self.client_options.get("minPoolSize", 0))
+        await asyncio.gather(*(self.ping() for _ in range(warm)))
+        logger.info(f"Connected to MongoDB with {warm} warm connections")
+
+    async def ping(self):
+        await self.client.admin.command("ping")
+
+    async def explain(self, database: str, command: dict) -> dict:
+        """Plan stages and executionStats counters for one read command"""
+        explained = await self.client[database].command({"explain": command, "verbosity": "executionStats"})
+
+        def find(node, key):
+            if isinstance(node, dict):
+                if key in node:
+                    return node[key]
+                nodes = node.values()
+            elif isinstance(node, list):
+                nodes = node
+            else:
+                return None
+            for child in nodes:
+                found = find(child, key)
+                if found is not None:
+                    return found
+            return None
+
+        # Aggregations nest the find's plan and stats inside their first stage
+        stats = find(explained, "executionStats") or {}
+        return {
+            "stages": sorted(set(plan_stages(find(explained, "winningPlan") or {}))),
+            "returned": stats.get("nReturned"),
+            "keys_examined": stats.get("totalKeysExamined"),
+            "docs_examined": stats.get("totalDocsExamined"),
+            "execution_ms": stats.get("executionTimeMillis")
+        }
+
+    async def migrate(self):
+        """One-shot upgrade of data written before per-student progress; idempotent"""
+        migrated = await self.progress.migrate_legacy()
+        stories = await self.stories.migrate_owner()
+        if migrated or stories:
+            logger.info(f"Migrated {migrated} legacy progress documents and {stories} stories to per-student progress")
+        return migrated + stories
+
+    async def ensure_indexes(self):
+        """Create the declared indexes; a no-op when they already exist"""
+        for collection, indexes in COLLECTION_INDEXES.items():
+            await self.db[collection].create_indexes(indexes)
+
+    def route_query_shapes(self):
+        """The find() each route issues, built with placeholder values for explain()"""
+        stories = self.db.stories
+        sample_id = ObjectId()
+        after = (datetime.utcnow(), sample_id)
+        start, end = datetime(2024, 1, 1), datetime.utcnow()
+        return {
+            "get_stories": stories.find(story_filter()).sort(STORY_SORT).limit(1001),
+            "get_stories?after": stories.find(story_filter(after)).sort(STORY_SORT).limit(1001),
+            "get_stories?category": stories.find(story_filter(category="Adventure")).sort(STORY_SORT).limit(1001),
+            "get_stories?category&after": stories.find(story_filter(after, "Adventure")).sort(STORY_SORT).limit(1001),
+            "search_stories": stories.find({"_id": {"$in": [sample_id]}}),
+            "export_stories?start&end": stories.find(story_filter(start=start, end=end)).sort(STORY_SORT),
+            "export_stories?category&start&end": stories.find(
+                story_filter(category="Adventure", start=start, end=end)
+            ).sort(STORY_SORT),
+            "get_story": stories.find({"_id": sample_id}).limit(1),
+            "delete_story": stories.find({"_id": sample_id}).limit(1),
+            "get_progress": self.db.user_progress.find({"student_id": DEFAULT_STUDENT_ID}).limit(1),
+            "get_class_progress": self.db.user_progress.find({"class_id": "sample"}),
+            "list_drafts": self.db.story_drafts.find({"student_id": DEFAULT_STUDENT_ID}).sort("updated_at", DESCENDING),
+            "get_stats": self.db.story_rollups.find(rollup_filter("2024-01-01", "2024-12-31")),
+            "get_stats?category": self.db.story_rollups.find(rollup_filter("2024-01-01", "2024-12-31", "Adventure"))
+        }
+
+    async def verify_query_plans(self):
+        """Fail if any route query would scan the collection or sort in memory"""
+        failures = {}
+        for route, cursor in self.route_query_shapes().items():
+            explained = await cursor.explain()
+            stages = set(plan_stages(explained["queryPlanner"]["winningPlan"]))
+            bad_stages = stages & {"COLLSCAN", "SORT"}
+            if bad_stages:
+                failures[route] = sorted(bad_stages)
+
+        if failures:
+            raise RuntimeError(f"Query plans not served by an index: {failures}")
+        logger.info("Query plan check passed for all story routes")
+
+    async def clear(self):
+        """Remove every story and progress document (benchmarks only)"""
+        await self.db.stories.delete_many({})
+        await self.db.user_progress.delete_many({})
+        await self.db.story_rollups.delete_many({})
+        await self.db.story_drafts.delete_many({})
+        await self.db.story_idempotency.delete_many({})
+
+    async def watch(self):
+        """Open a change stream over story inserts/deletes and progress writes
+
+        Returns an async iterator of ("story" or "progress", operation, document);
+        deletes carry only the _id. Change streams need a replica set or sharded
+        cluster, so on a standalone server this raises OperationFailure.
+        """
+        watched = {
+            self.stories.collection.name: ("story", ("insert", "delete")),
+            self.progress.collection.name: ("progress", ("insert", "update", "replace"))
+        }
+        pipeline = [{"$match": {"$or": [
+            {"ns.coll": collection, "operationType": {"$in": list(operations)}}
+            for collection, (_, operations) in watched.items()
+        ]}}]
+        stream = self.db.watch(pipeline, full_document="updateLookup")
+        # try_next opens the stream, so an unsupported deployment fails here rather than later
+        first = await stream.try_next()
+
+        def describe(change):
+            kind, _ = watched[change["ns"]["coll"]]
+            return kind, change["operationType"], change.get("fullDocument") or change["documentKey"]
+
+        async def changes():
+            try:
+                if first:
+                    yield describe(first)
+                async for change in stream:
+                    yield describe(change)
+            finally:
+                await stream.close()
+
+        return changes()
+
+    def close(self):
+        if self.client:
+            self.client.close()
+
+
+# Embedded engine
+MIN_OBJECT_ID = ObjectId("0" * 24)
+
+class SQLiteJournal:
+    """Write-through persistence for the embedded engine: one BSON blob per document"""
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS stories (id TEXT PRIMARY KEY, doc BLOB NOT NULL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS student_progress (student_id TEXT PRIMARY KEY, doc BLOB NOT NULL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS story_rollups (id TEXT PRIMARY KEY, doc BLOB NOT NULL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS story_drafts (id TEXT PRIMARY KEY, doc BLOB NOT NULL)")
+
+    def load_stories(self):
+        for (doc,) in self.conn.execute("SELECT doc FROM stories"):
+            yield bson.decode(doc)
+
+    def load_progress(self):
+        for (doc,) in self.conn.execute("SELECT doc FROM student_progress"):
+            yield bson.decode(doc)
+
+    def pop_legacy_progress(self) -> Optional[dict]:
+        """The single global progress row from before per-student progress, if still present"""
+        exists = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'progress'"
+        ).fetchone()
+        if not exists:
+            return None
+        row = self.conn.execute("SELECT doc FROM progress").fetchone()
+        self.conn.execute("DROP TABLE progress")
+        return bson.decode(row[0]) if row else None
+
+    def put_stories(self, docs: List[dict]):
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO stories (id, doc) VALUES (?, ?)",
+                [(str(doc["_id"]), bson.encode(doc)) for doc in docs]
+            )
+
+    def delete_story(self, story_id: ObjectId):
+        self.conn.execute("DELETE FROM stories WHERE id = ?", (str(story_id),))
+
+    def put_progress(self, docs: List[dict]):
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO student_progress (student_id, doc) VALUES (?, ?)",
+                [(doc["student_id"], bson.encode(doc)) for doc in docs]
+            )
+
+    def load_rollups(self):
+        for (doc,) in self.conn.execute("SELECT doc FROM story_rollups"):
+            yield bson.decode(doc)
+
+    def put_rollups(self, docs: List[dict]):
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO story_rollups (id, doc) VALUES (?, ?)",
+                [(rollup_id(doc["day"], doc["category"]), bson.encode(doc)) for doc in docs]
+            )
+
+    def load_drafts(self):
+        for (doc,) in self.conn.execute("SELECT doc FROM story_drafts"):
+            yield bson.decode(doc)
+
+    def put_draft(self, doc: dict):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO story_drafts (id, doc) VALUES (?, ?)", (str(doc["_id"]), bson.encode(doc))
+        )
+
+    def delete_draft(self, draft_id: ObjectId):
+        self.conn.execute("DELETE FROM story_drafts WHERE id = ?", (str(draft_id),))
+
+    def clear(self):
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.execute("DELETE FROM stories")
+            self.conn.execute("DELETE FROM student_progress")
+            self.conn.execute("DELETE FROM story_rollups")
+            self.conn.execute("DELETE FROM story_drafts")
+
+    def ping(self):
+        self.conn.execute("SELECT 1").fetchone()
+
+    def close(self):
+        self.conn.close()
+
+def summarize_story(doc: dict) -> dict:
+    summary = {field: doc[field] for field in STORY_SUMMARY_FIELDS if field in doc}
+    summary["_id"] = doc["_id"]
+    summary["preview"] = doc.get("preview", (doc.get("introduction") or "")[:STORY_PREVIEW_LENGTH])
+    return summary
+
+class EmbeddedStoryRepository:
+    """Stories held in a dict with (created_at, _id) orderings kept sorted per category
+
+    Every method runs without awaiting in between, so each call is atomic on the
+    event loop. Callers get shallow copies and may mutate them freely. Stories are
+    held in memory and journaled in the body codec's stored form.
+    """
+
+    def __init__(self, journal: Optional[SQLiteJournal], body_codec: StoryBodyCodec):
+        self.journal = journal
+        self.body_codec = body_codec
+        self.docs: Dict[ObjectId, dict] = {}
+        self.order: List[StoryCursor] = []
+        self.category_order: Dict[str, List[StoryCursor]] = defaultdict(list)
+
+    def load(self, docs):
+        for doc in docs:
+            self._add(doc)
+
+    def _key(self, doc: dict) -> StoryCursor:
+        return (doc.get("created_at") or datetime.min, doc["_id"])
+
+    def _add(self, doc: dict):
+        key = self._key(doc)
+        self.docs[doc["_id"]] = doc
+        insort(self.order, key)
+        insort(self.category_order[doc.get("category")], key)
+
+    def _remove(self, story_id: ObjectId) -> Optional[dict]:
+        doc = self.docs.pop(story_id, None)
+        if doc is None:
+            return None
+        key = self._key(doc)
+        for order in (self.order, self.category_order[doc.get("category")]):
+            del order[bisect_left(order, key)]
+        return doc
+
+    def _keys(self, category=None, after=None, start=None, end=None) -> List[StoryCursor]:
+        """Matching ordering keys, oldest first"""
+        order = self.category_order.get(category, []) if category else self.order
+        low = bisect_left(order, (start, MIN_OBJECT_ID)) if start else 0
+        high = len(order)
+        if end:
+            high = bisect_left(order, (end, MIN_OBJECT_ID))
+        if after:
+            high = min(high, bisect_left(order, after))
+        return order[low:high]
+
+    async def insert(self, doc: dict) -> ObjectId:
+        doc.setdefault("_id", ObjectId())
+        if doc["_id"] in self.docs:
+            raise ValueError(f"Duplicate story id {doc['_id']}")
+        stored = self.body_codec.pack(doc)
+        if self.journal:
+            self.journal.put_stories([stored])
+        self._add(stored)
+        return doc["_id"]
+
+    async def insert_many(self, docs: List[dict]) -> Dict[int, str]:
+        failures = {}
+        inserted = []
+        for index, doc in enumerate(docs):
+            doc.setdefault("_id", ObjectId())
+            if doc["_id"] in self.docs:
+                failures[index] = f"Duplicate story id {doc['_id']}"
+                continue
+            inserted.append(self.body_codec.pack(doc))
+        if self.journal and inserted:
+            self.journal.put_stories(inserted)
+        for doc in inserted:
+            self._add(doc)
+        return failures
+
+    def _full(self, doc: dict) -> dict:
+        return self.body_codec.unpack(dict(doc))
+
+    async def get(self, story_id: ObjectId) -> Optional[dict]:
+        doc = self.docs.get(story_id)
+        return self._full(doc) if doc else None
+
+    async def get_many(self, story_ids: List[ObjectId], summary: bool = False) -> List[dict]:
+        docs = [self.docs[story_id] for story_id in story_ids if story_id in self.docs]
+        return [summarize_story(doc) if summary else self._full(doc) for doc in docs]
+
+    async def list(self, limit: int, after: Optional[StoryCursor] = None,
+                   category: Optional[str] = None, summary: bool = False) -> List[dict]:
+        keys = self._keys(category, after)
+        docs = [self.docs[story_id] for _, story_id in reversed(keys[-limit:])]
+        return [summarize_story(doc) if summary else self._full(doc) for doc in docs]
+
+    async def scan(self, category: Optional[str] = None, start: Optional[datetime] = None,
+                   end: Optional[datetime] = None, fields=None, batch_size: int = 500):
+        keys = self._keys(category, start=start, end=end)
+        for position, (_, story_id) in enumerate(reversed(keys), 1):
+            doc = self.docs.get(story_id)
+            if doc is not None:
+                yield self._full(doc)
+            if position % batch_size == 0:
+                # Let other requests run between batches, like a driver round trip would
+                await asyncio.sleep(0)
+
+    async def scan_unanalyzed(self, version: int, fields, batch_size: int = 500):
+        stale = [story_id for story_id, doc in self.docs.items()
+                 if (doc.get("analytics") or {}).get("version") != version]
+        for position, story_id in enumerate(stale, 1):
+            doc = self.docs.get(story_id)
+            if doc is not None:
+                if any(field in STORY_BODY_FIELDS for field in fields):
+                    doc = self._full(doc)
+                yield {"_id": story_id, **{field: doc.get(field) for field in fields}}
+            if position % batch_size == 0:
+                await asyncio.sleep(0)
+
+    async def set_fields_many(self, updates: List[Tuple[ObjectId, dict]]):
+        changed = []
+        for story_id, fields in updates:
+            doc = self.docs.get(story_id)
+            if doc is not None:
+                doc.update(fields)
+                changed.append(doc)
+        if self.journal and changed:
+            self.journal.put_stories(changed)
+
+    async def delete(self, story_id: ObjectId) -> Optional[dict]:
+        doc = self._remove(story_id)
+        if doc is not None and self.journal:
+            self.journal.delete_story(story_id)
+        return doc
+
+    async def totals_by_student(self) -> Dict[str, Tuple[int, int]]:
+        totals: Dict[str, Tuple[int, int]] = {}
+        for doc in self.docs.values():
+            count, words = totals.get(doc.get("student_id", DEFAULT_STUDENT_ID), (0, 0))
+            totals[doc.get("student_id", DEFAULT_STUDENT_ID)] = (count + 1, words + doc.get("word_count", 0))
+        return totals
+
+    async def migrate_owner(self) -> int:
+        legacy = [doc for doc in self.docs.values() if "student_id" not in doc]
+        for doc in legacy:
+            doc["student_id"] = DEFAULT_STUDENT_ID
+        if self.journal and legacy:
+            self.journal.put_stories(legacy)
+        return len(legacy)
+
+    async def storage_size(self) -> dict:
+        """Document count and BSON size of the stories as stored"""
+        return {
+            "documents": len(self.docs),
+            "data_bytes": sum(len(bson.encode(doc)) for doc in self.docs.values())
+        }
+
+class EmbeddedProgressRepository:
+    def __init__(self, journal: Optional[SQLiteJournal]):
+        self.journal = journal
+        self.docs: Dict[str, dict] = {}
+
+    def _save(self, *docs: dict):
+        if self.journal:
+            self.journal.put_progress(list(docs))
+        for doc in docs:
+            self.docs[doc["student_id"]] = doc
+
+    def _new(self, student_id: str, defaults: dict) -> dict:
+        return {"_id": ObjectId(), "student_id": student_id, **defaults}
+
+    async def get(self, student_id: str) -> Optional[dict]:
+        doc = self.docs.get(student_id)
+        return dict(doc) if doc else None
+
+    async def get_or_create(self, student_id: str, defaults: dict) -> dict:
+        if student_id not in self.docs:
+            self._save(self._new(student_id, defaults))
+        return dict(self.docs[student_id])
+
+    async def increment_many(self, increments: List[Tuple[str, Dict[str, int], Optional[str]]], defaults: dict):
+        updated = []
+        for student_id, deltas, class_id in increments:
+            # Nested counters are copied too, since callers hold shallow copies of the stored doc
+            current = self.docs.get(student_id) or self._new(student_id, defaults)
+            doc = {field: dict(value) if isinstance(value, dict) else value for field, value in current.items()}
+            for field, delta in deltas.items():
+                increment_path(doc, field, delta)
+            if class_id:
+                doc["class_id"] = class_id
+            doc["updated_at"] = datetime.utcnow()
+            updated.append(doc)
+        if updated:
+            self._save(*updated)
+
+    async def set(self, student_id: str, fields: dict) -> dict:
+        doc = dict(self.docs.get(student_id) or self._new(student_id, {}))
+        doc.update(fields)
+        self._save(doc)
+        return dict(doc)
+
+    async def adjust(self, student_id: str, observed: dict, deltas: Dict[str, int]) -> bool:
+        current = self.docs.get(student_id)
+        if current is None or any(current.get(field) != value for field, value in observed.items()):
+            return False
+        doc = {field: dict(value) if isinstance(value, dict) else value for field, value in current.items()}
+        for field, delta in deltas.items():
+            increment_path(doc, field, delta)
+        doc["updated_at"] = datetime.utcnow()
+        self._save(doc)
+        return True
+
+    async def get_many(self, student_ids: List[str]) -> List[dict]:
+        return [dict(self.docs[student_id]) for student_id in student_ids if student_id in self.docs]
+
+    async def all(self) -> List[dict]:
+        return [dict(doc) for doc in self.docs.values()]
+
+    async def class_rollup(self, class_id: str) -> dict:
+        return class_rollup(doc for doc in self.docs.values() if doc.get("class_id") == class_id)
+
+class EmbeddedDraftRepository:
+    def __init__(self, journal: Optional[SQLiteJournal]):
+        self.journal = journal
+        self.docs: Dict[ObjectId, dict] = {}
+
+    async def get(self, draft_id: ObjectId) -> Optional[dict]:
+        doc = self.docs.get(draft_id)
+        return dict(doc) if doc else None
+
+    async def put(self, doc: dict):
+        if self.journal:
+            self.journal.put_draft(doc)
+        self.docs[doc["_id"]] = dict(doc)
+
+    async def delete(self, draft_id: ObjectId):
+        if self.journal:
+            self.journal.delete_draft(draft_id)
+        self.docs.pop(draft_id, None)
+
+    async def list(self, student_id: str, limit: int) -> List[dict]:
+        drafts = [doc for doc in self.docs.values() if doc.get("student_id") == student_id]
+        drafts.sort(key=lambda doc: doc["updated_at"], reverse=True)
+        return [dict(doc) for doc in drafts[:limit]]
+
+class EmbeddedIdempotencyRepository:
+    """Kept in memory only: claims outlive client retries, not server restarts"""
+
+    def __init__(self):
+        self.docs: Dict[str, dict] = {}
+        self.sweep_at = 1024
+
+    async def claim(self, key: str, fingerprint: str, expires_at: datetime) -> Optional[dict]:
+        now = datetime.utcnow()
+        existing = self.docs.get(key)
+        if existing and existing["expires_at"] > now:
+            return dict(existing)
+        if len(self.docs) >= self.sweep_at:
+            self.docs = {claimed: doc for claimed, doc in self.docs.items() if doc["expires_at"] > now}
+            self.sweep_at = max(1024, 2 * len(self.docs))
+        self.docs[key] = {"_id": key, "fingerprint": fingerprint, "story_id": None, "expires_at": expires_at}
+        return None
+
+    async def get(self, key: str) -> Optional[dict]:
+        doc = self.docs.get(key)
+        return dict(doc) if doc and doc["expires_at"] > datetime.utcnow() else None
+
+    async def complete(self, key: str, story_id: ObjectId, expires_at: datetime):
+        if key in self.docs:
+            self.docs[key].update(story_id=story_id, expires_at=expires_at)
+
+    async def release(self, key: str, story_id: Optional[ObjectId] = None):
+        if key in self.docs and self.docs[key]["story_id"] == story_id:
+            del self.docs[key]
+
+class EmbeddedRollupRepository:
+    def __init__(self, journal: Optional[SQLiteJournal]):
+        self.journal = journal
+        self.docs: Dict[Tuple[str, str], dict] = {}
+        self.keys: List[Tuple[str, str]] = []
+
+    def load(self, docs):
+        for doc in docs:
+            self.docs[(doc["day"], doc["category"])] = doc
+        self.keys = sorted(self.docs)
+
+    async def apply(self, changes: Dict[Tuple[str, str], dict]):
+        changed = []
+        for key, change in changes.items():
+            doc = self.docs.get(key)
+            if doc is None:
+                doc = self.docs[key] = {"day": key[0], "category": key[1], "stories_count": 0,
+                                        "total_words": 0, "authors": {}}
+                insort(self.keys, key)
+            doc["stories_count"] += change["stories_count"]
+            doc["total_words"] += change["total_words"]
+            for author, stories in change["authors"].items():
+                doc["authors"][author] = doc["authors"].get(author, 0) + stories
+            changed.append(doc)
+        if self.journal and changed:
+            self.journal.put_rollups(changed)
+
+    async def range(self, start: Optional[str] = None, end: Optional[str] = None,
+                    category: Optional[str] = None) -> List[dict]:
+        low = bisect_left(self.keys, (start,)) if start else 0
+        # Every (end, category) key sorts below (end + "\0",)
+        high = bisect_left(self.keys, (end + "\0",)) if end else len(self.keys)
+        return [
+            {**self.docs[key], "authors": dict(self.docs[key]["authors"])}
+            for key in self.keys[low:high] if not category or key[1] == category
+        ]
+
+    async def count(self) -> int:
+        return len(self.docs)
+
+    async def adjust(self, day: str, category: str, observed: Optional[dict], change: dict) -> bool:
+        doc = self.docs.get((day, category))
+        if observed is None:
+            if doc is not None:
+                return False
+        elif doc is None or any(doc[field] != value for field, value in observed.items()):
+            return False
+        await self.apply({(day, category): change})
+        return True
+
+class EmbeddedStorage:
+    """In-process engine for single-classroom deployments, tests and benchmarks
+
+    With a path, every write is also journaled to SQLite (WAL) and reloaded by open().
+    """
+    name = "embedded"
+
+    def __init__(self, path: Optional[str] = None, body_compression: str = "none"):
+        self.journal = SQLiteJournal(path) if path else None
+        self.stories = EmbeddedStoryRepository(self.journal, StoryBodyCodec(body_compression))
+        self.progress = EmbeddedProgressRepository(self.journal)
+        self.rollups = EmbeddedRollupRepository(self.journal)
+        self.drafts = EmbeddedDraftRepository(self.journal)
+        self.idempotency = EmbeddedIdempotencyRepository()
+
+    async def open(self):
+        if self.journal:
+            self.stories.load(self.journal.load_stories())
+            for doc in self.journal.load_progress():
+                self.progress.docs[doc["student_id"]] = doc
+            self.rollups.load(self.journal.load_rollups())
+            self.drafts.docs = {doc["_id"]: doc for doc in self.journal.load_drafts()}
+            logger.info(f"Loaded {len(self.stories.docs)} stories from the embedded store")
+
+    async def migrate(self):
+        """One-shot upgrade of data written before per-student progress; idempotent"""
+        legacy = self.journal.pop_legacy_progress() if self.journal else None
+        if legacy and DEFAULT_STUDENT_ID not in self.progress.docs:
+            self.progress._save({**legacy, "student_id": DEFAULT_STUDENT_ID})
+        stories = await self.stories.migrate_owner()
+        if legacy or stories:
+            logger.info(f"Migrated legacy progress and {stories} stories to per-student progress")
+        return (1 if legacy else 0) + stories
+
+    async def ping(self):
+        if self.journal:
+            self.journal.ping()
+
+    async def ensure_indexes(self):
+        pass
+
+    async def verify_query_plans(self):
+        logger.info("Query plan check skipped: the embedded engine has no query planner")
+
+    async def clear(self):
+        """Remove every story and progress document (benchmarks only)"""
+        if self.journal:
+            self.journal.clear()
+        self.stories.docs.clear()
+        self.stories.order.clear()
+        self.stories.category_order.clear()
+        self.progress.docs.clear()
+        self.rollups.docs.clear()
+        self.rollups.keys.clear()
+        self.drafts.docs.clear()
+        self.idempotency.docs.clear()
+
+    def close(self):
+        if self.journal:
+            self.journal.close()
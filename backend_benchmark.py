@@ -0,0 +1,819 @@
+#!/usr/bin/env python3
+"""
+Story Master API Benchmark Suite
+Boots backend/server.py's app in-process, seeds a throwaway store and drives
+concurrent workloads through an async client, reporting per-route latency
+percentiles and throughput as JSON so runs can be compared across commits.
+
+Benchmarks DROP AND RESEED the stories and user_progress collections of --db-name
+(or wipe --storage-path when running on the embedded engine).
+
+Usage:
+    python backend_benchmark.py --storage embedded --output bench.json
+    python backend_benchmark.py --mongo-url mongodb://localhost:27017 --output bench.json
+    python backend_benchmark.py --suites load --workloads gallery,mixed --corpus-sizes 10000
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+
+# Imported by load_server() once the storage settings from the command line are in place
+server = None
+
+SAMPLE_STORY = {
+    "title": "The Magical Forest Adventure",
+    "category": "Fantasy",
+    "introduction": "Once upon a time, there was a young explorer named Emma who discovered a hidden path in her backyard.",
+    "middle": "Emma met a wise old owl who told her about a lost treasure that could save the forest from an evil wizard.",
+    "conclusion": "After finding the treasure, Emma learned that the real magic was the friendship she made with the forest creatures.",
+    "word_count": 60,
+    "date_completed": "2024-12-19",
+    "student_name": "Emma Johnson"
+}
+
+WORDS = ("dragon", "castle", "puppy", "rocket", "forest", "pirate", "robot", "garden",
+         "ocean", "wizard", "kitten", "mountain", "treasure", "friend", "school", "storm")
+VERBS = ("chased", "found", "helped", "followed", "hid from", "sang to", "raced", "waved at")
+CATEGORIES = ("Adventure", "Fantasy", "Friendship", "Family", "Mystery", "Animals")
+SEARCH_QUERIES = ("dragon", "tre", "puppy castle", "wiz", "ocean storm")
+# One classroom's worth of writers; submits and polls are spread across them
+STUDENT_IDS = tuple(f"student-{n}" for n in range(30))
+CLASS_ID = "bench-class"
+
+def load_server(args):
+    global server
+    os.environ["STORAGE_ENGINE"] = args.storage
+    os.environ["MONGO_URL"] = args.mongo_url
+    os.environ["DB_NAME"] = args.db_name
+    if args.storage_path:
+        os.environ["STORAGE_PATH"] = args.storage_path
+    import server as server_module
+    server = server_module
+
+def make_story(i):
+    """Build a stored story document for seeding"""
+    words = [WORDS[(i * 7 + k * 3) % len(WORDS)] for k in range(3)]
+    return server.Story(**{
+        **SAMPLE_STORY,
+        "title": f"Story {i}: the {words[0]} and the {words[1]}",
+        "category": CATEGORIES[i % len(CATEGORIES)],
+        "middle": f"{SAMPLE_STORY['middle']} Then a {words[2]} appeared.",
+        "word_count": 50 + i % 100,
+        "student_id": STUDENT_IDS[i % len(STUDENT_IDS)],
+        "class_id": CLASS_ID
+    }).dict()
+
+def make_long_story(i, sentences=10):
+    """A story of a few hundred words, the length practiced writers reach"""
+    rng = random.Random(i)
+    doc = make_story(i)
+    for section in ("introduction", "middle", "conclusion"):
+        extra = [
+            f"The {rng.choice(WORDS)} {rng.choice(VERBS)} the {rng.choice(WORDS)} near the {rng.choice(WORDS)}."
+            for _ in range(sentences)
+        ]
+        doc[section] = " ".join([doc[section]] + extra)
+    doc["word_count"] = sum(len(doc[section].split()) for section in ("introduction", "middle", "conclusion"))
+    return doc
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def summarize(samples):
+    """Latency summary in milliseconds"""
+    return {
+        "count": len(samples),
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 95) * 1000, 3),
+        "p99_ms": round(percentile(samples, 99) * 1000, 3),
+        "mean_ms": round(statistics.mean(samples) * 1000, 3)
+    }
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, cwd=Path(__file__).parent
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+async def seed_stories(count, batch_size=1000, factory=make_story):
+    """Wipe and reseed the store, then bring server-side state back in line"""
+    await server.storage.clear()
+    for start in range(0, count, batch_size):
+        batch = [factory(i) for i in range(start, min(count, start + batch_size))]
+        await server.storage.stories.insert_many(batch)
+    # Seeding bypasses the write routes, so rebuild what they would have maintained
+    await server.reconcile_progress()
+    await server.rebuild_stats()
+    server.story_index = server.StoryIndex()
+    await server.story_index.build(server.storage.stories)
+    server.response_cache.invalidate("stories", *(f"progress:{student_id}" for student_id in STUDENT_IDS))
+
+async def sample_story_ids(count=1000):
+    return [str(doc["_id"]) for doc in await server.storage.stories.list(count, summary=True)]
+
+# Workload operations; each returns the route template it exercised and the response
+async def op_gallery_page(client, state):
+    params = {"fields": "summary", "limit": 50}
+    if state["cursors"] and state["rng"].random() < 0.3:
+        params["after"] = state["rng"].choice(state["cursors"])
+    response = await client.get("/api/stories", params=params)
+    if "x-next-cursor" in response.headers and len(state["cursors"]) < 100:
+        state["cursors"].append(response.headers["x-next-cursor"])
+    return "GET /api/stories", response
+
+async def op_open_story(client, state):
+    story_id = state["rng"].choice(state["story_ids"])
+    return "GET /api/stories/{story_id}", await client.get(f"/api/stories/{story_id}")
+
+async def op_search(client, state):
+    q = state["rng"].choice(SEARCH_QUERIES)
+    return "GET /api/stories/search", await client.get("/api/stories/search", params={"q": q})
+
+async def op_submit(client, state):
+    story = {**SAMPLE_STORY, "title": f"Burst story {state['rng'].random()}",
+             "student_id": state["rng"].choice(STUDENT_IDS), "class_id": CLASS_ID}
+    return "POST /api/stories", await client.post("/api/stories", json=story)
+
+async def op_poll_progress(client, state):
+    student_id = state["rng"].choice(STUDENT_IDS)
+    etags = state.setdefault("progress_etags", {})
+    headers = {"If-None-Match": etags[student_id]} if student_id in etags else {}
+    response = await client.get("/api/progress", params={"student_id": student_id}, headers=headers)
+    if "etag" in response.headers:
+        etags[student_id] = response.headers["etag"]
+    return "GET /api/progress", response
+
+WORKLOADS = {
+    "gallery": [(0.6, op_gallery_page), (0.25, op_open_story), (0.15, op_search)],
+    "submit_burst": [(1.0, op_submit)],
+    "progress_polling": [(1.0, op_poll_progress)],
+    "mixed": [(0.45, op_gallery_page), (0.15, op_open_story), (0.1, op_search),
+              (0.1, op_submit), (0.2, op_poll_progress)]
+}
+
+async def run_workload(client, name, story_ids, concurrency, total_requests, seed=0):
+    """Drive one workload with `concurrency` workers until total_requests have completed"""
+    weights, operations = zip(*WORKLOADS[name])
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    remaining = total_requests
+
+    async def worker(worker_id):
+        nonlocal remaining
+        state = {"rng": random.Random(seed * 1000 + worker_id), "story_ids": story_ids, "cursors": []}
+        while remaining > 0:
+            remaining -= 1
+            operation = state["rng"].choices(operations, weights)[0]
+            started = time.perf_counter()
+            try:
+                route, response = await operation(client, state)
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                route, failed = operation.__name__, True
+            latencies[route].append(time.perf_counter() - started)
+            if failed:
+                errors[route] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    routes = {
+        route: {**summarize(samples), "errors": errors[route], "rps": round(len(samples) / elapsed, 1)}
+        for route, samples in sorted(latencies.items())
+    }
+    return {
+        "concurrency": concurrency,
+        "requests": total_requests,
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(total_requests / elapsed, 1),
+        "routes": routes
+    }
+
+async def bench_load(client, corpus_sizes, workloads, concurrency, total_requests):
+    """Concurrent mixed workloads against each seeded corpus size"""
+    print("\n=== Benchmarking concurrent workloads ===")
+    results = {}
+    for size in corpus_sizes:
+        results[str(size)] = {}
+        for name in workloads:
+            # Reseed per workload so submit bursts don't skew the next run
+            await seed_stories(size)
+            story_ids = await sample_story_ids()
+            result = await run_workload(client, name, story_ids, concurrency, total_requests)
+            results[str(size)][name] = result
+            print(f"{size:>7} stories, {name:<16} {result['rps']:>8} req/s")
+            for route, stats in result["routes"].items():
+                print(f"    {route:<30} p50 {stats['p50_ms']:>8}ms  p95 {stats['p95_ms']:>8}ms  "
+                      f"p99 {stats['p99_ms']:>8}ms  errors {stats['errors']}")
+    return results
+
+async def bench_create_story(client, corpus_sizes=(100, 1000, 10000, 100000), requests_per_size=50):
+    """POST /api/stories latency should stay flat as the corpus grows"""
+    print("\n=== Benchmarking POST /api/stories vs corpus size ===")
+    results = {}
+    for size in corpus_sizes:
+        await seed_stories(size)
+        samples = []
+        for n in range(requests_per_size):
+            # Distinct titles, or the server would answer repeats as replays of the first
+            story = {**SAMPLE_STORY, "title": f"{SAMPLE_STORY['title']} {n}"}
+            started = time.perf_counter()
+            response = await client.post("/api/stories", json=story)
+            samples.append(time.perf_counter() - started)
+            response.raise_for_status()
+        results[str(size)] = summarize(samples)
+        print(f"{size:>7} stories: {results[str(size)]}")
+
+    report = await server.reconcile_progress()
+    print(f"Progress drift after run: {report['drift'] or 'none'}")
+    return results
+
+class StorageOpCounter:
+    """Counts calls into the storage repositories while active; each is one store round trip"""
+
+    def __init__(self):
+        self.calls = defaultdict(int)
+        self.patched = []
+
+    def __enter__(self):
+        for repository_name in ("stories", "progress", "rollups"):
+            repository = getattr(server.storage, repository_name)
+            for name in dir(type(repository)):
+                method = getattr(repository, name)
+                if name.startswith("_") or not asyncio.iscoroutinefunction(method):
+                    continue
+                setattr(repository, name, self.wrap(f"{repository_name}.{name}", method))
+                self.patched.append((repository, name))
+        return self
+
+    def wrap(self, label, method):
+        async def counted(*args, **kwargs):
+            self.calls[label] += 1
+            return await method(*args, **kwargs)
+        return counted
+
+    def __exit__(self, *exc_info):
+        for repository, name in self.patched:
+            delattr(repository, name)
+
+    @property
+    def total(self):
+        return sum(self.calls.values())
+
+def mongo_command_count():
+    return sum(histogram.count for histogram in server.metrics.commands.values())
+
+async def bench_submit_burst(client, submissions=50, corpus_size=1000):
+    """50 students pressing save at once, one write per story versus group commit"""
+    print(f"\n=== Benchmarking {submissions} simultaneous submissions ===")
+    batcher = server.story_writes
+    max_batch = batcher.max_batch
+    results = {}
+    try:
+        # A batch size of 1 flushes every submission on its own, as before group commit
+        for name, batch_size in (("per_request", 1), ("group_commit", max_batch)):
+            await seed_stories(corpus_size)
+            batcher.max_batch = batch_size
+            stories = [
+                {**SAMPLE_STORY, "title": f"Burst story {n}", "middle": f"{SAMPLE_STORY['middle']} Take {n}.",
+                 "student_id": STUDENT_IDS[n % len(STUDENT_IDS)], "class_id": CLASS_ID}
+                for n in range(submissions)
+            ]
+            commands_before = mongo_command_count()
+            batches_before = batcher.stats["batches"]
+            with StorageOpCounter() as ops:
+                started = time.perf_counter()
+                responses = await asyncio.gather(*(client.post("/api/stories", json=story) for story in stories))
+                wall = time.perf_counter() - started
+            errors = sum(1 for response in responses if response.status_code != 200)
+            results[name] = {
+                "wall_ms": round(wall * 1000, 3),
+                "errors": errors,
+                "batches": batcher.stats["batches"] - batches_before,
+                "storage_ops": ops.total,
+                "storage_ops_by_method": dict(ops.calls)
+            }
+            if server.storage.name == "mongo":
+                results[name]["mongo_commands"] = mongo_command_count() - commands_before
+            print(f"{name:>12}: {results[name]['wall_ms']}ms wall, {results[name]['batches']} batches, "
+                  f"{results[name]['storage_ops']} storage ops, {errors} errors")
+    finally:
+        batcher.max_batch = max_batch
+
+    report = await server.reconcile_progress()
+    print(f"Progress drift after run: {report['drift'] or 'none'}")
+    return results
+
+async def scan_search(term, category=None):
+    """The pre-index approach: pull every story and substring-match it"""
+    matches = []
+    async for story in server.storage.stories.scan(category=category):
+        content = " ".join(story.get(field, "") for field in server.StoryIndex.TEXT_FIELDS)
+        if term.lower() in content.lower():
+            matches.append(story)
+    return matches
+
+async def bench_search(client, corpus_sizes=(10000, 100000), rounds=10):
+    """GET /api/stories/search latency versus scanning the whole corpus"""
+    print("\n=== Benchmarking story search vs corpus size ===")
+    results = {}
+    for size in corpus_sizes:
+        await seed_stories(size)
+        server.story_index = server.StoryIndex()
+        started = time.perf_counter()
+        await server.story_index.build(server.storage.stories)
+        build_seconds = time.perf_counter() - started
+
+        indexed, scanned = [], []
+        for _ in range(rounds):
+            for q in SEARCH_QUERIES:
+                started = time.perf_counter()
+                response = await client.get("/api/stories/search", params={"q": q})
+                indexed.append(time.perf_counter() - started)
+                response.raise_for_status()
+        for q in SEARCH_QUERIES:
+            started = time.perf_counter()
+            await scan_search(q)
+            scanned.append(time.perf_counter() - started)
+
+        results[str(size)] = {
+            "index_build_s": round(build_seconds, 3),
+            "indexed": summarize(indexed),
+            "scan": summarize(scanned)
+        }
+        print(f"{size:>7} stories: {results[str(size)]}")
+    return results
+
+async def bench_metrics_overhead(client, concurrency, total_requests, corpus_size=1000):
+    """Cost of the metrics middleware and command listener on the hot path"""
+    print("\n=== Benchmarking metrics overhead ===")
+    calls = 100000
+    started = time.perf_counter()
+    for _ in range(calls):
+        server.metrics.observe_request("GET", "/api/progress", 200, 0.001)
+    observe_ns = (time.perf_counter() - started) / calls * 1e9
+
+    await seed_stories(corpus_size)
+    story_ids = await sample_story_ids()
+    results = {"observe_request_ns": round(observe_ns, 1)}
+    for enabled in (False, True):
+        server.metrics.enabled = enabled
+        result = await run_workload(client, "gallery", story_ids, concurrency, total_requests)
+        results["enabled" if enabled else "disabled"] = {"rps": result["rps"], "routes": result["routes"]}
+    print(f"observe_request: {results['observe_request_ns']}ns/call, "
+          f"gallery {results['disabled']['rps']} req/s without metrics, {results['enabled']['rps']} req/s with")
+    return results
+
+async def event_loop_lag(stop, interval=0.001):
+    """Worst delay between asking to wake after interval and actually waking"""
+    worst = 0.0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - started - interval)
+    return worst
+
+async def bench_analytics(corpus_size=20000, batch_size=500):
+    """Analytics backfill throughput per executor, and how much each stalls the event loop"""
+    print("\n=== Benchmarking analytics backfill ===")
+    analyzer = server.story_analyzer
+    cache_size = analyzer.cache_size
+    results = {}
+    try:
+        for kind in ("inline", "thread", "process"):
+            await seed_stories(corpus_size)
+            analyzer.close()
+            # Seeded stories share most of their text, so measure with the content-hash cache off
+            analyzer.executor_kind, analyzer.cache_size = kind, 0
+            analyzer.cache.clear()
+
+            stop = asyncio.Event()
+            lag = asyncio.create_task(event_loop_lag(stop))
+            report = await server.backfill_analytics(batch_size)
+            stop.set()
+            results[kind] = {**report, "max_loop_lag_ms": round(await lag * 1000, 3)}
+            print(f"{kind:>8}: {report['stories_per_second']:>9} stories/s, "
+                  f"max event loop lag {results[kind]['max_loop_lag_ms']}ms")
+
+        # Re-analyzing unchanged text should be answered from the content-hash cache
+        analyzer.cache_size = cache_size
+        stories = [story async for story in server.storage.stories.scan(fields=server.SECTIONS)]
+        await analyzer.analyze_many(stories)
+        started = time.perf_counter()
+        await analyzer.analyze_many(stories)
+        seconds = time.perf_counter() - started
+        results["cached"] = {"stories": len(stories), "stories_per_second": round(len(stories) / seconds, 1)}
+        print(f"  cached: {results['cached']['stories_per_second']:>9} stories/s")
+    finally:
+        analyzer.close()
+        analyzer.executor_kind = os.environ.get("ANALYTICS_EXECUTOR", "process")
+        analyzer.cache_size = cache_size
+    return results
+
+def bench_serialization(story_count=1000, rounds=50):
+    """Encode time for a page of stories: jsonable_encoder + json versus the orjson BSON encoder"""
+    from bson import ObjectId
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+
+    print(f"\n=== Benchmarking JSON encoding of {story_count} stories ===")
+    stories = [{**make_story(i), "_id": ObjectId()} for i in range(story_count)]
+
+    def previous_encode(docs):
+        # What responses did before: stringify _id in place, jsonable_encoder, then json.dumps
+        docs = [dict(doc) for doc in docs]
+        for doc in docs:
+            doc["_id"] = str(doc["_id"])
+        return JSONResponse(jsonable_encoder(docs)).body
+
+    results = {}
+    for name, encode in (("jsonable_encoder", previous_encode), ("orjson", server.dumps)):
+        samples = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            encode(stories)
+            samples.append(time.perf_counter() - started)
+        results[name] = summarize(samples)
+        print(f"{name:>16}: p50 {results[name]['p50_ms']}ms  p95 {results[name]['p95_ms']}ms")
+    results["speedup_p50"] = round(results["jsonable_encoder"]["p50_ms"] / results["orjson"]["p50_ms"], 1)
+    print(f"{'speedup':>16}: {results['speedup_p50']}x")
+    return results
+
+async def bench_compression(client, corpus_size=2000, rounds=20):
+    """Bytes on the wire per response encoding and stored story size per body codec"""
+    from compression import response_encodings
+    from storage import StoryBodyCodec
+
+    print(f"\n=== Benchmarking compression on {corpus_size} stories ===")
+    stories = server.storage.stories
+    configured = stories.body_codec
+    results = {"storage": {}, "wire": {}}
+    try:
+        # Short sample stories stay plain under every codec; long ones show what compaction saves
+        for corpus, factory in (("sample", make_story), ("long", make_long_story)):
+            sizes = results["storage"][corpus] = {}
+            for name in ("none",) + tuple(configured.codecs):
+                stories.body_codec = StoryBodyCodec(name)
+                await seed_stories(corpus_size, factory=factory)
+                sizes[name] = await stories.storage_size()
+            for name, size in sizes.items():
+                for measure in ("data_bytes", "storage_bytes"):
+                    if measure in size and sizes["none"].get(measure):
+                        size[f"{measure}_ratio"] = round(size[measure] / sizes["none"][measure], 3)
+                print(f"{corpus:>6} {name:>4}: {size['data_bytes']:>10} data bytes ({size['data_bytes_ratio']:.0%})"
+                      + (f", {size['storage_bytes']} on disk" if "storage_bytes" in size else ""))
+    finally:
+        stories.body_codec = configured
+
+    # Wire sizes are measured on long stories in the configured storage format
+    await seed_stories(corpus_size, factory=make_long_story)
+    story_id = (await sample_story_ids(1))[0]
+    routes = {
+        "gallery_full": "/api/stories?limit=100",
+        "gallery_summary": "/api/stories?limit=100&fields=summary",
+        "story": f"/api/stories/{story_id}",
+        "export_ndjson": "/api/stories/export?format=ndjson"
+    }
+    for route, url in routes.items():
+        results["wire"][route] = {}
+        for encoding in ("identity",) + response_encodings():
+            samples = []
+            for _ in range(rounds):
+                started = time.perf_counter()
+                response = await client.get(url, headers={"Accept-Encoding": encoding})
+                samples.append(time.perf_counter() - started)
+            results["wire"][route][encoding] = {
+                "bytes": response.num_bytes_downloaded,
+                "content_encoding": response.headers.get("content-encoding", "identity"),
+                **summarize(samples)
+            }
+        identity = results["wire"][route]["identity"]["bytes"]
+        print(f"{route:>16}: " + ", ".join(
+            f"{encoding} {figures['bytes']}B ({figures['bytes'] / identity:.0%}, p50 {figures['p50_ms']}ms)"
+            for encoding, figures in results["wire"][route].items()
+        ))
+    return results
+
+class DelayedTransport(httpx.AsyncBaseTransport):
+    """Adds a fixed round-trip time to every request, like a slow school network"""
+
+    def __init__(self, transport, rtt):
+        self.transport = transport
+        self.rtt = rtt
+
+    async def handle_async_request(self, request):
+        await asyncio.sleep(self.rtt)
+        return await self.transport.handle_async_request(request)
+
+async def bench_bootstrap(rtt_ms=150, corpus_size=1000, rounds=10):
+    """App start and story save as the app did them (sequential requests) versus one round trip each"""
+    print(f"\n=== Benchmarking app start and save at {rtt_ms}ms RTT ===")
+    await seed_stories(corpus_size)
+    student_id = STUDENT_IDS[0]
+    params = {"student_id": student_id}
+
+    async def start_sequential(client):
+        await client.get("/api/progress", params=params)
+        await client.get("/api/stories", params={"fields": "summary"})
+
+    async def start_bootstrap(client):
+        await client.get("/api/bootstrap", params=params)
+
+    saves = itertools.count()
+
+    def new_story():
+        return {**SAMPLE_STORY, "title": f"Bootstrap story {next(saves)}", "student_id": student_id}
+
+    async def save_then_refresh(client):
+        await client.post("/api/stories", json=new_story())
+        await client.get("/api/progress", params=params)
+
+    async def save(client):
+        await client.post("/api/stories", json=new_story())
+
+    flows = {"start_sequential": start_sequential, "start_bootstrap": start_bootstrap,
+             "save_then_refresh": save_then_refresh, "save": save}
+    transport = DelayedTransport(httpx.ASGITransport(app=server.app), rtt_ms / 1000)
+    results = {}
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for name, flow in flows.items():
+            samples = []
+            for _ in range(rounds):
+                started = time.perf_counter()
+                await flow(client)
+                samples.append(time.perf_counter() - started)
+            results[name] = summarize(samples)
+            print(f"{name:>18}: p50 {results[name]['p50_ms']}ms")
+    return results
+
+class EventStreamClient:
+    """One SSE connection driven straight through the ASGI app
+
+    httpx's ASGITransport waits for the app to finish before returning a response,
+    which an event stream never does, so frames are collected from send() instead.
+    """
+
+    def __init__(self, path="/api/stories/events"):
+        self.frames = asyncio.Queue()
+        self.disconnected = asyncio.Event()
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+            "headers": [(b"host", b"bench")], "server": ("bench", 80), "client": ("bench", 1)
+        }
+        self.task = asyncio.create_task(server.app(scope, self.receive, self.send))
+
+    async def receive(self):
+        await self.disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(self, message):
+        if message["type"] == "http.response.body" and message.get("body"):
+            self.frames.put_nowait(message["body"])
+
+    async def wait_for_event(self, event):
+        while True:
+            frame = await self.frames.get()
+            if f"event: {event}".encode() in frame:
+                return
+
+    async def close(self):
+        self.disconnected.set()
+        await self.task
+
+async def bench_sse_idle(subscriber_counts=(0, 100, 500), idle_seconds=5.0, heartbeat_seconds=(15.0, 1.0),
+                         max_cpu_percent=5.0):
+    """CPU used by open but idle event streams, and how long one event takes to reach all of them
+
+    Runs whose idle CPU exceeds max_cpu_percent are listed under "failures".
+    """
+    print(f"\n=== Benchmarking idle SSE subscribers over {idle_seconds}s ===")
+    await seed_stories(100)
+    heartbeat = server.story_events.heartbeat
+    results = {"max_cpu_percent": max_cpu_percent, "failures": []}
+    try:
+        for seconds in heartbeat_seconds:
+            server.story_events.heartbeat = seconds
+            for count in subscriber_counts:
+                clients = [EventStreamClient() for _ in range(count)]
+                await asyncio.sleep(0.1)
+                for client in clients:
+                    client.frames = asyncio.Queue()
+                cpu_started = time.process_time()
+                await asyncio.sleep(idle_seconds)
+                cpu = time.process_time() - cpu_started
+
+                started = time.perf_counter()
+                server.story_events.publish("story-created", {"_id": "bench"})
+                await asyncio.gather(*(client.wait_for_event("story-created") for client in clients))
+                fan_out = time.perf_counter() - started
+
+                await asyncio.gather(*(client.close() for client in clients))
+                name = f"heartbeat_{seconds:g}s_{count}_subscribers"
+                results[name] = {
+                    "subscribers": count,
+                    "cpu_ms": round(cpu * 1000, 3),
+                    "cpu_percent": round(cpu / idle_seconds * 100, 3),
+                    "fan_out_ms": round(fan_out * 1000, 3)
+                }
+                print(f"{name:>36}: {results[name]['cpu_ms']}ms CPU idle ({results[name]['cpu_percent']}%), "
+                      f"fan-out {results[name]['fan_out_ms']}ms")
+                if results[name]["cpu_percent"] > max_cpu_percent:
+                    results["failures"].append(name)
+                    print(f"❌ {name} used more than {max_cpu_percent}% CPU while idle")
+    finally:
+        server.story_events.heartbeat = heartbeat
+    return results
+
+async def bench_admission(client, writes=600, reads=300, corpus_size=1000):
+    """Gallery read latency during a write burst, with writes unbounded versus admission-controlled"""
+    print(f"\n=== Benchmarking {reads} gallery reads during a burst of {writes} writes ===")
+    limiter = server.admission.classes["write"].limiter
+    configured = (limiter.concurrency, limiter.queue_size)
+    results = {}
+    try:
+        for name, (concurrency, queue_size) in (("unbounded", (writes, writes)), ("admission_control", configured)):
+            await seed_stories(corpus_size)
+            limiter.concurrency, limiter.queue_size = concurrency, queue_size
+            shed_before = limiter.stats["shed_queue_full"] + limiter.stats["shed_queue_timeout"]
+
+            async def read(n):
+                await asyncio.sleep(n * 0.002)
+                started = time.perf_counter()
+                response = await client.get("/api/stories", params={"fields": "summary", "limit": 50})
+                return time.perf_counter() - started, response.status_code
+
+            write_requests = [
+                client.post("/api/stories", json={**SAMPLE_STORY, "title": f"Burst {n}",
+                                                  "student_id": STUDENT_IDS[n % len(STUDENT_IDS)]})
+                for n in range(writes)
+            ]
+            started = time.perf_counter()
+            outcome = await asyncio.gather(asyncio.gather(*write_requests), asyncio.gather(*(read(n) for n in range(reads))))
+            wall = time.perf_counter() - started
+            write_responses, read_samples = outcome
+            statuses = defaultdict(int)
+            for response in write_responses:
+                statuses[response.status_code] += 1
+            results[name] = {
+                "wall_ms": round(wall * 1000, 3),
+                "reads": summarize([seconds for seconds, _ in read_samples]),
+                "read_errors": sum(1 for _, status in read_samples if status != 200),
+                "write_statuses": dict(statuses),
+                "writes_shed": limiter.stats["shed_queue_full"] + limiter.stats["shed_queue_timeout"] - shed_before
+            }
+            print(f"{name:>18}: reads p50 {results[name]['reads']['p50_ms']}ms p95 {results[name]['reads']['p95_ms']}ms, "
+                  f"writes {dict(statuses)}, {results[name]['wall_ms']}ms wall")
+    finally:
+        limiter.concurrency, limiter.queue_size = configured
+    return results
+
+async def bench_idempotency(client, stories=50, copies=3, corpus_size=1000):
+    """Double-clicks and retries: every story submitted several times at once, with and without a key"""
+    print(f"\n=== Benchmarking {stories} stories submitted {copies} times each ===")
+    results = {}
+    for name in ("idempotency_key", "content_hash"):
+        await seed_stories(corpus_size)
+
+        async def submit(n, copy):
+            story = {**SAMPLE_STORY, "title": f"Saved twice {n}", "student_id": STUDENT_IDS[n % len(STUDENT_IDS)]}
+            headers = {"Idempotency-Key": f"save-{n}"} if name == "idempotency_key" else {}
+            # Retries land a moment after the first click
+            await asyncio.sleep(copy * 0.001)
+            started = time.perf_counter()
+            response = await client.post("/api/stories", json=story, headers=headers)
+            return time.perf_counter() - started, response
+
+        with StorageOpCounter() as ops:
+            outcome = await asyncio.gather(*(submit(n, copy) for n in range(stories) for copy in range(copies)))
+            # Late retries, after the first submission has finished, are answered from the stored story alone
+            late = [await submit(n, 0) for n in range(stories)]
+        writes = [seconds for seconds, response in outcome if "idempotent-replayed" not in response.headers]
+        # Concurrent copies wait for the first one's write, so they take at least as long
+        replays = [seconds for seconds, response in outcome if "idempotent-replayed" in response.headers]
+        story_ids = {response.json()["_id"] for _, response in outcome + late if response.status_code == 200}
+        results[name] = {
+            "requests": len(outcome) + len(late),
+            "errors": sum(1 for _, response in outcome + late if response.status_code != 200),
+            "stories_created": len(story_ids),
+            "writes": summarize(writes),
+            "concurrent_replays": summarize(replays) if replays else None,
+            "late_replays": summarize([seconds for seconds, _ in late]),
+            "storage_ops": ops.total,
+            "storage_ops_by_method": dict(ops.calls)
+        }
+        print(f"{name:>16}: {results[name]['requests']} requests -> {len(story_ids)} stories, "
+              f"write p50 {results[name]['writes']['p50_ms']}ms, "
+              f"late replay p50 {results[name]['late_replays']['p50_ms']}ms")
+
+    report = await server.reconcile_progress()
+    print(f"Progress drift after run: {report['drift'] or 'none'}")
+    return results
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--storage", choices=("embedded", "mongo"), default=os.environ.get("STORAGE_ENGINE", "mongo"))
+    parser.add_argument("--storage-path", help="SQLite file for the embedded engine (in-memory if omitted)")
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db-name", default="story_master_bench")
+    parser.add_argument("--suites", default="load,create_story,search",
+                        help="comma-separated subset of: load, create_story, search, metrics_overhead, analytics, "
+                             "serialization, submit_burst, compression, bootstrap, sse_idle, admission, idempotency")
+    parser.add_argument("--workloads", default=",".join(WORKLOADS),
+                        help=f"comma-separated subset of: {', '.join(WORKLOADS)}")
+    parser.add_argument("--corpus-sizes", default="1000,10000",
+                        help="corpus sizes for the load suite")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=2000, help="requests per workload run")
+    parser.add_argument("--sse-idle-max-cpu-percent", type=float, default=5.0,
+                        help="fail the sse_idle suite if idle subscribers use more CPU than this")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    return parser.parse_args(argv)
+
+async def main(argv=None):
+    """Run the selected benchmark suites and print a JSON report"""
+    args = parse_args(argv)
+    load_server(args)
+    suites = args.suites.split(",")
+
+    print("🚀 Starting Story Master API Benchmarks")
+    if args.storage == "mongo":
+        print(f"Database: {args.db_name} at {args.mongo_url}")
+    else:
+        print(f"Embedded storage: {args.storage_path or 'in-memory'}")
+
+    # ASGITransport does not run the lifespan handler, so bootstrap storage here
+    await server.storage.open()
+    await server.storage.ensure_indexes()
+    await server.storage.verify_query_plans()
+
+    report = {
+        "timestamp": datetime.utcnow().isoformat(),
+        "commit": current_commit(),
+        "config": vars(args)
+    }
+    transport = httpx.ASGITransport(app=server.app)
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", limits=limits) as client:
+        if "load" in suites:
+            corpus_sizes = [int(size) for size in args.corpus_sizes.split(",")]
+            report["load"] = await bench_load(
+                client, corpus_sizes, args.workloads.split(","), args.concurrency, args.requests
+            )
+        if "create_story" in suites:
+            report["create_story"] = await bench_create_story(client)
+        if "search" in suites:
+            report["search"] = await bench_search(client)
+        if "metrics_overhead" in suites:
+            report["metrics_overhead"] = await bench_metrics_overhead(client, args.concurrency, args.requests)
+        if "analytics" in suites:
+            report["analytics"] = await bench_analytics()
+        if "submit_burst" in suites:
+            report["submit_burst"] = await bench_submit_burst(client)
+        if "serialization" in suites:
+            report["serialization"] = bench_serialization()
+        if "compression" in suites:
+            report["compression"] = await bench_compression(client)
+        if "bootstrap" in suites:
+            report["bootstrap"] = await bench_bootstrap()
+        if "sse_idle" in suites:
+            report["sse_idle"] = await bench_sse_idle(max_cpu_percent=args.sse_idle_max_cpu_percent)
+        if "admission" in suites:
+            report["admission"] = await bench_admission(client)
+        if "idempotency" in suites:
+            report["idempotency"] = await bench_idempotency(client)
+
+    output = json.dumps(report, indent=2)
+    print("\n" + output)
+    if args.output:
+        Path(args.output).write_text(output)
+    return report
+
+if __name__ == "__main__":
+    report = asyncio.run(main())
+    # Suites with a pass/fail budget list the runs that broke it
+    failures = [suite for suite, results in report.items() if isinstance(results, dict) and results.get("failures")]
+    if failures:
+        print(f"⚠️  Over budget: {', '.join(failures)}")
+    sys.exit(1 if failures else 0)
@@ -4,13 +4,26 @@ Story Master API Backend Testing Suite
 Tests all API endpoints for the Story Master application
 """
 
+import csv
+import io
+import os
 import requests
 import json
+import socket
+import statistics
+import subprocess
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from pathlib import Path
 
-# Get the backend URL from frontend .env
-BACKEND_URL = "https://kidstorylab.preview.emergentagent.com/api"
+# Get the backend URL from frontend .env; set BACKEND_URL to test another deployment
+# (performance runs belong in backend_benchmark.py, which needs no running server)
+BACKEND_URL = os.environ.get("BACKEND_URL", "https://kidstorylab.preview.emergentagent.com/api")
+# Cold start budget for importing backend/server.py in a fresh interpreter: about 1.5x the
+# ~430ms it takes today, so an import that pulls in a heavy module again fails the test
+IMPORT_TIME_BUDGET_MS = float(os.environ.get("IMPORT_TIME_BUDGET_MS", "650"))
 
 def test_root_endpoint():
     """Test the root endpoint GET /api/"""
@@ -60,12 +73,17 @@ def test_get_progress():
         return False, None
 
 def test_update_progress():
-    """Test PUT /api/progress - should update progress with lesson_completed: true"""
+    """Test PUT /api/progress - should update lesson_completed and refuse current_streak, which is computed"""
     print("\n=== Testing PUT Progress Endpoint ===")
     try:
+        response = requests.put(f"{BACKEND_URL}/progress", json={"lesson_completed": True, "current_streak": 5})
+        print(f"current_streak update Status Code: {response.status_code}")
+        if response.status_code != 422:
+            print(f"❌ PUT progress should refuse current_streak with 422, got {response.status_code}")
+            return False, None
+        
         update_data = {
-            "lesson_completed": True,
-            "current_streak": 5
+            "lesson_completed": True
         }
         
         response = requests.put(f"{BACKEND_URL}/progress", json=update_data)
@@ -74,7 +92,7 @@ def test_update_progress():
         
         if response.status_code == 200:
             data = response.json()
-            if data.get("lesson_completed") == True and data.get("current_streak") == 5:
+            if data.get("lesson_completed") == True and isinstance(data.get("current_streak"), int):
                 print("✅ PUT progress endpoint working correctly")
                 return True, data
             else:
@@ -167,6 +185,402 @@ def test_get_story_by_id(story_id):
         print(f"❌ GET story by ID error: {e}")
         return False, None
 
+def test_story_pagination():
+    """Test GET /api/stories keyset pages - cursors round trip, a story saved between pages causes no
+    duplicates or gaps, and a malformed cursor is rejected"""
+    print("\n=== Testing Story Pagination ===")
+    try:
+        run = datetime.utcnow().isoformat()
+        
+        def save_story(n):
+            return requests.post(f"{BACKEND_URL}/stories", json={
+                "title": f"The Page Turner {n} {run}",
+                "category": "Mystery",
+                "introduction": "Someone had folded down the corner of every page in the library book.",
+                "middle": "Nora followed the folded pages like a trail of breadcrumbs.",
+                "conclusion": "The last fold marked a note that said: you found me!",
+                "word_count": 36,
+                "date_completed": "2024-12-19"
+            })
+        
+        def walk(limit, after=None):
+            # Every story from the cursor on, following X-Next-Cursor to the last page
+            story_ids = []
+            while True:
+                params = {"limit": limit, "fields": "summary"}
+                if after:
+                    params["after"] = after
+                response = requests.get(f"{BACKEND_URL}/stories", params=params)
+                if response.status_code != 200:
+                    raise Exception(f"page after {after} failed with status {response.status_code}")
+                story_ids += [story["_id"] for story in response.json()]
+                after = response.headers.get("X-Next-Cursor")
+                if not after:
+                    return story_ids
+        
+        for n in range(3):
+            if save_story(n).status_code != 200:
+                print("❌ Could not create test stories")
+                return False
+        expected = walk(1000)
+        
+        first_page = requests.get(f"{BACKEND_URL}/stories", params={"limit": 2, "fields": "summary"})
+        cursor = first_page.headers.get("X-Next-Cursor")
+        first_ids = [story["_id"] for story in first_page.json()]
+        print(f"First page: {first_ids}, next cursor: {cursor}")
+        if first_ids != expected[:2] or not cursor:
+            print("❌ The first page should hold the two newest stories and a cursor to the next")
+            return False
+        
+        # A story saved now is newer than every page still to come, so it must not show up in them
+        inserted = save_story(3)
+        rest = walk(2, cursor)
+        walked = first_ids + rest
+        print(f"Walked {len(walked)} stories, {len(set(walked))} distinct, {len(expected)} expected")
+        if len(walked) != len(set(walked)) or inserted.json().get("_id") in rest:
+            print("❌ Pages repeated a story")
+            return False
+        if walked != expected:
+            print("❌ Pages skipped stories or returned them out of order")
+            return False
+        
+        for bad_cursor in ("not-a-cursor", "2024-12-19T10:00:00,not-an-id"):
+            response = requests.get(f"{BACKEND_URL}/stories", params={"after": bad_cursor})
+            print(f"Cursor {bad_cursor!r}: {response.status_code}")
+            if response.status_code != 400:
+                print("❌ A malformed cursor should return 400")
+                return False
+        
+        print("✅ Story pagination working correctly")
+        return True
+    except Exception as e:
+        print(f"❌ Story pagination test error: {e}")
+        return False
+
+def test_story_search():
+    """Test GET /api/stories/search - matches, no hits, and the index following story creates and deletes"""
+    print("\n=== Testing Story Search ===")
+    try:
+        # A word no other story contains, so the hits are exactly this test's story
+        word = f"lanternfish{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}"
+        
+        def search(q):
+            # 503 only means the index is still loading after a restart
+            for _ in range(30):
+                response = requests.get(f"{BACKEND_URL}/stories/search", params={"q": q})
+                if response.status_code != 503:
+                    break
+                time.sleep(1)
+            if response.status_code != 200:
+                raise Exception(f"search for {q!r} failed with status {response.status_code}")
+            return response.json()
+        
+        story_response = requests.post(f"{BACKEND_URL}/stories", json={
+            "title": f"The Glowing {word}",
+            "category": "Adventure",
+            "introduction": "Deep in the ocean, a small fish carried its own light.",
+            "middle": "It lit the way for a lost submarine through the dark trench.",
+            "conclusion": "The sailors named the fish after the lantern on their ship.",
+            "word_count": 37,
+            "date_completed": "2024-12-19"
+        })
+        if story_response.status_code != 200:
+            print("❌ Could not create test story")
+            return False
+        story_id = story_response.json().get("_id")
+        
+        found = search(word)
+        print(f"Search for the new story: {found.get('total')} hit(s)")
+        if found.get("total") != 1 or [story["_id"] for story in found.get("results", [])] != [story_id]:
+            print("❌ Search did not find the story just created")
+            return False
+        
+        missing = search(f"unwritten{word}")
+        print(f"Search for an unused word: {missing.get('total')} hit(s)")
+        if missing.get("total") != 0 or missing.get("results"):
+            print("❌ Search for a word no story contains should have no hits")
+            return False
+        
+        requests.delete(f"{BACKEND_URL}/stories/{story_id}")
+        deleted = search(word)
+        print(f"Search after delete: {deleted.get('total')} hit(s)")
+        if deleted.get("total") == 0 and not deleted.get("results"):
+            print("✅ Story search working correctly")
+            return True
+        else:
+            print("❌ A deleted story is still found by search")
+            return False
+    except Exception as e:
+        print(f"❌ Story search test error: {e}")
+        return False
+
+def test_conditional_requests():
+    """Test ETag and If-None-Match on cached reads - 304 while nothing changed, fresh data after a write"""
+    print("\n=== Testing Conditional Requests ===")
+    try:
+        params = {"student_id": f"etag-test-{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}"}
+        
+        first = requests.get(f"{BACKEND_URL}/progress", params=params)
+        etag = first.headers.get("ETag")
+        print(f"Progress: {first.status_code}, ETag: {etag}")
+        if first.status_code != 200 or not etag:
+            print("❌ GET progress should return an ETag")
+            return False
+        
+        unchanged = requests.get(f"{BACKEND_URL}/progress", params=params, headers={"If-None-Match": etag})
+        print(f"Unchanged progress with If-None-Match: {unchanged.status_code}")
+        if unchanged.status_code != 304 or unchanged.content or unchanged.headers.get("ETag") != etag:
+            print("❌ An unchanged resource should be answered with an empty 304 and the same ETag")
+            return False
+        
+        # The write invalidates the cached progress, so the old ETag no longer matches
+        requests.put(f"{BACKEND_URL}/progress", params=params, json={"lesson_completed": True})
+        updated = requests.get(f"{BACKEND_URL}/progress", params=params, headers={"If-None-Match": etag})
+        print(f"Progress after update: {updated.status_code}, ETag: {updated.headers.get('ETag')}")
+        if (updated.status_code != 200 or updated.headers.get("ETag") == etag
+                or updated.json().get("lesson_completed") is not True):
+            print("❌ Progress was served from the cache after it was updated")
+            return False
+        
+        newest = requests.get(f"{BACKEND_URL}/stories", params={"limit": 1, "fields": "summary"})
+        story_response = requests.post(f"{BACKEND_URL}/stories", json={
+            "title": f"The Stale Page {params['student_id']}",
+            "category": "Mystery",
+            "introduction": "Every morning the newspaper on the doorstep showed the same date.",
+            "middle": "Eli checked the calendar, the clock and even the moon.",
+            "conclusion": "The paperboy had simply been delivering yesterday's news all week.",
+            "word_count": 38,
+            "date_completed": "2024-12-19"
+        })
+        if story_response.status_code != 200:
+            print("❌ Could not create test story")
+            return False
+        after_save = requests.get(f"{BACKEND_URL}/stories", params={"limit": 1, "fields": "summary"},
+                                  headers={"If-None-Match": newest.headers.get("ETag", "")})
+        print(f"Stories after a save: {after_save.status_code}")
+        if after_save.status_code == 200 and [story["_id"] for story in after_save.json()] == [story_response.json()["_id"]]:
+            print("✅ Conditional requests working correctly")
+            return True
+        else:
+            print("❌ The story list was served from the cache after a story was saved")
+            return False
+    except Exception as e:
+        print(f"❌ Conditional requests test error: {e}")
+        return False
+
+def test_story_export():
+    """Test GET /api/stories/export - every record as NDJSON or CSV, and unsupported formats refused"""
+    print("\n=== Testing Story Export ===")
+    try:
+        # Commas and quotes in the title have to survive CSV quoting
+        title = f'The Fox, the "Hen" and the Fence {datetime.utcnow().isoformat()}'
+        story_response = requests.post(f"{BACKEND_URL}/stories", json={
+            "title": title,
+            "category": "Fantasy",
+            "introduction": "A fox wanted to get into the hen house.",
+            "middle": "The hen taught the fox to build a fence instead.",
+            "conclusion": "Now they guard the garden together.",
+            "word_count": 30,
+            "date_completed": "2024-12-19"
+        })
+        if story_response.status_code != 200:
+            print("❌ Could not create test story")
+            return False
+        story_id = story_response.json().get("_id")
+        
+        ndjson = requests.get(f"{BACKEND_URL}/stories/export", params={"format": "ndjson"})
+        records = [json.loads(line) for line in ndjson.text.splitlines() if line]
+        exported = [record for record in records if record.get("_id") == story_id]
+        print(f"NDJSON: {ndjson.status_code}, {ndjson.headers.get('Content-Type')}, {len(records)} records")
+        if (ndjson.status_code != 200 or not ndjson.headers.get("Content-Type", "").startswith("application/x-ndjson")
+                or len(exported) != 1 or exported[0].get("title") != title):
+            print("❌ NDJSON export is missing the new story")
+            return False
+        
+        csv_response = requests.get(f"{BACKEND_URL}/stories/export", params={"format": "csv"})
+        rows = list(csv.DictReader(io.StringIO(csv_response.text)))
+        exported = [row for row in rows if row.get("_id") == story_id]
+        print(f"CSV: {csv_response.status_code}, {csv_response.headers.get('Content-Type')}, {len(rows)} rows")
+        if (csv_response.status_code != 200 or len(rows) != len(records)
+                or len(exported) != 1 or exported[0].get("title") != title):
+            print("❌ CSV export should have the same stories as NDJSON, titles intact")
+            return False
+        
+        unsupported = requests.get(f"{BACKEND_URL}/stories/export", params={"format": "xml"})
+        print(f"Unsupported format: {unsupported.status_code}")
+        if unsupported.status_code == 400:
+            print("✅ Story export working correctly")
+            return True
+        else:
+            print("❌ An unsupported export format should return 400")
+            return False
+    except Exception as e:
+        print(f"❌ Story export test error: {e}")
+        return False
+
+def test_response_compression():
+    """Test Accept-Encoding negotiation - gzip or brotli when accepted, identity when refused or too small to matter"""
+    print("\n=== Testing Response Compression ===")
+    try:
+        # Streamed exports are compressed whatever their size, so one story is enough
+        export_url = f"{BACKEND_URL}/stories/export"
+        
+        def export(accept_encoding):
+            return requests.get(export_url, params={"format": "ndjson"}, headers={"Accept-Encoding": accept_encoding})
+        
+        identity = export("identity")
+        gzipped = export("gzip")
+        print(f"identity: {identity.headers.get('Content-Encoding')}, gzip: {gzipped.headers.get('Content-Encoding')}, "
+              f"Vary: {gzipped.headers.get('Vary')}")
+        if identity.status_code != 200 or not identity.text or identity.headers.get("Content-Encoding"):
+            print("❌ A client accepting only identity should get an uncompressed export")
+            return False
+        if (gzipped.headers.get("Content-Encoding") != "gzip" or gzipped.text != identity.text
+                or "accept-encoding" not in gzipped.headers.get("Vary", "").lower()):
+            print("❌ A gzip client should get the same export gzipped, with Vary: Accept-Encoding")
+            return False
+        
+        # brotli is preferred when the server has it; the body isn't read, the client may not decode brotli
+        preferred = export("gzip;q=0.5, br")
+        refused = export("gzip;q=0, *;q=0")
+        print(f"br preferred: {preferred.headers.get('Content-Encoding')}, all refused: {refused.headers.get('Content-Encoding')}")
+        if preferred.headers.get("Content-Encoding") not in ("br", "gzip") or refused.headers.get("Content-Encoding"):
+            print("❌ Encoding was not negotiated from the client's q-values")
+            return False
+        
+        small = requests.get(f"{BACKEND_URL}/", headers={"Accept-Encoding": "gzip"})
+        print(f"Small response: {small.headers.get('Content-Encoding')}")
+        if small.status_code == 200 and not small.headers.get("Content-Encoding"):
+            print("✅ Response compression working correctly")
+            return True
+        else:
+            print("❌ Responses below the size threshold should not be compressed")
+            return False
+    except Exception as e:
+        print(f"❌ Response compression test error: {e}")
+        return False
+
+def test_bootstrap():
+    """Test GET /api/bootstrap - a student's progress and the newest stories in one response, kept current by saves"""
+    print("\n=== Testing Bootstrap Endpoint ===")
+    try:
+        params = {"student_id": f"bootstrap-test-{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}", "limit": 5}
+        
+        before = requests.get(f"{BACKEND_URL}/bootstrap", params=params)
+        print(f"Before saving: {before.status_code}")
+        if before.status_code != 200 or before.json().get("progress", {}).get("stories_count") != 0:
+            print("❌ Bootstrap should return a new student's empty progress")
+            return False
+        
+        story_response = requests.post(f"{BACKEND_URL}/stories", json={
+            "title": f"The First Day {params['student_id']}",
+            "category": "Friendship",
+            "introduction": "Maya did not know anyone at her new school.",
+            "middle": "At lunch a boy offered her half of his orange.",
+            "conclusion": "By the end of the day they had planned a whole treehouse.",
+            "word_count": 36,
+            "date_completed": "2024-12-19",
+            "student_id": params["student_id"]
+        })
+        if story_response.status_code != 200:
+            print("❌ Could not create test story")
+            return False
+        saved = story_response.json()
+        
+        # The save invalidates both halves, so the earlier ETag must not get a 304
+        after = requests.get(f"{BACKEND_URL}/bootstrap", params=params,
+                             headers={"If-None-Match": before.headers.get("ETag", "")})
+        data = after.json() if after.status_code == 200 else {}
+        print(f"After saving: {after.status_code}, stories_count: {data.get('progress', {}).get('stories_count')}")
+        if (data.get("progress", {}).get("stories_count") == 1 == saved.get("progress", {}).get("stories_count")
+                and data.get("stories") and data["stories"][0].get("_id") == saved.get("_id")):
+            print("✅ Bootstrap endpoint working correctly")
+            return True
+        else:
+            print("❌ Bootstrap did not reflect the saved story and its progress")
+            return False
+    except Exception as e:
+        print(f"❌ Bootstrap test error: {e}")
+        return False
+
+def test_story_events_resume():
+    """Test GET /api/stories/events - a client reconnecting with Last-Event-ID gets the events it missed,
+    and one with an id the server can't resume from is told to reload"""
+    print("\n=== Testing Story Event Resume ===")
+    try:
+        events_url = f"{BACKEND_URL}/stories/events"
+        run = datetime.utcnow().isoformat()
+        
+        def read_events(response, last_story_id):
+            # Events from an open stream, up to the story-created event for last_story_id
+            events, fields = [], {}
+            for line in response.iter_lines(decode_unicode=True):
+                if line:
+                    name, _, value = line.partition(":")
+                    fields[name] = value[1:] if value.startswith(" ") else value
+                    continue
+                # A blank line ends the event; retry and heartbeat frames carry no event name
+                if "event" in fields:
+                    events.append(fields)
+                    if fields["event"] == "story-created" and json.loads(fields["data"]).get("_id") == last_story_id:
+                        return events
+                fields = {}
+            raise Exception("the event stream ended early")
+        
+        def save_story(n):
+            response = requests.post(f"{BACKEND_URL}/stories", json={
+                "title": f"The Radio Signal {n} {run}",
+                "category": "Science Fiction",
+                "introduction": "The old radio in the attic crackled to life on its own.",
+                "middle": "A voice read out the weather for a town that didn't exist.",
+                "conclusion": "Grandpa smiled and said it was the town he grew up in.",
+                "word_count": 38,
+                "date_completed": "2024-12-19"
+            })
+            return response.json()["_id"]
+        
+        live = requests.get(events_url, stream=True, timeout=10)
+        try:
+            first_id = save_story(1)
+            second_id = save_story(2)
+            seen = read_events(live, second_id)
+        finally:
+            live.close()
+        created = [event for event in seen if event["event"] == "story-created"]
+        print(f"Live: {[event['event'] for event in seen]}")
+        if [json.loads(event["data"])["_id"] for event in created][-2:] != [first_id, second_id]:
+            print("❌ The live stream did not deliver both new stories")
+            return False
+        
+        # Resume from the first story's event; everything after it must be replayed with the same ids
+        resume_from = created[-2]["id"]
+        expected = [event["id"] for event in seen[seen.index(created[-2]) + 1:]]
+        resumed = requests.get(events_url, headers={"Last-Event-ID": resume_from}, stream=True, timeout=10)
+        try:
+            replayed = [event["id"] for event in read_events(resumed, second_id)]
+        finally:
+            resumed.close()
+        print(f"Resumed from {resume_from}: {replayed}")
+        if replayed != expected:
+            print(f"❌ Resuming should replay {expected}")
+            return False
+        
+        unknown = requests.get(events_url, headers={"Last-Event-ID": "0-0"}, stream=True, timeout=10)
+        try:
+            first_event = next(line for line in unknown.iter_lines(decode_unicode=True) if line.startswith("event:"))
+        finally:
+            unknown.close()
+        print(f"Unknown Last-Event-ID: {first_event}")
+        if first_event == "event: reset":
+            print("✅ Story event resume working correctly")
+            return True
+        else:
+            print("❌ An id the server can't resume from should get a reset event")
+            return False
+    except Exception as e:
+        print(f"❌ Story event resume test error: {e}")
+        return False
+
 def test_progress_auto_update():
     """Test that progress is updated automatically when a story is created"""
     print("\n=== Testing Progress Auto-Update ===")
@@ -184,9 +598,9 @@ def test_progress_auto_update():
         print(f"Initial stories count: {initial_stories_count}")
         print(f"Initial total words: {initial_total_words}")
         
-        # Create a new story
+        # Create a new story; the title is unique so a rerun isn't taken for a resubmission of the last run's story
         story_data = {
-            "title": "The Space Adventure",
+            "title": f"The Space Adventure {datetime.utcnow().isoformat()}",
             "category": "Science Fiction",
             "introduction": "Captain Alex piloted her spaceship through the asteroid field.",
             "middle": "She discovered a new planet with friendly aliens who needed help.",
@@ -287,6 +701,352 @@ def test_error_handling():
         print(f"❌ Error handling test error: {e}")
         return False
 
+def test_bulk_import():
+    """Test POST /api/stories/bulk - NDJSON and JSON array bodies, malformed records, chunked uploads and truncation"""
+    print("\n=== Testing Bulk Import ===")
+    try:
+        run = datetime.utcnow().strftime('%Y%m%d%H%M%S%f')
+        
+        def story(n):
+            return json.dumps({
+                "title": f"Imported Tale {n} {run}",
+                "category": "Adventure",
+                "introduction": "A paper boat set off down the gutter after the rain.",
+                "middle": "It raced past leaves, bottle caps and a very surprised frog.",
+                "conclusion": "It came to rest in a puddle, where a child picked it up.",
+                "word_count": 35,
+                "date_completed": "2024-12-19",
+                "student_id": f"import-test-{run}"
+            })
+        
+        def chunked(body, size=7):
+            # A generator body is sent with chunked transfer encoding, so records arrive split across chunks
+            for start in range(0, len(body), size):
+                yield body[start:start + size]
+        
+        cases = [
+            ("NDJSON", "\n".join([story(1), "{not json", story(2), "[1, 2]", story(3)]).encode(), 3, [2, 4]),
+            ("array", f"[{story(4)}, {{bad}}, {story(5)}, {story(6)}]".encode(), 3, [2]),
+            ("chunked array", f"[{story(7)},{story(8)} , {story(9)}]".encode(), 3, []),
+            ("truncated array", f"[{story(10)}, {story(11)}".encode(), 2, [3])
+        ]
+        passed = True
+        for name, body, inserted, failed_records in cases:
+            data = chunked(body) if name == "chunked array" else body
+            response = requests.post(f"{BACKEND_URL}/stories/bulk", data=data)
+            report = response.json() if response.status_code == 200 else {}
+            print(f"{name}: {response.status_code} {report}")
+            if (response.status_code != 200 or report.get("inserted") != inserted
+                    or [error["record"] for error in report.get("errors", [])] != failed_records):
+                print(f"❌ {name} import expected {inserted} inserted and failures at records {failed_records}")
+                passed = False
+        
+        if passed:
+            print("✅ Bulk import working correctly")
+        return passed
+    except Exception as e:
+        print(f"❌ Bulk import test error: {e}")
+        return False
+
+def test_concurrent_idempotent_submissions():
+    """Test POST /api/stories - concurrent submissions with one Idempotency-Key save a single story, and
+    a submission whose story was deleted can be made again"""
+    print("\n=== Testing Concurrent Idempotent Submissions ===")
+    try:
+        run = datetime.utcnow().isoformat()
+        story_data = {
+            "title": f"The Double Click {run}",
+            "category": "Adventure",
+            "introduction": "Sam pressed the button to send the story.",
+            "middle": "The page was slow, so he pressed it again, and again.",
+            "conclusion": "Only one copy of the story reached the gallery.",
+            "word_count": 33,
+            "date_completed": "2024-12-19",
+            "student_name": "Sam Lee"
+        }
+        headers = {"Idempotency-Key": f"double-click-{run}"}
+        
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            responses = list(pool.map(
+                lambda _: requests.post(f"{BACKEND_URL}/stories", json=story_data, headers=headers),
+                range(8)
+            ))
+        statuses = [response.status_code for response in responses]
+        print(f"Status Codes: {statuses}")
+        
+        # 409 only means a duplicate gave up waiting for the first submission to finish saving
+        saved = [response for response in responses if response.status_code == 200]
+        if not saved or any(status not in (200, 409) for status in statuses):
+            print("❌ Concurrent submissions failed")
+            return False
+        story_ids = {response.json().get("_id") for response in saved}
+        first = [response for response in saved if response.headers.get("Idempotent-Replayed") != "true"]
+        print(f"Distinct stories: {len(story_ids)}, first submissions: {len(first)}")
+        
+        if len(story_ids) != 1 or len(first) != 1:
+            print("❌ Concurrent submissions with one Idempotency-Key saved more than one story")
+            return False
+        
+        # Once its story is deleted, the same submission saves a new story, and that one is replayed
+        story_id = story_ids.pop()
+        requests.delete(f"{BACKEND_URL}/stories/{story_id}")
+        resubmitted = requests.post(f"{BACKEND_URL}/stories", json=story_data, headers=headers)
+        replayed = requests.post(f"{BACKEND_URL}/stories", json=story_data, headers=headers)
+        print(f"After delete: {resubmitted.status_code} then {replayed.status_code}")
+        if (resubmitted.status_code != 200 or resubmitted.json().get("_id") == story_id
+                or resubmitted.headers.get("Idempotent-Replayed") == "true"):
+            print("❌ Resubmitting after the story was deleted did not save a new story")
+            return False
+        if replayed.status_code != 200 or replayed.json().get("_id") != resubmitted.json().get("_id"):
+            print("❌ The resubmitted story was not replayed")
+            return False
+        
+        # Likewise without a key, where submissions are matched by content
+        unkeyed = {**story_data, "title": f"The Second Draft {run}"}
+        saved = requests.post(f"{BACKEND_URL}/stories", json=unkeyed)
+        requests.delete(f"{BACKEND_URL}/stories/{saved.json().get('_id')}")
+        rewritten = requests.post(f"{BACKEND_URL}/stories", json=unkeyed)
+        print(f"Rewritten after delete without a key: {rewritten.status_code}")
+        if rewritten.status_code == 200 and rewritten.json().get("_id") != saved.json().get("_id"):
+            print("✅ Concurrent idempotent submissions saved one story, and deleted stories can be resubmitted")
+            return True
+        else:
+            print("❌ Rewriting a deleted story with the same content did not save it")
+            return False
+    except Exception as e:
+        print(f"❌ Concurrent idempotent submissions test error: {e}")
+        return False
+
+def test_concurrent_create_and_reconcile():
+    """Test POST /api/progress/reconcile while stories are being created - it must not report drift or overcount"""
+    print("\n=== Testing Reconcile During Concurrent Story Creation ===")
+    try:
+        student_id = f"reconcile-test-{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}"
+        stories = 12
+        
+        def create(n):
+            return requests.post(f"{BACKEND_URL}/stories", json={
+                "title": f"The Busy Library, Part {n}",
+                "category": "Adventure",
+                "introduction": "The library was quiet until the books started to whisper.",
+                "middle": "Every shelf told a different story at the same time.",
+                "conclusion": "The librarian smiled and listened to each one.",
+                "word_count": 30,
+                "date_completed": "2024-12-19",
+                "student_id": student_id
+            })
+        
+        def reconcile(_):
+            return requests.post(f"{BACKEND_URL}/progress/reconcile")
+        
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            created = [pool.submit(create, n) for n in range(stories)]
+            reconciles = [pool.submit(reconcile, n) for n in range(6)]
+            created = [future.result() for future in created]
+            reconciles = [future.result() for future in reconciles]
+        
+        if any(response.status_code != 200 for response in created + reconciles):
+            print(f"❌ Requests failed: {[response.status_code for response in created + reconciles]}")
+            return False
+        spurious = [response.json()["drift"][student_id] for response in reconciles if student_id in response.json()["drift"]]
+        progress = requests.get(f"{BACKEND_URL}/progress?student_id={student_id}").json()
+        print(f"Stories created: {stories}, stories_count: {progress.get('stories_count')}, drift reports: {len(spurious)}")
+        
+        if progress.get("stories_count") == stories and not spurious:
+            print("✅ Reconcile during concurrent creation kept progress exact")
+            return True
+        else:
+            print(f"❌ Reconcile raced story creation: {spurious}")
+            return False
+    except Exception as e:
+        print(f"❌ Concurrent create and reconcile test error: {e}")
+        return False
+
+def test_draft_revisions_and_finalize():
+    """Test PATCH /api/stories/:id and finalize - stale revisions get 409, and only finalizing counts toward progress"""
+    print("\n=== Testing Draft Revisions and Finalize ===")
+    try:
+        student_id = f"draft-test-{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}"
+        progress_url = f"{BACKEND_URL}/progress?student_id={student_id}"
+        initial_progress = requests.get(progress_url).json()
+        
+        response = requests.post(f"{BACKEND_URL}/stories/drafts", json={
+            "category": "Mystery",
+            "title": "The Missing Paintbrush",
+            "student_id": student_id,
+            "student_name": "Jordan Park"
+        })
+        print(f"Create draft Status Code: {response.status_code}")
+        if response.status_code != 201 or response.json().get("revision") != 0:
+            print("❌ Could not create draft")
+            return False
+        story_id = response.json()["_id"]
+        story_url = f"{BACKEND_URL}/stories/{story_id}"
+        
+        response = requests.patch(story_url, json={
+            "revision": 0,
+            "introduction": "Jordan's favorite paintbrush vanished from the art room one morning."
+        })
+        print(f"PATCH Status Code: {response.status_code}")
+        if response.status_code != 200 or response.json().get("revision") != 1:
+            print("❌ PATCH did not advance the draft's revision")
+            return False
+        
+        # A second tab still at revision 0 must not overwrite the first
+        response = requests.patch(story_url, json={"revision": 0, "introduction": "A stale edit."})
+        print(f"Stale PATCH Status Code: {response.status_code}")
+        if response.status_code != 409:
+            print("❌ PATCH against a stale revision should return 409")
+            return False
+        
+        response = requests.post(f"{story_url}/finalize", json={"revision": 0})
+        print(f"Stale finalize Status Code: {response.status_code}")
+        if response.status_code != 409:
+            print("❌ Finalize against a stale revision should return 409")
+            return False
+        
+        response = requests.patch(story_url, json={
+            "revision": 1,
+            "middle": "Clues of blue paint led down the hall to the music room.",
+            "conclusion": "The class hamster had borrowed it to decorate its cage."
+        })
+        if response.status_code != 200 or response.json().get("revision") != 2:
+            print("❌ PATCH at the current revision failed")
+            return False
+        
+        draft_progress = requests.get(progress_url).json()
+        if draft_progress.get("stories_count") != initial_progress.get("stories_count"):
+            print("❌ A draft should not count toward progress")
+            return False
+        
+        response = requests.post(f"{story_url}/finalize", json={"revision": 2, "date_completed": "2024-12-19"})
+        print(f"Finalize Status Code: {response.status_code}")
+        if response.status_code != 200 or response.json().get("_id") != story_id:
+            print("❌ Finalize failed")
+            return False
+        
+        final_progress = requests.get(progress_url).json()
+        print(f"Stories count: {initial_progress.get('stories_count')} -> {final_progress.get('stories_count')}")
+        print(f"Total words: {initial_progress.get('total_words')} -> {final_progress.get('total_words')}")
+        if (final_progress.get("stories_count") == initial_progress.get("stories_count", 0) + 1
+                and final_progress.get("total_words", 0) > initial_progress.get("total_words", 0)
+                and response.json().get("progress", {}).get("stories_count") == final_progress.get("stories_count")):
+            print("✅ Draft revisions and finalize working correctly")
+            return True
+        else:
+            print("❌ Finalizing a draft did not count toward progress")
+            return False
+    except Exception as e:
+        print(f"❌ Draft revisions and finalize test error: {e}")
+        return False
+
+def test_admission_control():
+    """Test that a write beyond the admission limits is shed with 503 and Retry-After instead of queued"""
+    print("\n=== Testing Admission Control ===")
+    backend_dir = Path(__file__).parent / "backend"
+    # A local server with one write slot and no queue, so a second concurrent write has to be shed
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server_url = f"http://127.0.0.1:{port}"
+    env = {**os.environ, "STORAGE_ENGINE": "embedded", "ADMISSION_WRITE_CONCURRENCY": "1",
+           "ADMISSION_WRITE_QUEUE": "0", "ADMISSION_RETRY_AFTER": "3", "PYTHONDONTWRITEBYTECODE": "1"}
+    env.pop("STORAGE_PATH", None)
+    story_data = {
+        "title": "The Busy Bakery",
+        "category": "Friendship",
+        "introduction": "Every child in town wanted a cupcake at the same time.",
+        "middle": "The baker asked them to line up and come back in a few minutes.",
+        "conclusion": "Nobody went home without a cupcake, and nobody got squashed.",
+        "word_count": 37,
+        "date_completed": "2024-12-19"
+    }
+    
+    def slow_upload():
+        # The import holds the only write slot while its body trickles in
+        yield (json.dumps(story_data) + "\n").encode()
+        time.sleep(2)
+        yield json.dumps({**story_data, "title": "The Busy Bakery, Part Two"}).encode()
+    
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=backend_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        for _ in range(60):
+            try:
+                if requests.get(f"{server_url}/healthz", timeout=1).status_code == 200:
+                    break
+            except requests.RequestException:
+                pass
+            time.sleep(0.5)
+        else:
+            print("❌ The local server did not start")
+            return False
+        
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            upload = pool.submit(requests.post, f"{server_url}/api/stories/bulk", data=slow_upload())
+            time.sleep(1)
+            shed = requests.post(f"{server_url}/api/stories", json=story_data)
+            # Reads have limits of their own and are unaffected
+            read = requests.get(f"{server_url}/api/stories", params={"limit": 1})
+            imported = upload.result()
+        print(f"Write during import: {shed.status_code}, Retry-After: {shed.headers.get('Retry-After')}, "
+              f"read: {read.status_code}, import: {imported.status_code}")
+        if shed.status_code != 503 or shed.headers.get("Retry-After") != "3":
+            print("❌ A write with no free slot and no queue room should get 503 with Retry-After")
+            return False
+        if read.status_code != 200 or imported.status_code != 200 or imported.json().get("inserted") != 2:
+            print("❌ Shedding a write should not affect reads or the write holding the slot")
+            return False
+        
+        retried = requests.post(f"{server_url}/api/stories", json={**story_data, "title": "The Busy Bakery, Again"})
+        print(f"Write after the import finished: {retried.status_code}")
+        if retried.status_code == 200:
+            print("✅ Admission control working correctly")
+            return True
+        else:
+            print("❌ The write slot was not released after the import")
+            return False
+    except Exception as e:
+        print(f"❌ Admission control test error: {e}")
+        return False
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+def test_import_time_budget(runs=5):
+    """Test that importing the server stays within IMPORT_TIME_BUDGET_MS and opens no connections"""
+    print("\n=== Testing Server Import Time ===")
+    backend_dir = Path(__file__).parent / "backend"
+    # The address is unroutable on purpose: an import that tried to reach it would stall
+    env = {**os.environ, "STORAGE_ENGINE": "mongo", "MONGO_URL": "mongodb://192.0.2.1:27017",
+           "DB_NAME": "import_time_check", "PYTHONDONTWRITEBYTECODE": "1"}
+    probe = "import time; started = time.perf_counter(); import server; print(time.perf_counter() - started)"
+    try:
+        samples = []
+        for _ in range(runs):
+            result = subprocess.run(
+                [sys.executable, "-c", probe], cwd=backend_dir, env=env,
+                capture_output=True, text=True, timeout=60
+            )
+            if result.returncode != 0:
+                print(f"❌ Importing the server failed:\n{result.stderr}")
+                return False
+            samples.append(float(result.stdout.strip().splitlines()[-1]) * 1000)
+
+        median_ms = statistics.median(samples)
+        print(f"Import times (ms): {[round(sample, 1) for sample in samples]}")
+        print(f"Median: {median_ms:.1f}ms, budget: {IMPORT_TIME_BUDGET_MS:.0f}ms")
+        if median_ms <= IMPORT_TIME_BUDGET_MS:
+            print("✅ Server import is within budget")
+            return True
+        print("❌ Server import exceeds its budget; check `python -X importtime -c 'import server'`")
+        return False
+    except Exception as e:
+        print(f"❌ Import time test error: {e}")
+        return False
+
 def main():
     """Run all tests"""
     print("🚀 Starting Story Master API Backend Tests")
@@ -312,12 +1072,51 @@ def main():
     else:
         results['get_story_by_id'] = False
     
-    # Test 5: Progress auto-update
+    # Test 5: Story pagination
+    results['story_pagination'] = test_story_pagination()
+    
+    # Test 6: Story search
+    results['story_search'] = test_story_search()
+    
+    # Test 7: Conditional requests
+    results['conditional_requests'] = test_conditional_requests()
+    
+    # Test 8: Story export
+    results['story_export'] = test_story_export()
+    
+    # Test 9: Response compression
+    results['response_compression'] = test_response_compression()
+    
+    # Test 10: Bootstrap
+    results['bootstrap'] = test_bootstrap()
+    
+    # Test 11: Story event resume
+    results['story_events_resume'] = test_story_events_resume()
+    
+    # Test 12: Admission control
+    results['admission_control'] = test_admission_control()
+    
+    # Test 13: Progress auto-update
     results['progress_auto_update'] = test_progress_auto_update()
     
-    # Test 6: Error handling
+    # Test 14: Error handling
     results['error_handling'] = test_error_handling()
     
+    # Test 15: Bulk import
+    results['bulk_import'] = test_bulk_import()
+    
+    # Test 16: Concurrent idempotent submissions
+    results['concurrent_idempotent_submissions'] = test_concurrent_idempotent_submissions()
+    
+    # Test 17: Draft revisions and finalize
+    results['draft_revisions_and_finalize'] = test_draft_revisions_and_finalize()
+    
+    # Test 18: Reconcile during concurrent writes
+    results['concurrent_create_and_reconcile'] = test_concurrent_create_and_reconcile()
+    
+    # Test 19: Cold start
+    results['import_time_budget'] = test_import_time_budget()
+    
     # Summary
     print("\n" + "="*50)
     print("📊 TEST RESULTS SUMMARY")
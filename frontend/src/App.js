@@ -27,12 +27,9 @@ function App() {
       try {
         setLoading(true);
         
-        // Load user progress
-        const progress = await ApiService.getProgress();
+        // Progress and story summaries arrive together; full bodies are fetched when a story is opened
+        const { progress, stories: storiesData } = await ApiService.getBootstrap();
         setUserProgress(progress);
-        
-        // Load stories
-        const storiesData = await ApiService.getStories();
         setStories(storiesData);
         
       } catch (error) {
@@ -49,6 +46,28 @@ function App() {
 
     loadInitialData();
   }, [toast]);
+
+  // Keep the gallery live while it's projected: stories appear and disappear as classmates save them
+  useEffect(() => {
+    const source = ApiService.subscribeToStoryEvents({
+      'story-created': (story) => {
+        setStories(prev => prev.some(s => s._id === story._id) ? prev : [story, ...prev]);
+      },
+      'story-deleted': ({ _id }) => {
+        setStories(prev => prev.filter(s => s._id !== _id));
+      },
+      'progress-updated': (progress) => {
+        setUserProgress(prev => prev.student_id === progress.student_id ? progress : prev);
+      },
+      // Too much was missed to catch up event by event, so reload everything
+      'reset': async () => {
+        const { progress, stories: storiesData } = await ApiService.getBootstrap();
+        setUserProgress(progress);
+        setStories(storiesData);
+      }
+    });
+    return () => source.close();
+  }, []);
   
   const updateProgress = async (progressUpdate) => {
     try {
@@ -64,16 +83,22 @@ function App() {
     }
   };
 
-  const addStory = async (storyData) => {
+  const addStory = async ({ idempotency_key, ...storyData }) => {
     try {
-      const newStory = await ApiService.createStory(storyData);
-      setStories(prev => [newStory, ...prev]);
+      // Autosaved drafts are finalized in place; anything else is created outright
+      const newStory = storyData.draft_id
+        ? await ApiService.finalizeStory(storyData.draft_id, {
+            revision: storyData.revision,
+            date_completed: storyData.date_completed
+          })
+        : await ApiService.createStory(storyData, idempotency_key);
       
-      // Refresh progress to get updated stats
-      const updatedProgress = await ApiService.getProgress();
+      // The saved story comes back with the updated stats
+      const { progress: updatedProgress, ...story } = newStory;
+      setStories(prev => [story, ...prev.filter(s => s._id !== story._id)]);
       setUserProgress(updatedProgress);
       
-      return newStory;
+      return story;
     } catch (error) {
       console.error('Error adding story:', error);
       toast({
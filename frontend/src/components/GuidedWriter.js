@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef, useCallback } from 'react';
 import { Card, CardContent, CardDescription, CardHeader, CardTitle } from './ui/card';
 import { Button } from './ui/button';
 import { Textarea } from './ui/textarea';
@@ -9,6 +9,7 @@ import { Alert, AlertDescription } from './ui/alert';
 import { storyCategories, writingHints } from './mock';
 import { PlayCircle, Zap, CheckCircle, Lightbulb, ArrowRight, ArrowLeft, Save, RotateCcw, HelpCircle } from 'lucide-react';
 import { useToast } from '../hooks/use-toast';
+import ApiService from '../services/api';
 
 const stepIcons = {
   0: PlayCircle,
@@ -23,6 +24,34 @@ const stepColors = {
 };
 
 const stepNames = ['Introduction', 'Main Story', 'Conclusion'];
+const sectionFields = ['introduction', 'middle', 'conclusion'];
+
+// Typing pauses this long before changed sections are sent; the server batches further
+const AUTOSAVE_DELAY_MS = 800;
+
+const newSubmissionKey = () =>
+  window.crypto?.randomUUID?.() || `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+
+// The draft being written on this device; several children can share one student_id,
+// so only this device's own draft is ever brought back
+const DRAFT_STORAGE_KEY = 'storyMaster.draftId';
+
+const rememberDraft = (draftId) => {
+  try {
+    if (draftId) window.localStorage.setItem(DRAFT_STORAGE_KEY, draftId);
+    else window.localStorage.removeItem(DRAFT_STORAGE_KEY);
+  } catch (error) {
+    // Without storage the draft is still autosaved, it just isn't restored
+  }
+};
+
+const rememberedDraft = () => {
+  try {
+    return window.localStorage.getItem(DRAFT_STORAGE_KEY);
+  } catch (error) {
+    return null;
+  }
+};
 
 const GuidedWriter = ({ progress, onStoryCreate }) => {
   const [selectedCategory, setSelectedCategory] = useState(null);
@@ -33,6 +62,87 @@ const GuidedWriter = ({ progress, onStoryCreate }) => {
   const [currentHint, setCurrentHint] = useState(0);
   const [saving, setSaving] = useState(false);
   const { toast } = useToast();
+  const draftRef = useRef(null);
+  const pendingChanges = useRef({});
+  const autosaveTimer = useRef(null);
+  // One key per version of the story, so retrying a save can't create it twice
+  const submission = useRef(null);
+
+  const studentId = progress.student_id;
+
+  // Bring back the unfinished story started on this device, e.g. after the tab was closed
+  useEffect(() => {
+    const draftId = rememberedDraft();
+    if (!draftId) return;
+    ApiService.listDrafts({ student_id: studentId, limit: 100 })
+      .then(drafts => {
+        const latest = drafts.find(d => d._id === draftId);
+        const category = latest && storyCategories.find(c => c.name === latest.category);
+        if (!category) {
+          rememberDraft(null);
+          return;
+        }
+        draftRef.current = { id: latest._id, revision: latest.revision };
+        setSelectedCategory(category);
+        setStoryTitle(latest.title || '');
+        setStoryParts(sectionFields.map(field => latest[field] || ''));
+        toast({
+          title: "Welcome back!",
+          description: "We kept your unfinished story safe. Keep writing!",
+        });
+      })
+      .catch(error => console.error('Error loading drafts:', error));
+  }, [studentId, toast]);
+
+  const flushAutosave = useCallback(async () => {
+    clearTimeout(autosaveTimer.current);
+    const changes = pendingChanges.current;
+    if (!draftRef.current || Object.keys(changes).length === 0) return;
+    pendingChanges.current = {};
+    const draft = draftRef.current;
+    try {
+      const saved = await ApiService.patchStory(draft.id, { revision: draft.revision, ...changes });
+      draft.revision = saved.revision;
+    } catch (error) {
+      // Keep the edits for the next attempt; on a conflict, continue from the server's revision
+      pendingChanges.current = { ...changes, ...pendingChanges.current };
+      if (error.response?.status === 409) {
+        const drafts = await ApiService.listDrafts({ student_id: studentId, limit: 100 });
+        const current = drafts.find(d => d._id === draft.id);
+        if (current) draft.revision = current.revision;
+      }
+    }
+  }, [studentId]);
+
+  const queueAutosave = (field, value) => {
+    pendingChanges.current[field] = value;
+    clearTimeout(autosaveTimer.current);
+    autosaveTimer.current = setTimeout(flushAutosave, AUTOSAVE_DELAY_MS);
+  };
+
+  useEffect(() => () => clearTimeout(autosaveTimer.current), []);
+
+  const startDraft = async (category) => {
+    setSelectedCategory(category);
+    try {
+      const draft = await ApiService.createDraft({ category: category.name, student_id: studentId });
+      draftRef.current = { id: draft._id, revision: draft.revision };
+      rememberDraft(draft._id);
+      flushAutosave();
+    } catch (error) {
+      // Writing still works without autosave; the story is created when it is finished
+    }
+  };
+
+  const discardDraft = () => {
+    clearTimeout(autosaveTimer.current);
+    pendingChanges.current = {};
+    if (draftRef.current) {
+      ApiService.deleteStory(draftRef.current.id).catch(() => {});
+      draftRef.current = null;
+    }
+    rememberDraft(null);
+  };
 
   // Redirect if lesson not completed
   useEffect(() => {
@@ -78,6 +188,7 @@ const GuidedWriter = ({ progress, onStoryCreate }) => {
     const newParts = [...storyParts];
     newParts[currentStep] = value;
     setStoryParts(newParts);
+    queueAutosave(sectionFields[currentStep], value);
   };
 
   const getStoryStarter = () => {
@@ -109,6 +220,7 @@ const GuidedWriter = ({ progress, onStoryCreate }) => {
 
     try {
       setSaving(true);
+      await flushAutosave();
       
       const storyData = {
         title: storyTitle.trim(),
@@ -119,6 +231,16 @@ const GuidedWriter = ({ progress, onStoryCreate }) => {
         date_completed: new Date().toISOString().split('T')[0],
         word_count: storyParts.join(' ').trim().split(/\s+/).length
       };
+      if (draftRef.current && Object.keys(pendingChanges.current).length === 0) {
+        storyData.draft_id = draftRef.current.id;
+        storyData.revision = draftRef.current.revision;
+      } else {
+        const content = JSON.stringify([storyData.title, storyData.introduction, storyData.middle, storyData.conclusion]);
+        if (submission.current?.content !== content) {
+          submission.current = { key: newSubmissionKey(), content };
+        }
+        storyData.idempotency_key = submission.current.key;
+      }
 
       await onStoryCreate(storyData);
 
@@ -127,7 +249,11 @@ const GuidedWriter = ({ progress, onStoryCreate }) => {
         description: `"${storyTitle}" has been saved to your collection!`,
       });
 
-      // Reset for new story
+      // Reset for new story; a draft that couldn't be finalized is discarded
+      if (!storyData.draft_id) discardDraft();
+      draftRef.current = null;
+      rememberDraft(null);
+      submission.current = null;
       setStoryTitle('');
       setStoryParts(['', '', '']);
       setCurrentStep(0);
@@ -164,7 +290,7 @@ const GuidedWriter = ({ progress, onStoryCreate }) => {
               <Card 
                 key={category.id}
                 className={`${category.color} cursor-pointer hover:scale-105 transition-transform duration-200 border-2 hover:border-indigo-400`}
-                onClick={() => setSelectedCategory(category)}
+                onClick={() => startDraft(category)}
               >
                 <CardHeader className="text-center">
                   <CardTitle className="text-lg">{category.name}</CardTitle>
@@ -236,7 +362,10 @@ const GuidedWriter = ({ progress, onStoryCreate }) => {
               <Input
                 placeholder="My Amazing Adventure..."
                 value={storyTitle}
-                onChange={(e) => setStoryTitle(e.target.value)}
+                onChange={(e) => {
+                  setStoryTitle(e.target.value);
+                  queueAutosave('title', e.target.value);
+                }}
                 className="text-lg"
               />
             </CardContent>
@@ -325,6 +454,7 @@ const GuidedWriter = ({ progress, onStoryCreate }) => {
                 <Button 
                   variant="outline"
                   onClick={() => {
+                    discardDraft();
                     setSelectedCategory(null);
                     setCurrentStep(0);
                     setStoryParts(['', '', '']);
@@ -5,6 +5,7 @@ import { Badge } from './ui/badge';
 import { Input } from './ui/input';
 import { Dialog, DialogContent, DialogDescription, DialogHeader, DialogTitle, DialogTrigger } from './ui/dialog';
 import { completedStories } from './mock';
+import ApiService from '../services/api';
 import { BookOpen, Calendar, FileText, Search, Heart, Sparkles, Eye, PlayCircle, Zap, CheckCircle } from 'lucide-react';
 
 const StoryGallery = ({ stories }) => {
@@ -12,20 +13,54 @@ const StoryGallery = ({ stories }) => {
   const [searchTerm, setSearchTerm] = useState('');
   const [selectedCategory, setSelectedCategory] = useState('All');
   const [selectedStory, setSelectedStory] = useState(null);
+  const [fullStories, setFullStories] = useState({});
+  const [searchResults, setSearchResults] = useState(null);
+  const [savedCategories, setSavedCategories] = useState([]);
 
   useEffect(() => {
     // Combine completed mock stories with new stories from props
     setAllStories([...completedStories, ...(stories || [])]);
   }, [stories]);
 
-  const categories = ['All', ...new Set(allStories.map(story => story.category))];
+  useEffect(() => {
+    // Categories of saved stories come from the server's rollups, not the loaded page
+    ApiService.getStats()
+      .then(stats => setSavedCategories(stats.by_category.map(entry => entry.category)))
+      .catch(error => console.error('Error loading story stats:', error));
+  }, [stories]);
+
+  useEffect(() => {
+    // Saved stories are searched on the server; debounce so typing doesn't flood the API
+    const term = searchTerm.trim();
+    if (!term) {
+      setSearchResults(null);
+      return;
+    }
+    const timer = setTimeout(async () => {
+      try {
+        const params = { q: term, limit: 100 };
+        if (selectedCategory !== 'All') params.category = selectedCategory;
+        const data = await ApiService.searchStories(params);
+        setSearchResults(data.results);
+      } catch (error) {
+        console.error('Error searching stories:', error);
+      }
+    }, 250);
+    return () => clearTimeout(timer);
+  }, [searchTerm, selectedCategory]);
+
+  const categories = ['All', ...new Set([...completedStories.map(story => story.category), ...savedCategories])];
 
-  const filteredStories = allStories.filter(story => {
-    const searchContent = story.title + ' ' + (story.introduction || story.content || '') + ' ' + (story.middle || '') + ' ' + (story.conclusion || '');
+  const matchesFilters = (story) => {
+    const searchContent = story.title + ' ' + (story.introduction || story.preview || story.content || '') + ' ' + (story.middle || '') + ' ' + (story.conclusion || '');
     const matchesSearch = searchContent.toLowerCase().includes(searchTerm.toLowerCase());
     const matchesCategory = selectedCategory === 'All' || story.category === selectedCategory;
     return matchesSearch && matchesCategory;
-  });
+  };
+
+  const filteredStories = searchResults
+    ? [...completedStories.filter(matchesFilters), ...searchResults]
+    : allStories.filter(matchesFilters);
 
   const getCategoryColor = (category) => {
     const colors = {
@@ -49,6 +84,9 @@ const StoryGallery = ({ stories }) => {
   };
 
   const getStoryPreview = (story) => {
+    if (story.preview) {
+      return story.preview + '...';
+    }
     if (story.introduction) {
       return story.introduction.substring(0, 120) + '...';
     }
@@ -64,6 +102,19 @@ const StoryGallery = ({ stories }) => {
     return (story.content || '').trim().split(/\s+/).length;
   };
 
+  const openStory = async (story) => {
+    setSelectedStory(story);
+    // Summaries from the API carry no section bodies; load the full story on demand
+    if (story._id && !story.introduction && !fullStories[story._id]) {
+      try {
+        const fullStory = await ApiService.getStory(story._id);
+        setFullStories(prev => ({ ...prev, [story._id]: fullStory }));
+      } catch (error) {
+        console.error('Error loading story:', error);
+      }
+    }
+  };
+
   const renderFullStory = (story) => (
     <div className="space-y-6">
       <div className="text-center">
@@ -210,7 +261,7 @@ const StoryGallery = ({ stories }) => {
                 </div>
                 <Dialog>
                   <DialogTrigger asChild>
-                    <Button className="w-full" size="sm" onClick={() => setSelectedStory(story)}>
+                    <Button className="w-full" size="sm" onClick={() => openStory(story)}>
                       <Eye className="h-4 w-4 mr-2" />
                       Read Full Story
                     </Button>
@@ -222,7 +273,7 @@ const StoryGallery = ({ stories }) => {
                         A complete story with proper structure
                       </DialogDescription>
                     </DialogHeader>
-                    {renderFullStory(story)}
+                    {renderFullStory(fullStories[story._id] || story)}
                   </DialogContent>
                 </Dialog>
               </CardContent>
@@ -5,6 +5,26 @@ const API = `${BACKEND_URL}/api`;
 
 // API service for Story Master app
 class ApiService {
+  // Progress and story summaries for the first screen, in one round trip
+  async getBootstrap(params = {}) {
+    try {
+      const response = await axios.get(`${API}/bootstrap`, { params });
+      return response.data;
+    } catch (error) {
+      console.error('Error loading app data:', error);
+      throw error;
+    }
+  }
+
+  // Live story and progress changes; the browser reconnects and resumes on its own
+  subscribeToStoryEvents(handlers) {
+    const source = new EventSource(`${API}/stories/events`);
+    Object.entries(handlers).forEach(([event, handler]) => {
+      source.addEventListener(event, (message) => handler(JSON.parse(message.data)));
+    });
+    return source;
+  }
+
   // User Progress API
   async getProgress() {
     try {
@@ -26,10 +46,21 @@ class ApiService {
     }
   }
 
+  // Statistics API
+  async getStats(params = {}) {
+    try {
+      const response = await axios.get(`${API}/stats`, { params });
+      return response.data;
+    } catch (error) {
+      console.error('Error getting stats:', error);
+      throw error;
+    }
+  }
+
   // Stories API
-  async getStories() {
+  async getStories(params = {}) {
     try {
-      const response = await axios.get(`${API}/stories`);
+      const response = await axios.get(`${API}/stories`, { params });
       return response.data;
     } catch (error) {
       console.error('Error getting stories:', error);
@@ -37,9 +68,21 @@ class ApiService {
     }
   }
 
-  async createStory(storyData) {
+  async searchStories(params) {
     try {
-      const response = await axios.post(`${API}/stories`, storyData);
+      const response = await axios.get(`${API}/stories/search`, { params });
+      return response.data;
+    } catch (error) {
+      console.error('Error searching stories:', error);
+      throw error;
+    }
+  }
+
+  // Repeats with the same idempotencyKey (double-clicks, retries) get the first story back
+  async createStory(storyData, idempotencyKey) {
+    try {
+      const headers = idempotencyKey ? { 'Idempotency-Key': idempotencyKey } : {};
+      const response = await axios.post(`${API}/stories`, storyData, { headers });
       return response.data;
     } catch (error) {
       console.error('Error creating story:', error);
@@ -47,6 +90,47 @@ class ApiService {
     }
   }
 
+  // Drafts API: unfinished stories are autosaved section by section
+  async createDraft(draftData) {
+    try {
+      const response = await axios.post(`${API}/stories/drafts`, draftData);
+      return response.data;
+    } catch (error) {
+      console.error('Error creating draft:', error);
+      throw error;
+    }
+  }
+
+  async listDrafts(params = {}) {
+    try {
+      const response = await axios.get(`${API}/stories/drafts`, { params });
+      return response.data;
+    } catch (error) {
+      console.error('Error listing drafts:', error);
+      throw error;
+    }
+  }
+
+  async patchStory(storyId, changes) {
+    try {
+      const response = await axios.patch(`${API}/stories/${storyId}`, changes);
+      return response.data;
+    } catch (error) {
+      console.error('Error saving draft:', error);
+      throw error;
+    }
+  }
+
+  async finalizeStory(storyId, finalizeData) {
+    try {
+      const response = await axios.post(`${API}/stories/${storyId}/finalize`, finalizeData);
+      return response.data;
+    } catch (error) {
+      console.error('Error finalizing story:', error);
+      throw error;
+    }
+  }
+
   async getStory(storyId) {
     try {
       const response = await axios.get(`${API}/stories/${storyId}`);